@@ -10,14 +10,31 @@ django.setup()
 
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 import api.routing
+from api.auth import CachedAuthMiddlewareStack
+from api.services import prewarm_position_cache, rebuild_leaderboard
+from django.conf import settings
+from django.db import DatabaseError
+
+_cache_settings = getattr(settings, 'RULES_POSITION_CACHE', {})
+if _cache_settings.get('PREWARM_POSITIONS'):
+    try:
+        prewarm_position_cache(_cache_settings['PREWARM_POSITIONS'], _cache_settings.get('PREWARM_GAMES', 1000))
+    except DatabaseError:
+        # Database not migrated yet; the cache simply starts cold
+        pass
+
+try:
+    rebuild_leaderboard()
+except DatabaseError:
+    # Built on the first leaderboard request instead
+    pass
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
+        CachedAuthMiddlewareStack(
             URLRouter(
                 api.routing.websocket_urlpatterns
             )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -95,12 +96,134 @@ CORS_ALLOW_CREDENTIALS = True
 
 AUTH_USER_MODEL = 'api.CustomUser'
 
+# In-memory per worker; workers on the same host share groups through `manage.py channel_hub`
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "api.channel_layer.UnixSocketChannelLayer",
+        "CONFIG": {
+            "path": os.environ.get('CHANNEL_HUB_SOCKET', '/tmp/antichess-channels.sock'),
+        },
     }
 }
 
+# Live games: idle boards are dropped after this many seconds
+GAME_SESSION_IDLE_TIMEOUT = 600
+
+# WebSocket connects reuse the user resolved for a session cookie for TTL seconds
+WS_AUTH_CACHE = {
+    'TTL': 30,
+    'MAX_ENTRIES': 10000,
+}
+
+# Spectators get updates batched per FLUSH_INTERVAL; more than MAX_BATCH queued means a fresh snapshot
+GAME_SPECTATORS = {
+    'FLUSH_INTERVAL': 0.1,
+    'MAX_BATCH': 16,
+}
+
+# The last SIZE moves of each game (up to MAX_GAMES games) are kept for clients that reconnect
+GAME_MOVE_LOG = {
+    'SIZE': 64,
+    'MAX_GAMES': 10000,
+}
+
+# /api/metrics/ (Prometheus text) answers staff, 'Authorization: Bearer <TOKEN>' and requests from
+# ALLOWED_IPS. Behind the reverse proxy every request comes from 127.0.0.1, so prefer the token.
+METRICS = {
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+    'ALLOWED_IPS': [],
+}
+
+# Legal move generator: 'python-chess' or 'bitboard' (api.movegen, same moves, faster)
+RULES_MOVEGEN = 'python-chess'
+
+# LRU cache of legal moves / results per position (FEN without move clocks).
+# At ASGI startup it is warmed with the PREWARM_POSITIONS most frequent positions
+# of the last PREWARM_GAMES finished games.
+RULES_POSITION_CACHE = {
+    'SIZE': 4096,
+    'PREWARM_POSITIONS': 256,
+    'PREWARM_GAMES': 1000,
+}
+
+# Thread pool for rules computations (move validation, legal moves, results)
+RULES_EXECUTOR = {
+    'WORKERS': 4,
+    'MAX_PENDING': 256,
+}
+
+# Matchmaking: Elo band starts at BASE_BAND and widens by BAND_GROWTH per second waited
+MATCHMAKING = {
+    'BASE_BAND': 100,
+    'BAND_GROWTH': 50,
+    'MAX_BAND': 800,
+    'SWEEP_INTERVAL': 1.0,
+}
+
+# Reaping games nobody plays and archiving old ones (see api/lifecycle.py and api/archive.py). ABANDON_AFTER
+# must exceed the longest a clock can run; REAP_INTERVAL 0 leaves reaping to the reap_games command
+GAME_LIFECYCLE = {
+    'ABORT_AFTER': 60,
+    'ABANDON_AFTER': 1800,
+    'REAP_INTERVAL': 60,
+    'ARCHIVE_AFTER_DAYS': 30,
+    'ARCHIVE_BATCH_SIZE': 1000,
+}
+
+# Arena tournaments (see api/arena.py)
+ARENA = {
+    'PAIRING_INTERVAL': 2.0,
+    'WINDOW': 8,
+    'SCORE_WEIGHT': 100,
+    'REMATCH_MEMORY': 3,
+    'STANDINGS_SIZE': 10,
+}
+
+# Leaderboard index is rebuilt from the database at least this often (seconds)
+LEADERBOARD = {
+    'REFRESH_INTERVAL': 300,
+}
+
+# Only the first MAX_PLY plies of each game are counted in the opening explorer
+OPENING_EXPLORER = {
+    'MAX_PLY': 30,
+}
+
+# Post-game analysis, run by `manage.py analyse_games` in its own process
+ANALYSIS = {
+    'ENABLED': True,
+    'DEPTH': 3,
+    'WORKERS': 1,
+    'BATCH_SIZE': 8,
+    'BLUNDER_THRESHOLD': 300,
+    'LEASE_SECONDS': 300,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Built-in engine opponent; it takes anyone still unpaired after MATCH_AFTER seconds
+BOT = {
+    'ENABLED': True,
+    'USERNAME': 'antichess_bot',
+    'MATCH_AFTER': 15,
+    'WORKERS': 2,
+    'MAX_DEPTH': 32,
+}
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('API_LOG_LEVEL', 'INFO')},
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -0,0 +1,148 @@
+"""
+Post-game analysis.
+
+finish_game queues an AnalysisJob in the same transaction that finishes the
+game. The analyse_games worker (a separate process, so analysis never shares
+a CPU queue with live games) claims jobs in batches, replays each game in a
+process pool with every position searched to a fixed depth, and stores one
+MoveEvaluation per ply.
+
+A claim is a lease: the job is marked running with a token and an expiry. If
+the worker dies, the lease runs out and another worker picks the job up again,
+up to MAX_ATTEMPTS times; results are only saved by the worker still holding
+the lease, in one transaction, so a job is never half-stored.
+"""
+import os
+import uuid
+from datetime import timedelta
+
+import chess.variant
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from .engine import analyse
+from .models import AnalysisJob, Game, MoveEvaluation
+
+_settings = getattr(settings, 'ANALYSIS', {})
+DEPTH = _settings.get('DEPTH', 3)
+BLUNDER_THRESHOLD = _settings.get('BLUNDER_THRESHOLD', 300)
+MAX_ATTEMPTS = _settings.get('MAX_ATTEMPTS', 3)
+LEASE_SECONDS = _settings.get('LEASE_SECONDS', 300)
+# Mate scores are capped at this when measuring how much a move lost
+SCORE_CAP = 2000
+
+
+def analyse_game(pgn, depth=DEPTH, blunder_threshold=BLUNDER_THRESHOLD):
+    """
+    Per-ply evaluations for a space-separated SAN movetext. Scores are from
+    the mover's side, before the move (best play) and after the move played;
+    loss is the difference. Touches no database, so it can run in a worker
+    process.
+    """
+    board = chess.variant.AntichessBoard()
+    plies = []
+    for san in pgn.split():
+        try:
+            move = board.parse_san(san)
+        except ValueError:
+            break
+        plies.append((board.fen(), move.uci(), san))
+        board.push(move)
+
+    # One search per position; the score after a move is minus the next position's score
+    scores = [analyse(fen, depth) for fen, _, _ in plies] + [analyse(board.fen(), depth)]
+    evaluations = []
+    for ply, (fen, uci, san) in enumerate(plies, start=1):
+        best, after = scores[ply - 1], scores[ply]
+        played_score = -after['score']
+        loss = max(0, _capped(best['score']) - _capped(played_score))
+        evaluations.append({
+            'ply': ply,
+            'move': uci,
+            'san': san,
+            'best_move': best['move'] or '',
+            'best_score': best['score'],
+            'played_score': played_score,
+            'loss': loss,
+            'blunder': loss >= blunder_threshold,
+        })
+    return evaluations
+
+
+def _capped(score):
+    return max(-SCORE_CAP, min(SCORE_CAP, score))
+
+
+def worker_init():
+    """ProcessPoolExecutor initializer: analysis yields the CPU to everything else."""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+# Queue
+
+def enqueue_finished():
+    """Queue every finished game that has never been queued. Returns the number queued."""
+    unqueued = (
+        Game.objects.filter(status='finished')
+        .filter(~Exists(AnalysisJob.objects.filter(game_id=OuterRef('id'))))
+        .values_list('id', flat=True)
+    )
+    jobs = [AnalysisJob(game_id=game_id) for game_id in unqueued.iterator()]
+    AnalysisJob.objects.bulk_create(jobs, batch_size=1000, ignore_conflicts=True)
+    return len(jobs)
+
+
+def _claimable(now):
+    return Q(status='queued') | Q(status='running', locked_until__lt=now)
+
+
+def claim_jobs(limit, lease=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    Lease up to limit jobs, oldest first. Returns (token, [(job id, game id, pgn)]);
+    jobs whose lease ran out too often are marked failed instead.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        AnalysisJob.objects.filter(_claimable(now), attempts__gte=max_attempts).update(
+            status='failed', error='Gave up after repeated attempts', locked_until=None)
+        ids = list(
+            AnalysisJob.objects.select_for_update(skip_locked=True)
+            .filter(_claimable(now)).order_by('id').values_list('id', flat=True)[:limit]
+        )
+        AnalysisJob.objects.filter(_claimable(now), id__in=ids).update(
+            status='running', token=token, attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=lease))
+    claimed = AnalysisJob.objects.filter(token=token, status='running').values_list('id', 'game_id', 'game__pgn')
+    return token, list(claimed)
+
+
+def save_analysis(job_id, token, evaluations):
+    """Store a job's evaluations and mark it done, if token still holds its lease. Returns True if saved."""
+    with transaction.atomic():
+        job = AnalysisJob.objects.select_for_update().filter(id=job_id, token=token, status='running').first()
+        if job is None:
+            return False
+        MoveEvaluation.objects.filter(game_id=job.game_id).delete()
+        MoveEvaluation.objects.bulk_create([MoveEvaluation(game_id=job.game_id, **row) for row in evaluations])
+        AnalysisJob.objects.filter(id=job_id).update(status='done', finished_at=timezone.now(), locked_until=None,
+                                                     error='')
+    return True
+
+
+def fail_job(job_id, token, error, max_attempts=MAX_ATTEMPTS):
+    """Put a job that raised back in the queue, or mark it failed after max_attempts."""
+    AnalysisJob.objects.filter(id=job_id, token=token, status='running').update(
+        status=Case(When(attempts__gte=max_attempts, then=Value('failed')), default=Value('queued')),
+        locked_until=None, error=str(error)[:1000])
+
+
+def game_analysis(game_id):
+    """Stored evaluations of a game, by ply."""
+    return list(MoveEvaluation.objects.filter(game_id=game_id).order_by('ply').values(
+        'ply', 'move', 'san', 'best_move', 'best_score', 'played_score', 'loss', 'blunder'))
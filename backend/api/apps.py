@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from .rules import position_cache, set_movegen
+        set_movegen(getattr(settings, 'RULES_MOVEGEN', 'python-chess'))
+        position_cache.resize(getattr(settings, 'RULES_POSITION_CACHE', {}).get('SIZE', 4096))
+
+        from django.contrib.auth.signals import user_logged_out
+        from django.db.models.signals import post_save
+        from .auth import forget_logged_out_session, forget_saved_user
+        user_logged_out.connect(forget_logged_out_session, dispatch_uid='ws_auth_cache_logout')
+        post_save.connect(forget_saved_user, sender=self.get_model('CustomUser'), dispatch_uid='ws_auth_cache_user')
+
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_counter
+        connection_created.connect(install_query_counter, dispatch_uid='metrics_query_counter')
@@ -0,0 +1,136 @@
+"""
+Archival of old finished games.
+
+The live paths all query Game, so it should hold only games in play and
+recent history. archive_batch() moves finished games older than
+ARCHIVE_AFTER_DAYS into ArchivedGame, keeping their ids: moves are packed two
+bytes each and any analysis eleven bytes per ply, and their MoveEvaluation and
+AnalysisJob rows are deleted with them. Games still waiting for analysis or
+for the opening explorer stay until they are done. Aborted games that old are
+simply deleted. History, PGN export, analysis and recompute_ratings read both
+tables.
+"""
+import struct
+from collections import defaultdict
+from datetime import timedelta
+
+import chess
+import chess.variant
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .analysis import SCORE_CAP
+from .models import AnalysisJob, ArchivedGame, Game, MoveEvaluation
+from .wire import decode_move, encode_move
+
+_settings = getattr(settings, 'GAME_LIFECYCLE', {})
+ARCHIVE_AFTER_DAYS = _settings.get('ARCHIVE_AFTER_DAYS', 30)
+ARCHIVE_BATCH_SIZE = _settings.get('ARCHIVE_BATCH_SIZE', 1000)
+
+# best move (0 if none), best score, played score, blunder
+EVALUATION = struct.Struct('>HiiB')
+ARCHIVE_FIELDS = (
+    'id', 'white_player_id', 'black_player_id', 'winner_id', 'cadence', 'created_at', 'finished_at',
+    'white_elo', 'black_elo', 'tournament_id', 'pgn',
+)
+
+
+def pack_moves(pgn):
+    """A space-separated SAN movetext as two bytes per move."""
+    board = chess.variant.AntichessBoard()
+    codes = []
+    for san in pgn.split():
+        try:
+            move = board.parse_san(san)
+        except ValueError:
+            break
+        codes.append(encode_move(move.uci()))
+        board.push(move)
+    return struct.pack(f'>{len(codes)}H', *codes)
+
+
+def unpack_moves(data):
+    """[(uci, san)] from pack_moves() bytes."""
+    data = bytes(data)
+    board = chess.variant.AntichessBoard()
+    moves = []
+    for code in struct.unpack(f'>{len(data) // 2}H', data):
+        move = chess.Move.from_uci(decode_move(code))
+        moves.append((move.uci(), board.san(move)))
+        board.push(move)
+    return moves
+
+
+def archived_pgn(data):
+    return ' '.join(san for _, san in unpack_moves(data))
+
+
+def pack_evaluations(rows):
+    """MoveEvaluation values() rows, in ply order, as EVALUATION records."""
+    return b''.join(
+        EVALUATION.pack(encode_move(row['best_move']) if row['best_move'] else 0, row['best_score'],
+                        row['played_score'], row['blunder'])
+        for row in rows
+    )
+
+
+def unpack_evaluations(data, moves):
+    """The analysis.game_analysis() rows of an archived game, given its unpack_moves()."""
+    evaluations = []
+    for ply, ((uci, san), (best, best_score, played_score, blunder)) in enumerate(
+            zip(moves, EVALUATION.iter_unpack(bytes(data))), start=1):
+        capped = [max(-SCORE_CAP, min(SCORE_CAP, score)) for score in (best_score, played_score)]
+        evaluations.append({
+            'ply': ply,
+            'move': uci,
+            'san': san,
+            'best_move': decode_move(best) if best else '',
+            'best_score': best_score,
+            'played_score': played_score,
+            'loss': max(0, capped[0] - capped[1]),
+            'blunder': bool(blunder),
+        })
+    return evaluations
+
+
+def archive_batch(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move up to batch_size games that finished before `before` into ArchivedGame,
+    oldest ids first. Returns the number moved; 0 means nothing is left to do.
+    """
+    unfinished_analysis = AnalysisJob.objects.filter(game_id=OuterRef('id'), status__in=('queued', 'running'))
+    ids = list(
+        Game.objects.filter(status='finished', finished_at__lt=before, in_explorer=True)
+        .filter(~Exists(unfinished_analysis)).order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+
+    evaluations = defaultdict(list)
+    for row in (MoveEvaluation.objects.filter(game_id__in=ids).order_by('game_id', 'ply')
+                .values('game_id', 'best_move', 'best_score', 'played_score', 'blunder')):
+        evaluations[row['game_id']].append(row)
+    archived = []
+    for row in Game.objects.filter(id__in=ids).values(*ARCHIVE_FIELDS):
+        pgn = row.pop('pgn')
+        archived.append(ArchivedGame(
+            **row, moves=pack_moves(pgn),
+            evaluations=pack_evaluations(evaluations[row['id']]) if row['id'] in evaluations else None,
+        ))
+
+    with transaction.atomic():
+        ArchivedGame.objects.bulk_create(archived, ignore_conflicts=True)
+        # Takes the game's analysis job and evaluations with it
+        Game.objects.filter(id__in=ids, status='finished').delete()
+    return len(ids)
+
+
+def delete_aborted(before):
+    """Delete games aborted before `before`. Returns the number deleted."""
+    return Game.objects.filter(status='aborted', finished_at__lt=before).delete()[1].get('api.Game', 0)
+
+
+def archive_cutoff(now=None, days=ARCHIVE_AFTER_DAYS):
+    return (timezone.now() if now is None else now) - timedelta(days=days)
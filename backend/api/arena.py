@@ -0,0 +1,227 @@
+"""
+Arena tournaments.
+
+An arena runs for a fixed time at one cadence. Players who are connected and
+not in a game wait in the arena's pool; every pairing round (a sweep every
+PAIRING_INTERVAL seconds) pairs the whole pool at once, so a player who
+finishes a game is playing again within one interval.
+
+A round sorts the pool by score, then rating, and pairs each player with the
+cheapest of the next WINDOW unpaired players, where the cost is the rating gap
+plus SCORE_WEIGHT per point of score gap, plus REMATCH_PENALTY if they met in
+either player's last REMATCH_MEMORY games. Two players never meet twice in a
+row: someone who finds only their last opponent waits for the next round.
+That is one sort and a bounded scan per player, a few milliseconds for
+thousands of players.
+
+Scoring follows the usual arena rules: a win is 2 points and a draw 1; after
+STREAK wins in a row every result is worth double until the streak breaks.
+Scores live in TournamentPlayer (updated by finish_game); each Arena keeps a
+copy in a Leaderboard for the live standings, updated one player at a time.
+Game results reach the Arena through the arena's channel group, since the
+game may have ended in another worker.
+"""
+import collections
+import itertools
+import threading
+
+from .leaderboard import Leaderboard
+
+WIN_POINTS = 2
+DRAW_POINTS = 1
+STREAK = 2
+MAX_SCORE = 10000
+# Finished games remembered to drop repeated deliveries of their results
+RESULTS_MEMORY = 4096
+
+
+def award(score, streak):
+    """Points for a result (1, 0.5, 0) after streak wins in a row. Returns (points, new streak)."""
+    multiplier = 2 if streak >= STREAK else 1
+    if score == 1:
+        return WIN_POINTS * multiplier, streak + 1
+    if score == 0.5:
+        return DRAW_POINTS * multiplier, 0
+    return 0, 0
+
+
+class ArenaPlayer:
+    __slots__ = ('user_id', 'rating', 'score', 'channel_name', 'playing', 'seq', 'recent', 'colour')
+
+    def __init__(self, user_id, rating, score, rematch_memory):
+        self.user_id = user_id
+        self.rating = rating
+        self.score = score
+        self.channel_name = None  # None while paused or disconnected
+        self.playing = False
+        self.seq = 0
+        self.recent = collections.deque(maxlen=rematch_memory)
+        # Games as White minus games as Black
+        self.colour = 0
+
+
+class Arena:
+    """
+    Pool, pairing and standings of one tournament in this process.
+    All changes happen under one lock, so a player is paired at most once.
+    """
+    def __init__(self, tournament_id, cadence, starts_at, ends_at, window=8, score_weight=100,
+                 rematch_penalty=10000, rematch_memory=3):
+        self.tournament_id = tournament_id
+        self.cadence = cadence
+        self.starts_at = starts_at
+        self.ends_at = ends_at
+        self.window = window
+        self.score_weight = score_weight
+        self.rematch_penalty = rematch_penalty
+        self.rematch_memory = rematch_memory
+        self.standings = Leaderboard(min_elo=0, max_elo=MAX_SCORE)
+        # Set when a score changes, cleared by whoever pushes the standings out
+        self.standings_changed = False
+        self._players = {}  # user_id -> ArenaPlayer
+        self._pool = {}     # user_id -> ArenaPlayer, waiting for a game
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # Games whose results were applied; every consumer in the arena's group relays them
+        self._results_seen = set()
+        self._results_order = collections.deque()
+
+    def load(self, rows):
+        """Scores from (user_id, score) rows, e.g. after a restart."""
+        with self._lock:
+            for user_id, score in rows:
+                self._player(user_id, 0).score = score
+            self.standings.load((player.user_id, player.score) for player in self._players.values())
+
+    def join(self, user_id, rating, score, channel_name):
+        """
+        Enter (or come back to) the arena on channel_name. The player waits in the
+        pool unless they are still playing, in which case they rejoin it after the game.
+        """
+        with self._lock:
+            player = self._player(user_id, rating)
+            player.rating = rating
+            player.score = score
+            player.channel_name = channel_name
+            if self.standings.rank(user_id) is None:
+                self.standings.update(user_id, score)
+                self.standings_changed = True
+            if not player.playing:
+                self._wait(player)
+
+    def leave(self, user_id):
+        """Pause: stop being paired. Returns True if the player was waiting."""
+        with self._lock:
+            player = self._players.get(user_id)
+            if player is None:
+                return False
+            player.channel_name = None
+            return self._pool.pop(user_id, None) is not None
+
+    def finished(self, user_id, score, rating=None):
+        """
+        A game of user_id's ended with their tournament score now at score (None
+        if it didn't change, e.g. an aborted game); back to the pool if still here.
+        """
+        with self._lock:
+            player = self._players.get(user_id)
+            if player is None:
+                return
+            player.playing = False
+            if rating is not None:
+                player.rating = rating
+            if score is not None:
+                player.score = score
+                self.standings.update(user_id, score)
+                self.standings_changed = True
+            if player.channel_name is not None:
+                self._wait(player)
+
+    def game_finished(self, game_id, scores, ratings):
+        """
+        finished() for every player in scores ({user_id: score or None}) once per
+        game, however many times the result is delivered. Returns False for repeats.
+        """
+        with self._lock:
+            if game_id in self._results_seen:
+                return False
+            self._results_seen.add(game_id)
+            self._results_order.append(game_id)
+            if len(self._results_order) > RESULTS_MEMORY:
+                self._results_seen.discard(self._results_order.popleft())
+        for user_id, score in scores.items():
+            self.finished(user_id, score, ratings.get(user_id))
+        return True
+
+    def waiting(self):
+        with self._lock:
+            return len(self._pool)
+
+    def channel(self, user_id):
+        player = self._players.get(user_id)
+        return None if player is None else player.channel_name
+
+    def pair(self):
+        """
+        One pairing round over the whole pool. Returns [(white, black)] players;
+        both are marked playing. With an odd pool the latest arrival waits, as
+        does anyone left with only their last opponent.
+        """
+        with self._lock:
+            pool = sorted(self._pool.values(), key=lambda p: (-p.score, -p.rating, p.seq))
+            if len(pool) < 2:
+                return []
+            if len(pool) % 2:
+                pool.remove(max(pool, key=lambda p: p.seq))
+
+            pairs = []
+            taken = [False] * len(pool)
+            for i, player in enumerate(pool):
+                if taken[i]:
+                    continue
+                best, best_cost = None, None
+                j, seen = i + 1, 0
+                while j < len(pool) and seen < self.window:
+                    if not taken[j] and not self._last_opponents(player, pool[j]):
+                        cost = self._cost(player, pool[j])
+                        if best_cost is None or cost < best_cost:
+                            best, best_cost = j, cost
+                        seen += 1
+                    j += 1
+                if best is None:
+                    continue
+                taken[i] = taken[best] = True
+                pairs.append(self._start(player, pool[best]))
+            return pairs
+
+    @staticmethod
+    def _last_opponents(a, b):
+        return bool(a.recent) and a.recent[-1] == b.user_id
+
+    def _cost(self, a, b):
+        cost = abs(a.rating - b.rating) + self.score_weight * abs(a.score - b.score)
+        if b.user_id in a.recent or a.user_id in b.recent:
+            cost += self.rematch_penalty
+        return cost
+
+    def _start(self, a, b):
+        # White goes to whoever has had it less, then to the longer waiter
+        white, black = (a, b) if (a.colour, a.seq) <= (b.colour, b.seq) else (b, a)
+        white.colour += 1
+        black.colour -= 1
+        for player, opponent in ((white, black), (black, white)):
+            player.playing = True
+            player.recent.append(opponent.user_id)
+            del self._pool[player.user_id]
+        return white, black
+
+    def _player(self, user_id, rating):
+        player = self._players.get(user_id)
+        if player is None:
+            player = self._players[user_id] = ArenaPlayer(user_id, rating, 0, self.rematch_memory)
+        return player
+
+    def _wait(self, player):
+        if player.user_id not in self._pool:
+            player.seq = next(self._seq)
+            self._pool[player.user_id] = player
@@ -0,0 +1,118 @@
+"""
+WebSocket authentication with a short-lived session -> user cache.
+
+channels' AuthMiddleware loads the session row and then the user row on every
+connect. CachedAuthMiddleware remembers the result per session key for a few
+seconds, and concurrent connects with the same cookie share one lookup, so a
+reconnect storm costs one pair of queries per player instead of one per socket.
+Entries are dropped on logout (user_logged_out) and whenever the user row is
+saved, which covers password changes; other processes catch up within the TTL.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from channels.auth import AuthMiddleware, get_user
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+
+
+class UserCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # session key -> (expires, user)
+        self._by_user = {}             # user id -> session keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._drop(session_key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, session_key, user, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._drop(session_key)
+            self._entries[session_key] = (now + self.ttl, user)
+            self._by_user.setdefault(user.pk, set()).add(session_key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, session_key):
+        with self._lock:
+            self._drop(session_key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for session_key in list(self._by_user.get(user_id, ())):
+                self._drop(session_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, session_key):
+        entry = self._entries.pop(session_key, None)
+        if entry is None:
+            return
+        keys = self._by_user.get(entry[1].pk)
+        if keys is not None:
+            keys.discard(session_key)
+            if not keys:
+                del self._by_user[entry[1].pk]
+
+
+_cache_settings = getattr(settings, 'WS_AUTH_CACHE', {})
+user_cache = UserCache(ttl=_cache_settings.get('TTL', 30), max_entries=_cache_settings.get('MAX_ENTRIES', 10000))
+_pending = {}  # session key -> lookup in progress
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    async def resolve_scope(self, scope):
+        session_key = scope['session'].session_key
+        if not session_key:
+            scope['user']._wrapped = await get_user(scope)
+            return
+
+        user = user_cache.get(session_key)
+        if user is None:
+            lookup = _pending.get(session_key)
+            if lookup is None:
+                lookup = _pending[session_key] = asyncio.ensure_future(get_user(scope))
+                lookup.add_done_callback(lambda _: _pending.pop(session_key, None))
+            user = await asyncio.shield(lookup)
+            # Anonymous results aren't cached: the cookie may log in any moment
+            if user.is_authenticated:
+                user_cache.set(session_key, user)
+        scope['user']._wrapped = user
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
+
+
+def forget_logged_out_session(sender, request, user, **kwargs):
+    if request is not None and request.session.session_key:
+        user_cache.invalidate(request.session.session_key)
+    if user is not None:
+        user_cache.invalidate_user(user.pk)
+
+
+def forget_saved_user(sender, instance, **kwargs):
+    # Password (and any other) changes take effect on the next connect
+    user_cache.invalidate_user(instance.pk)
@@ -0,0 +1,283 @@
+"""
+Channel layer for running several ASGI workers on one host without Redis.
+
+Every worker keeps its channels and group memberships in memory, exactly like
+InMemoryChannelLayer, and connects to a small hub (ChannelHub, started with
+`manage.py channel_hub`) over a unix domain socket. The hub only knows which
+workers have members in which group, and forwards two things:
+
+- send() to a process-specific channel owned by another worker
+- group_send() to a group that also has members on other workers, or that
+  has none in the sending worker (e.g. a game ending in one worker tells the
+  arena's group in another)
+
+The hub tells each worker which other workers share its groups, so a group
+whose members all live in one process (the normal case when the load balancer
+routes by game id) never leaves that process. If the hub isn't running, the
+layer degrades to plain in-memory behaviour and keeps retrying in the background.
+"""
+import asyncio
+import contextlib
+import marshal
+import os
+import secrets
+import struct
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+_HEADER = struct.Struct('!I')
+
+
+def _pack(frame):
+    payload = marshal.dumps(frame)
+    return _HEADER.pack(len(payload)) + payload
+
+
+async def _read_frame(reader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return marshal.loads(await reader.readexactly(size))
+
+
+def channel_worker(channel):
+    """The worker that owns a process-specific channel name, or None."""
+    if '!' not in channel:
+        return None
+    return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+
+class UnixSocketChannelLayer(InMemoryChannelLayer):
+    def __init__(self, path='/tmp/antichess-channels.sock', reconnect_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.reconnect_interval = reconnect_interval
+        self.worker = 'w' + secrets.token_hex(6)
+        self.remote = {}        # group -> workers (other than us) with members in it
+        self.forwarded = 0      # messages handed to the hub
+        self._loop = None
+        self._writer = None
+        self._reader_task = None
+        self._connecting = None
+        self._retry_at = 0.0
+        self._cleaned_at = 0.0
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        await self._connect()
+        return f'{prefix}{self.worker}!{secrets.token_hex(6)}'
+
+    async def send(self, channel, message):
+        owner = channel_worker(channel)
+        if owner is None or owner == self.worker:
+            return await super().send(channel, message)
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._forward(('send', channel, message))
+
+    async def group_add(self, group, channel):
+        first = group not in self.groups
+        await super().group_add(group, channel)
+        if first and await self._connect():
+            await self._write(('join', group))
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        if group not in self.groups:
+            self.remote.pop(group, None)
+            if self._writer is not None:
+                await self._write(('leave', group))
+
+    async def group_send(self, group, message):
+        await super().group_send(group, message)
+        # Without members here we don't know where the group lives; the hub does
+        if group not in self.groups or self.remote.get(group):
+            await self._forward(('group', group, message))
+
+    async def flush(self):
+        await super().flush()
+        self.remote = {}
+
+    def _clean_expired(self):
+        # The in-memory layer scans every channel and group on each send and
+        # receive; once a second is plenty for a 60 second expiry
+        now = time.monotonic()
+        if now - self._cleaned_at >= 1.0:
+            self._cleaned_at = now
+            super()._clean_expired()
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        writer, self._writer, self._reader_task = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    # Hub connection
+
+    async def _connect(self):
+        """Connected writer, or None while the hub is unreachable."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections belong to the loop that opened them
+            self._loop = loop
+            self._writer = self._reader_task = self._connecting = None
+            self.remote = {}
+            self._retry_at = 0.0
+        if self._writer is not None or loop.time() < self._retry_at:
+            return self._writer
+        if self._connecting is None:
+            self._connecting = loop.create_task(self._open())
+        try:
+            return await asyncio.shield(self._connecting)
+        finally:
+            self._connecting = None
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            self._retry_at = loop.time() + self.reconnect_interval
+            return None
+        # Re-announce memberships made while disconnected
+        writer.write(_pack(('hello', self.worker)))
+        for group in self.groups:
+            writer.write(_pack(('join', group)))
+        await writer.drain()
+        self._writer = writer
+        self._reader_task = loop.create_task(self._read(reader, writer))
+        return writer
+
+    async def _read(self, reader, writer):
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                op = frame[0]
+                if op == 'members':
+                    _, group, workers = frame
+                    if workers and group in self.groups:
+                        self.remote[group] = set(workers)
+                    else:
+                        self.remote.pop(group, None)
+                elif op == 'send':
+                    _, channel, message = frame
+                    with contextlib.suppress(ChannelFull):
+                        await super().send(channel, message)
+                elif op == 'group':
+                    _, group, message = frame
+                    if group in self.groups:
+                        await super().group_send(group, message)
+                    else:
+                        # Our last member expired without a discard
+                        await self._write(('leave', group))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+                self.remote = {}
+                self._retry_at = asyncio.get_running_loop().time() + self.reconnect_interval
+
+    async def _forward(self, frame):
+        if await self._connect() is None:
+            return
+        self.forwarded += 1
+        await self._write(frame)
+
+    async def _write(self, frame):
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            return
+        try:
+            writer.write(_pack(frame))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+class ChannelHub:
+    """
+    Routes messages between UnixSocketChannelLayer workers on one host.
+    Holds no channels of its own, only which workers have members in each group.
+    """
+    def __init__(self, path='/tmp/antichess-channels.sock'):
+        self.path = path
+        self.workers = {}   # worker -> StreamWriter
+        self.groups = {}    # group -> set of workers
+        self.routed = 0
+
+    async def start(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        # Only processes running as this user may join
+        os.chmod(self.path, 0o600)
+        return server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        worker = None
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                op = frame[0]
+                if op == 'hello':
+                    worker = frame[1]
+                    self.workers[worker] = writer
+                elif op == 'join':
+                    self.groups.setdefault(frame[1], set()).add(worker)
+                    await self._announce(frame[1])
+                elif op == 'leave':
+                    members = self.groups.get(frame[1])
+                    if members and worker in members:
+                        members.discard(worker)
+                        if not members:
+                            del self.groups[frame[1]]
+                        await self._announce(frame[1])
+                elif op == 'send':
+                    target = self.workers.get(channel_worker(frame[1]))
+                    if target is not None:
+                        await self._send(target, frame)
+                elif op == 'group':
+                    for member in list(self.groups.get(frame[1], ())):
+                        target = self.workers.get(member)
+                        if member != worker and target is not None:
+                            await self._send(target, frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if worker is not None and self.workers.get(worker) is writer:
+                del self.workers[worker]
+                for group, members in list(self.groups.items()):
+                    if worker in members:
+                        members.discard(worker)
+                        if not members:
+                            del self.groups[group]
+                        await self._announce(group)
+            writer.close()
+
+    async def _announce(self, group):
+        """Tell every worker in group which other workers are in it too."""
+        members = set(self.groups.get(group, ()))
+        for member in members:
+            target = self.workers.get(member)
+            if target is not None:
+                await self._send(target, ('members', group, sorted(members - {member})))
+
+    async def _send(self, writer, frame):
+        if writer.is_closing():
+            return
+        self.routed += 1
+        try:
+            writer.write(_pack(frame))
+            await writer.drain()
+        except ConnectionError:
+            pass
@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+def parse_cadence(cadence):
+    """'2+1' -> (120.0, 1.0): base time and increment in seconds."""
+    minutes, increment = cadence.split('+')
+    return float(minutes) * 60, float(increment)
+
+
+class GameClock:
+    """
+    Authoritative clock for one game.
+    Nothing runs until White's first move; after that the side to move is charged
+    from the moment the previous move was accepted.
+    """
+    def __init__(self, base, increment):
+        self.increment = increment
+        self.remaining = {'white': base, 'black': base}
+        self.turn = 'white'
+        self.running_since = None
+
+    @classmethod
+    def for_cadence(cls, cadence):
+        return cls(*parse_cadence(cadence))
+
+    def time_left(self, color, now=None):
+        left = self.remaining[color]
+        if color == self.turn and self.running_since is not None:
+            now = time.monotonic() if now is None else now
+            left -= now - self.running_since
+        return left
+
+    def flagged(self, now=None):
+        """True if the side to move has run out of time."""
+        return self.time_left(self.turn, now) <= 0
+
+    def press(self, now=None):
+        """
+        Stop the mover's clock after an accepted move, add the increment and start the opponent's.
+        Returns False (and changes nothing) if the mover had already flagged.
+        """
+        now = time.monotonic() if now is None else now
+        left = self.time_left(self.turn, now)
+        if left <= 0:
+            return False
+        self.remaining[self.turn] = left + self.increment
+        self.turn = 'black' if self.turn == 'white' else 'white'
+        self.running_since = now
+        return True
+
+    def deadline(self):
+        """Monotonic time at which the side to move flags, or None while stopped."""
+        if self.running_since is None:
+            return None
+        return self.running_since + self.remaining[self.turn]
+
+    def snapshot(self, now=None):
+        """Remaining milliseconds per side, for broadcasting."""
+        now = time.monotonic() if now is None else now
+        return {
+            'white': max(0, round(self.time_left('white', now) * 1000)),
+            'black': max(0, round(self.time_left('black', now) * 1000)),
+            'turn': self.turn,
+            'running': self.running_since is not None,
+        }
+
+
+class TimeoutScheduler:
+    """
+    One asyncio task watching the flag deadlines of every active game.
+    Deadlines live in a heap; rescheduling or cancelling a game just invalidates its
+    old entry, which is discarded when it reaches the top.
+    on_timeout(game_id) is awaited in a new task when a deadline passes.
+    """
+    def __init__(self, on_timeout):
+        self.on_timeout = on_timeout
+        self._heap = []
+        self._tokens = {}  # game_id -> token of its live heap entry
+        self._counter = itertools.count()
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+
+    def schedule(self, game_id, deadline):
+        token = next(self._counter)
+        self._tokens[game_id] = token
+        heapq.heappush(self._heap, (deadline, token, game_id))
+        if len(self._heap) > 2 * len(self._tokens) + 1024:
+            self._compact()
+        self._ensure_running()
+        if self._heap[0][1] == token:
+            # New earliest deadline: wake the task so it doesn't oversleep
+            self._wakeup.set()
+
+    def cancel(self, game_id):
+        self._tokens.pop(game_id, None)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._tokens.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = None
+            while self._heap:
+                deadline, token, game_id = self._heap[0]
+                if self._tokens.get(game_id) != token:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    break
+                heapq.heappop(self._heap)
+                del self._tokens[game_id]
+                self._loop.create_task(self.on_timeout(game_id))
+                delay = None
+
+            if not self._heap:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -1,21 +1,433 @@
+import asyncio
 import json
+import logging
+import random
+import time
+import weakref
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.utils import timezone
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
 from .models import Game, Profile, CustomUser
-from .rules import make_move, is_game_over, get_game_result, get_initial_fen, calculate_elo, get_legal_moves
+from .clocks import GameClock, TimeoutScheduler
+from .engine import BotEngine, think_time
+from .executor import RulesExecutor, RulesQueueFull
+from .explorer import game_positions
+from .matchmaking import MatchmakingEngine
+from .metrics import COUNT_BUCKETS, count_queries, registry
+from .lifecycle import purge_waiting, reap_game, stale_games
+from .movelog import MoveLog
+from .profiler import profiler
+from .rules import get_initial_fen, get_legal_moves, fen_ply, SessionRegistry
+from . import wire
 from .serializers import GameSerializer
+from .services import (
+    arenas, enter_tournament, finish_game, get_bot_user, live_standings, open_arena, tournament_standings,
+)
+
+logger = logging.getLogger(__name__)
+
+# Scraped from /api/metrics/; the gauges are read from the objects below at scrape time
+command_seconds = registry.histogram(
+    'antichess_ws_command_seconds', 'Time to handle a WebSocket command', labels=('consumer', 'command'))
+move_queries = registry.histogram(
+    'antichess_move_db_queries', 'Database queries made to apply one move', buckets=COUNT_BUCKETS)
+rules_seconds = registry.histogram(
+    'antichess_rules_call_seconds', 'Run time of rules calls, queueing excluded', labels=('function',))
+rules_rejected = registry.counter('antichess_rules_rejected_total', 'Moves refused because the rules queue was full')
+errors = registry.counter('antichess_errors_total', 'Unhandled errors, by where they were caught', labels=('where',))
+pairing_seconds = registry.histogram('antichess_arena_pairing_seconds', 'Time to pair one arena pool')
+open_sockets = registry.gauge('antichess_open_sockets', 'Open WebSocket connections', labels=('consumer',))
+registry.gauge('antichess_active_games', 'Games with a live board in this process', function=lambda: len(sessions))
+registry.gauge('antichess_rules_queue_depth', 'Rules calls queued or running', function=lambda: rules_executor.pending)
+registry.gauge('antichess_bot_queue_depth', 'Bot searches queued or running', function=lambda: bot_engine.pending)
+registry.gauge('antichess_matchmaking_waiting', 'Players waiting for an opponent', function=lambda: matchmaking.waiting())
+registry.gauge('antichess_arena_waiting', 'Arena players waiting to be paired',
+               function=lambda: sum(arena.waiting() for arena in list(arenas.values())))
+
+# One live board per active game, shared by every consumer in this process
+sessions = SessionRegistry(idle_timeout=getattr(settings, 'GAME_SESSION_IDLE_TIMEOUT', 600))
+
+# Rules computations run here, not on the thread-sensitive DB executor
+_executor_settings = getattr(settings, 'RULES_EXECUTOR', {})
+rules_executor = RulesExecutor(
+    workers=_executor_settings.get('WORKERS', 4),
+    max_pending=_executor_settings.get('MAX_PENDING', 256),
+    observe=rules_seconds.observe,
+)
+
+# Recent move_applied messages per game, replayed to clients that reconnect
+_move_log_settings = getattr(settings, 'GAME_MOVE_LOG', {})
+move_log = MoveLog(
+    size=_move_log_settings.get('SIZE', 64),
+    max_games=_move_log_settings.get('MAX_GAMES', 10000),
+)
+
+async def broadcast(game_id, message_type, payload):
+    """
+    Send one message to everyone in a game room. It is encoded here, once per
+    wire format, and every consumer forwards the encoding its client asked for
+    instead of re-encoding it. Returns (text, bytes).
+    """
+    message = {'type': message_type, **payload}
+    text, data = json.dumps(message), wire.encode(message)
+    await get_channel_layer().group_send(f'game_{game_id}', {
+        'type': message_type,
+        'text': text,
+        'bytes': data,
+    })
+    return text, data
+
+
+# Moves, timeouts and the reaper handle one game at a time, from reading the row to the broadcast
+_move_locks = weakref.WeakValueDictionary()
+
+
+def move_lock(game_id):
+    key = str(game_id)
+    lock = _move_locks.get(key)
+    if lock is None:
+        lock = _move_locks[key] = asyncio.Lock()
+    return lock
+
+
+async def replay_positions(pgn):
+    """
+    The opening explorer's positions of pgn for finish_game, replayed on the rules
+    pool; None (finish_game replays them itself) if the pool is full.
+    """
+    try:
+        return await rules_executor.run(game_positions, pgn)
+    except RulesQueueFull:
+        return None
+
+
+async def handle_timeout(game_id):
+    """Called by the timeout scheduler when the side to move may have run out of time."""
+    async with move_lock(game_id):
+        await _handle_timeout(game_id)
+
+
+async def _handle_timeout(game_id):
+    # Also called by a late move, which already holds the game's move lock
+    session = sessions.peek(game_id)
+    if session is None or session.clock is None:
+        return
+    if not session.clock.flagged():
+        # A move got in first; its deadline has been rescheduled
+        return
+
+    # Flagging loses, whatever the material
+    clock = session.clock
+    result = '0-1' if clock.turn == 'white' else '1-0'
+    sessions.evict(game_id)
+    timeouts.cancel(game_id)
+    # No move carries this result, so reconnecting clients need the full state
+    move_log.discard(game_id)
+    game = await get_game(game_id)
+    if game.status != 'active':
+        return
+    positions = await replay_positions(game.pgn)
+    if await database_sync_to_async(finish_game)(game, result, positions) is None:
+        return
+
+    await broadcast(game_id, 'game_finished', {
+        'status': game.status,
+        'result': result,
+        'winner': game.winner_id,
+        'reason': 'timeout',
+        'clock': clock.snapshot(),
+    })
+
+async def timeout_fired(game_id):
+    try:
+        await handle_timeout(game_id)
+    except Exception:
+        errors.inc('handle_timeout')
+        logger.exception('Error in handle_timeout for game %s', game_id)
+
+# Flag detection for every active game in this process
+timeouts = TimeoutScheduler(timeout_fired)
+
+
+@database_sync_to_async
+def get_game(game_id):
+    return Game.objects.select_related('white_player', 'black_player').get(id=game_id)
+
+
+@database_sync_to_async
+def save_move(game):
+    """Save the position after a move, unless the game has ended meanwhile. Returns True if saved."""
+    return Game.objects.filter(id=game.id, status='active').update(
+        fen=game.fen, pgn=game.pgn, last_move_at=game.last_move_at) == 1
+
+
+async def apply_move(game_id, player_id, move_uci):
+    """
+    Play move_uci for player_id in game_id: validate it on the live board, save it
+    and broadcast it to the game group. Returns an error message for the mover, or None.
+    """
+    with count_queries() as queries:
+        async with move_lock(game_id):
+            error = await _apply_move(game_id, player_id, move_uci)
+    move_queries.observe(queries.count)
+    return error
+
+
+async def _apply_move(game_id, player_id, move_uci):
+    # 1. Get Game
+    game = await get_game(game_id)
+
+    if game.status != 'active':
+        return 'Game is not active'
+
+    # 2. Validate Turn
+    active_color = game.fen.split(' ')[1] # 'w' or 'b'
+    is_white_turn = (active_color == 'w')
+
+    if is_white_turn:
+        if game.white_player_id != player_id:
+            logger.warning("Invalid turn: user %s tried to move on White's turn in game %s", player_id, game_id)
+            return None
+    else:
+        if game.black_player_id != player_id:
+            logger.warning("Invalid turn: user %s tried to move on Black's turn in game %s", player_id, game_id)
+            return None
+
+    # 3. Apply Move on the live board, unless the mover's flag has already fallen
+    now = time.monotonic()
+    session = sessions.get(game_id, game.fen)
+    if session.clock is None:
+        session.clock = GameClock.for_cadence(game.cadence)
+    if session.clock.flagged(now):
+        await _handle_timeout(game.id)
+        return None
+
+    try:
+        new_fen, san, error, result_str, legal_moves = await rules_executor.run(session.apply, move_uci)
+    except RulesQueueFull:
+        rules_rejected.inc()
+        error = "Server busy, please retry"
+
+    if error:
+        return error
+
+    # 4. Update Game
+    game.fen = new_fen
+    if game.pgn:
+        game.pgn += f" {san}"
+    else:
+        game.pgn = san
+
+    session.clock.press(now)
+    try:
+        if result_str:
+            # Game row and both profiles in one transaction
+            sessions.evict(game_id)
+            timeouts.cancel(game.id)
+            positions = await replay_positions(game.pgn)
+            if await database_sync_to_async(finish_game)(game, result_str, positions) is None:
+                return 'Game is not active'
+        else:
+            game.last_move_at = timezone.now()
+            if not await save_move(game):
+                # Ended elsewhere (e.g. by another process's reaper) while the move was checked
+                sessions.evict(game_id)
+                timeouts.cancel(game.id)
+                return 'Game is not active'
+            timeouts.schedule(game.id, session.clock.deadline())
+    except Exception:
+        # The live board holds a move the database doesn't; the next move starts again from the saved one
+        sessions.evict(game_id)
+        raise
+
+    # 5. Broadcast the move only; clients apply it to the state they already have
+    encoded = await broadcast(game_id, 'move_applied', {
+        'ply': session.ply,
+        'uci': move_uci,
+        'san': san,
+        'fen': new_fen,
+        'legal_moves': legal_moves,
+        'status': game.status,
+        'result': result_str,
+        'winner': game.winner_id,
+        'clock': session.clock.snapshot(now),
+    })
+    move_log.append(game_id, session.ply, encoded)
+
+    if not result_str:
+        to_move = game.black_player if is_white_turn else game.white_player
+        if to_move is not None and to_move.is_bot:
+            schedule_bot_move(game.id, to_move.id, game.cadence)
+    return None
+
+
+# Ends games nobody is playing any more (see lifecycle.py), while this process has sockets open
+_lifecycle_settings = getattr(settings, 'GAME_LIFECYCLE', {})
+_reaper = None
+
+
+def _sockets_open():
+    return any(open_sockets.value(consumer) for consumer in ('game', 'matchmaking', 'arena'))
+
+
+async def reap_games():
+    global _reaper
+    interval = _lifecycle_settings.get('REAP_INTERVAL', 60)
+    try:
+        while _sockets_open():
+            await asyncio.sleep(interval)
+            try:
+                await database_sync_to_async(purge_waiting)()
+                for game_id, pgn in await database_sync_to_async(stale_games)():
+                    replayed = (pgn, await replay_positions(pgn)) if pgn else None
+                    async with move_lock(game_id):
+                        reaped = await database_sync_to_async(reap_game)(game_id, replayed=replayed)
+                        if reaped is None:
+                            continue
+                        game, reason, result = reaped
+                        sessions.evict(game.id)
+                        timeouts.cancel(game.id)
+                        move_log.discard(game.id)
+                        await broadcast(game.id, 'game_finished', {
+                            'status': game.status,
+                            'result': result,
+                            'winner': game.winner_id,
+                            'reason': reason,
+                            'clock': None,
+                        })
+            except Exception:
+                errors.inc('reap_games')
+                logger.exception('Error in reap_games')
+    finally:
+        _reaper = None
+
+
+def ensure_reaper():
+    global _reaper
+    if _reaper is None and _lifecycle_settings.get('REAP_INTERVAL', 60):
+        _reaper = asyncio.ensure_future(reap_games())
+
+
+# The built-in opponent; searches run in worker processes
+_bot_settings = getattr(settings, 'BOT', {})
+bot_engine = BotEngine(
+    workers=_bot_settings.get('WORKERS', 2),
+    max_depth=_bot_settings.get('MAX_DEPTH', 32),
+)
+_bot_tasks = set()
+_bot_games = set()
+
+
+def schedule_bot_move(game_id, bot_id, cadence):
+    """Start the bot's move in game_id, unless one is already on its way."""
+    key = str(game_id)
+    if key in _bot_games:
+        return None
+    _bot_games.add(key)
+    task = asyncio.ensure_future(play_bot_move(game_id, bot_id, cadence))
+    _bot_tasks.add(task)
+    task.add_done_callback(_bot_tasks.discard)
+    task.add_done_callback(lambda _: _bot_games.discard(key))
+    return task
+
+
+@database_sync_to_async
+def bot_to_move(game_id):
+    """(bot id, cadence) if game_id is active and the bot is to move, else None."""
+    game = Game.objects.select_related('white_player', 'black_player').filter(id=game_id, status='active').first()
+    if game is None:
+        return None
+    to_move = game.white_player if game.fen.split(' ')[1] == 'w' else game.black_player
+    if to_move is None or not to_move.is_bot:
+        return None
+    return to_move.id, game.cadence
+
+
+async def play_bot_move(game_id, bot_id, cadence):
+    """Search the current position within the bot's time budget and play the result."""
+    profiler.bind(str(game_id))
+    try:
+        game = await get_game(game_id)
+        if game.status != 'active':
+            return
+        session = sessions.peek(game_id)
+        remaining = None
+        if session is not None and session.clock is not None:
+            color = 'white' if game.white_player_id == bot_id else 'black'
+            remaining = session.clock.time_left(color)
+        found = await bot_engine.choose_move(game.fen, think_time(cadence, remaining))
+        if found['move']:
+            await apply_move(game_id, bot_id, found['move'])
+    except Exception:
+        errors.inc('play_bot_move')
+        logger.exception('Error in play_bot_move for game %s', game_id)
+
+
+_spectator_settings = getattr(settings, 'GAME_SPECTATORS', {})
+
+
+class WireConsumer(AsyncWebsocketConsumer):
+    """
+    JSON by default; binary frames (see wire.py) for clients that offer the
+    wire.SUBPROTOCOL subprotocol.
+    """
+    binary = False
+
+    async def accept_negotiated(self):
+        self.binary = wire.SUBPROTOCOL in self.scope.get('subprotocols', ())
+        await self.accept(subprotocol=wire.SUBPROTOCOL if self.binary else None)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            try:
+                command, data = wire.decode_command(bytes_data)
+            except wire.WireError as e:
+                await self.send_message({'type': 'error', 'message': str(e)})
+                return
+        else:
+            data = json.loads(text_data)
+            command = data.get('command')
+        with command_seconds.time(self.metrics_name, command if command in self.commands else 'other'):
+            await self.run_command(command, data)
+
+    async def send_message(self, message):
+        if self.binary:
+            await self.send(bytes_data=wire.encode(message))
+        else:
+            await self.send(text_data=json.dumps(message))
+
+    async def send_encoded(self, encoded):
+        """Send a (text, bytes) pair encoded once for many sockets."""
+        if self.binary:
+            await self.send(bytes_data=encoded[1])
+        else:
+            await self.send(text_data=encoded[0])
+
+
+class GameConsumer(WireConsumer):
+    """
+    A game room. The two players get every broadcast as it arrives; anyone else,
+    including anonymous visitors, watches read-only, and their updates are
+    flushed at most every FLUSH_INTERVAL seconds, several moves to a frame.
+    """
+    metrics_name = 'game'
+    commands = ('make_move', 'join_game', 'get_state')
 
-class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.game_id = self.scope['url_route']['kwargs']['game_id']
         self.room_group_name = f'game_{self.game_id}'
         self.user = self.scope['user']
 
-        if self.user == AnonymousUser():
+        players = await self.get_player_ids()
+        if players is None:
             await self.close()
             return
+        self.spectator = not self.user.is_authenticated or self.user.id not in players
+        self.outbox = []
+        self.flusher = None
+        profiler.bind(str(self.game_id))
 
         # Join room group
         await self.channel_layer.group_add(
@@ -23,220 +435,443 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_negotiated()
+        open_sockets.inc('game')
+        ensure_reaper()
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'outbox'):
+            # Closed in connect(), before joining anything
+            return
+        open_sockets.dec('game')
+        if self.flusher is not None:
+            self.flusher.cancel()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        command = data.get('command')
-
+    async def run_command(self, command, data):
         if command == 'make_move':
+            if self.spectator:
+                await self.send_message({
+                    'type': 'error',
+                    'message': 'Spectators cannot move'
+                })
+                return
             await self.process_move(data.get('move'))
         
-        elif command == 'join_game':
-             # Send initial state
-             game_data = await self.get_game_data()
-             await self.send(text_data=json.dumps({
-                 'type': 'game_state',
-                 'game': game_data
-             }))
+        elif command == 'join_game' and isinstance(data.get('last_ply'), int):
+            # Reconnecting: just the moves missed since last_ply, if we still have them
+            await self.resume(data['last_ply'])
+
+        elif command in ('join_game', 'get_state'):
+             # Send full state; moves after this are sent as move_applied deltas
+             await self.send_state()
+
+        if command == 'join_game' and not self.spectator:
+            # The bot's first move (or one lost with another process) is played here, on
+            # the worker that owns the game, so its clock and timeout live in one place
+            bot = await bot_to_move(self.game_id)
+            if bot is not None:
+                schedule_bot_move(self.game_id, *bot)
+
+    async def resume(self, last_ply):
+        missed = move_log.since(self.game_id, last_ply)
+        if missed is None:
+            await self.send_state()
+            return
+        session = sessions.peek(self.game_id)
+        clock = session.clock.snapshot() if session is not None and session.clock is not None else None
+        ply = last_ply + len(missed)
+        if self.binary:
+            await self.send(bytes_data=wire.resumed(ply, clock, [data for _, data in missed]))
+            return
+        await self.send(text_data=(
+            f'{{"type": "resumed", "ply": {ply}, "clock": {json.dumps(clock)}, '
+            f'"messages": [{", ".join(text for text, _ in missed)}]}}'
+        ))
+
+    async def send_state(self):
+        game_data = await self.get_game_data()
+        await self.send_message({
+            'type': 'game_state',
+            'game': game_data
+        })
 
     async def process_move(self, move_uci):
         try:
-            # 1. Get Game
-            game = await self.get_game()
-            
-            # 2. Validate Turn
-            active_color = game.fen.split(' ')[1] # 'w' or 'b'
-            is_white_turn = (active_color == 'w')
-            
-            if is_white_turn:
-                if game.white_player_id != self.user.id:
-                    print(f"Invalid turn: User {self.user.id} tried to move on White turn")
-                    return
-            else:
-                if game.black_player_id != self.user.id:
-                    print(f"Invalid turn: User {self.user.id} tried to move on Black turn")
-                    return
-
-            # 3. Apply Move
-            new_fen, san, error = await database_sync_to_async(make_move)(game.fen, move_uci)
-            
+            error = await apply_move(self.game_id, self.user.id, move_uci)
             if error:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': error
-                }))
-                return
+                })
+        except Exception:
+            errors.inc('process_move')
+            logger.exception('Error in process_move for game %s', self.game_id)
 
-            # 4. Update Game
-            game.fen = new_fen
-            if game.pgn:
-                game.pgn += f" {san}"
-            else:
-                game.pgn = san
-                
-            if await database_sync_to_async(is_game_over)(new_fen):
-                game.status = 'finished'
-                game.finished_at = timezone.now()
-                
-                result_str = await database_sync_to_async(get_game_result)(new_fen)
-                
-                score_white = 0.5
-                if result_str == '1-0':
-                    score_white = 1.0
-                    game.winner_id = game.white_player_id
-                elif result_str == '0-1':
-                    score_white = 0.0
-                    game.winner_id = game.black_player_id
-                
-                # Update Elos - tricky part, we need profiles asynchronously
-                # We can't access game.white_player.profile directly.
-                w_profile = await database_sync_to_async(lambda: Profile.objects.get(user_id=game.white_player_id))()
-                b_profile = await database_sync_to_async(lambda: Profile.objects.get(user_id=game.black_player_id))()
-                    
-                new_w, new_b = calculate_elo(w_profile.elo, b_profile.elo, score_white)
-                
-                w_profile.elo = new_w
-                w_profile.games_played += 1
-                if score_white == 1: w_profile.wins += 1
-                elif score_white == 0: w_profile.losses += 1
-                else: w_profile.draws += 1
-                if new_w > w_profile.highest_elo: w_profile.highest_elo = new_w
-                
-                b_profile.elo = new_b
-                b_profile.games_played += 1
-                if score_white == 0: b_profile.wins += 1
-                elif score_white == 1: b_profile.losses += 1
-                else: b_profile.draws += 1
-                if new_b > b_profile.highest_elo: b_profile.highest_elo = new_b
-                
-                await database_sync_to_async(w_profile.save)()
-                await database_sync_to_async(b_profile.save)()
-                    
-            await database_sync_to_async(game.save)()
-            
-            # 5. Broadcast State
-            game_data = await self.get_game_data()
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'game_update',
-                    'game': game_data
-                }
-            )
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            print(f"Error in process_move: {e}")
-
-    async def game_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_state',
-            'game': event['game']
-        }))
+    async def move_applied(self, event):
+        await self.relay(event)
+
+    async def game_finished(self, event):
+        await self.relay(event)
+
+    async def relay(self, event):
+        if not self.spectator:
+            await self.send_encoded((event['text'], event['bytes']))
+            return
+        self.outbox.append(event['bytes'] if self.binary else event['text'])
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush_outbox())
+
+    async def flush_outbox(self):
+        """Send what queued up for a spectator since the last flush as one frame."""
+        interval = _spectator_settings.get('FLUSH_INTERVAL', 0.1)
+        max_batch = _spectator_settings.get('MAX_BATCH', 16)
+        try:
+            while self.outbox:
+                batch, self.outbox = self.outbox, []
+                if len(batch) > max_batch:
+                    # Too far behind: a fresh snapshot is smaller than the backlog
+                    await self.send_state()
+                elif self.binary:
+                    await self.send(bytes_data=batch[0] if len(batch) == 1 else wire.batch(batch))
+                elif len(batch) == 1:
+                    await self.send(text_data=batch[0])
+                else:
+                    await self.send(text_data='{"type": "batch", "messages": [' + ', '.join(batch) + ']}')
+                await asyncio.sleep(interval)
+        finally:
+            self.flusher = None
 
     @database_sync_to_async
-    def get_game(self):
-        return Game.objects.get(id=self.game_id)
+    def get_player_ids(self):
+        """(white id, black id), or None if there is no such game."""
+        return Game.objects.filter(id=self.game_id).values_list('white_player_id', 'black_player_id').first()
 
     @database_sync_to_async
     def get_game_data(self):
-        game = Game.objects.get(id=self.game_id)
-        data = GameSerializer(game).data
-        # Attach legal moves for current status
-        if game.status == 'active' or game.status == 'waiting':
-             data['legal_moves'] = get_legal_moves(game.fen)
-        else:
-             data['legal_moves'] = []
-        return data
+        return load_game_data(self.game_id)
+
+
+def load_game_data(game_id):
+    """The game_state payload: the serialized game plus ply, legal moves and clock."""
+    game = Game.objects.get(id=game_id)
+    data = GameSerializer(game).data
+    data['ply'] = fen_ply(game.fen)
+    # Attach legal moves for current status
+    if game.status in ('active', 'waiting'):
+        # From the saved position: the live board may hold a move that is still being saved
+        data['legal_moves'] = get_legal_moves(game.fen)
+        session = sessions.peek(game_id) if game.status == 'active' else None
+        if session is not None and session.clock is not None:
+            data['clock'] = session.clock.snapshot()
+    else:
+        data['legal_moves'] = []
+    return data
+
 
+# Players waiting for a game, one queue per cadence
+_matchmaking_settings = getattr(settings, 'MATCHMAKING', {})
+matchmaking = MatchmakingEngine(
+    base_band=_matchmaking_settings.get('BASE_BAND', 100),
+    band_growth=_matchmaking_settings.get('BAND_GROWTH', 50),
+    max_band=_matchmaking_settings.get('MAX_BAND', 800),
+)
+_sweeper = None
+
+
+@database_sync_to_async
+def create_matched_game(white_id, black_id, cadence):
+    return Game.objects.create(
+        white_player_id=white_id,
+        black_player_id=black_id,
+        cadence=cadence,
+        status='active',
+        fen=get_initial_fen()
+    )
+
+
+async def start_matched_game(white, black):
+    """Create the Game row for a formed pair and tell both players."""
+    game = await create_matched_game(white.user_id, black.user_id, white.cadence)
+    channel_layer = get_channel_layer()
+    for entry, color in ((white, 'white'), (black, 'black')):
+        await channel_layer.send(entry.channel_name, {
+            'type': 'match_found',
+            'game_id': game.id,
+            'color': color
+        })
+    return game
+
+
+async def start_bot_game(entry):
+    """
+    Pair a player nobody else took with the bot, on a random colour. If the bot
+    plays White it moves once the player joins the game (see GameConsumer).
+    """
+    bot = await database_sync_to_async(get_bot_user)(_bot_settings.get('USERNAME', 'antichess_bot'))
+    if random.random() < 0.5:
+        white_id, black_id, color = entry.user_id, bot.id, 'white'
+    else:
+        white_id, black_id, color = bot.id, entry.user_id, 'black'
+    game = await create_matched_game(white_id, black_id, entry.cadence)
+    await get_channel_layer().send(entry.channel_name, {
+        'type': 'match_found',
+        'game_id': game.id,
+        'color': color
+    })
+    return game
+
+
+async def sweep_matchmaking():
+    """Pair waiting players as their Elo bands widen; stops when the queues are empty."""
+    global _sweeper
+    interval = _matchmaking_settings.get('SWEEP_INTERVAL', 1.0)
+    try:
+        while matchmaking.waiting():
+            await asyncio.sleep(interval)
+            for white, black in matchmaking.sweep():
+                try:
+                    await start_matched_game(white, black)
+                except Exception:
+                    matchmaking.requeue((white, black))
+                    errors.inc('sweep_matchmaking')
+                    logger.exception('Error in sweep_matchmaking pairing users %s and %s',
+                                     white.user_id, black.user_id)
+            if _bot_settings.get('ENABLED', False):
+                for entry in matchmaking.expire(_bot_settings.get('MATCH_AFTER', 15)):
+                    try:
+                        await start_bot_game(entry)
+                    except Exception:
+                        matchmaking.requeue((entry,))
+                        errors.inc('sweep_matchmaking')
+                        logger.exception('Error in sweep_matchmaking starting a bot game for user %s', entry.user_id)
+    finally:
+        _sweeper = None
+
+
+def ensure_matchmaking_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = asyncio.ensure_future(sweep_matchmaking())
+
+
+class MatchmakingConsumer(WireConsumer):
+    metrics_name = 'matchmaking'
+    commands = ('find_game', 'cancel')
 
-class MatchmakingConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         # if self.user == AnonymousUser():
         #      await self.close()
         #      return
-        await self.accept()
-        self.waiting_game_group = None
+        await self.accept_negotiated()
+        open_sockets.inc('matchmaking')
+        ensure_reaper()
 
     async def disconnect(self, close_code):
-        if self.waiting_game_group:
-            await self.channel_layer.group_discard(
-                self.waiting_game_group,
-                self.channel_name
-            )
-
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        command = data.get('command')
+        open_sockets.dec('matchmaking')
+        if self.user.is_authenticated:
+            matchmaking.leave(self.user.id, self.channel_name)
+
+    async def run_command(self, command, data):
         cadence = data.get('cadence')
 
         if command == 'find_game':
-            game, created = await self.find_match(cadence)
-            
-            if created:
-                # User created a game and is waiting
-                self.waiting_game_group = f'match_{game.id}'
-                await self.channel_layer.group_add(
-                    self.waiting_game_group,
-                    self.channel_name
-                )
-                # Should we tell client we are waiting?
-                # Client is showing spinner, so it's fine.
+            if not self.user.is_authenticated:
+                await self.send_message({
+                    'type': 'error',
+                    'message': 'Login required'
+                })
+                return
+            if cadence not in dict(Game.CADENCE_CHOICES):
+                await self.send_message({
+                    'type': 'error',
+                    'message': 'Unknown cadence'
+                })
+                return
+
+            elo = await self.get_elo()
+            pair = matchmaking.join(cadence, self.user.id, elo, self.channel_name)
+            if pair:
+                # Paired with someone already waiting; they play White
+                try:
+                    await start_matched_game(*pair)
+                except Exception:
+                    # Both wait again; the sweeper pairs them once games can be created
+                    matchmaking.requeue(pair)
+                    ensure_matchmaking_sweeper()
+                    errors.inc('find_game')
+                    logger.exception('Error in find_game pairing users %s and %s', pair[0].user_id, pair[1].user_id)
             else:
-                # User joined an existing game
-                # Notify the creator (who is in the group)
-                group_name = f'match_{game.id}'
-                await self.channel_layer.group_send(
-                    group_name,
-                    {
-                        'type': 'match_found',
-                        'game_id': game.id
-                    }
-                )
-                
-                # Notify self (the joiner)
-                await self.send(text_data=json.dumps({
-                    'type': 'game_found',
-                    'game_id': game.id,
-                    'color': 'black' # Joiner is usually black if creator was white
-                }))
+                # Client is showing spinner while we wait for an opponent
+                ensure_matchmaking_sweeper()
+
+        elif command == 'cancel':
+            if self.user.is_authenticated:
+                matchmaking.leave(self.user.id, self.channel_name)
 
     async def match_found(self, event):
-        game_id = event['game_id']
-        await self.send(text_data=json.dumps({
+        await self.send_message({
              'type': 'game_found',
-             'game_id': game_id,
-             'color': 'white'
-        }))
+             'game_id': event['game_id'],
+             'color': event['color']
+        })
 
     @database_sync_to_async
-    def find_match(self, cadence):
-        # 1. Try to find a waiting game
-        game = Game.objects.filter(cadence=cadence, status='waiting').exclude(white_player=self.user).exclude(black_player=self.user).first()
-        
-        if game:
-            if not game.white_player:
-                 game.white_player = self.user
-            elif not game.black_player:
-                 game.black_player = self.user
-            
-            game.status = 'active'
-            game.save()
-            return game, False
-        else:
-            # 2. Create new game
-            game = Game.objects.create(
-                white_player=self.user,
-                cadence=cadence,
-                status='waiting',
-                fen=get_initial_fen()
-            )
-            return game, True
+    def get_elo(self):
+        return Profile.objects.filter(user_id=self.user.id).values_list('elo', flat=True).first() or 1500
+
+
+# Arena tournaments with players in this process (see arena.py)
+_arena_settings = getattr(settings, 'ARENA', {})
+_arena_sweeper = None
+
+
+@database_sync_to_async
+def create_arena_games(arena, pairs):
+    return Game.objects.bulk_create([
+        Game(white_player_id=white.user_id, black_player_id=black.user_id, cadence=arena.cadence,
+             status='active', fen=get_initial_fen(), tournament_id=arena.tournament_id)
+        for white, black in pairs
+    ])
+
+
+async def start_arena_games(arena, pairs):
+    """Create the Game rows of one pairing round and tell every player where to go."""
+    games = await create_arena_games(arena, pairs)
+    channel_layer = get_channel_layer()
+    for game, (white, black) in zip(games, pairs):
+        for player, color in ((white, 'white'), (black, 'black')):
+            channel_name = arena.channel(player.user_id)
+            if channel_name is not None:
+                await channel_layer.send(channel_name, {
+                    'type': 'match_found',
+                    'game_id': game.id,
+                    'color': color,
+                })
+    return games
+
+
+async def publish_standings(arena, event_type='arena_standings'):
+    arena.standings_changed = False
+    standings = await database_sync_to_async(live_standings)(arena, _arena_settings.get('STANDINGS_SIZE', 10))
+    message = {'type': event_type, 'tournament_id': arena.tournament_id, 'standings': standings}
+    await get_channel_layer().group_send(f'arena_{arena.tournament_id}', {
+        'type': event_type,
+        'text': json.dumps(message),
+    })
+
+
+async def sweep_arenas():
+    """
+    Pair every open arena's pool and push standings that changed, each
+    PAIRING_INTERVAL; arenas past their end are closed. Stops when none are left.
+    """
+    global _arena_sweeper
+    interval = _arena_settings.get('PAIRING_INTERVAL', 2.0)
+    try:
+        while arenas:
+            await asyncio.sleep(interval)
+            now = timezone.now()
+            for arena in list(arenas.values()):
+                try:
+                    if now >= arena.ends_at:
+                        arenas.pop(arena.tournament_id, None)
+                        await publish_standings(arena, 'arena_finished')
+                        continue
+                    if now >= arena.starts_at:
+                        with pairing_seconds.time():
+                            pairs = arena.pair()
+                        if pairs:
+                            await start_arena_games(arena, pairs)
+                    if arena.standings_changed:
+                        await publish_standings(arena)
+                except Exception:
+                    errors.inc('sweep_arenas')
+                    logger.exception('Error in sweep_arenas for tournament %s', arena.tournament_id)
+    finally:
+        _arena_sweeper = None
+
+
+def ensure_arena_sweeper():
+    global _arena_sweeper
+    if _arena_sweeper is None:
+        _arena_sweeper = asyncio.ensure_future(sweep_arenas())
+
+
+class ArenaConsumer(WireConsumer):
+    """
+    An arena tournament. Everyone connected gets the live standings; a
+    logged-in player sends join to be paired, again after every game, until
+    they pause or disconnect, and gets game_found for each new game.
+    JSON only: standings have no binary encoding.
+    """
+    metrics_name = 'arena'
+    commands = ('join', 'pause', 'get_standings')
+
+    async def connect(self):
+        self.tournament_id = int(self.scope['url_route']['kwargs']['tournament_id'])
+        self.user = self.scope['user']
+        self.arena = await database_sync_to_async(open_arena)(self.tournament_id)
+        if self.arena is None:
+            await self.close()
+            return
+        self.group_name = f'arena_{self.tournament_id}'
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        open_sockets.inc('arena')
+        ensure_arena_sweeper()
+        ensure_reaper()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'group_name'):
+            return
+        open_sockets.dec('arena')
+        # Another tab of the same player may have taken over
+        if self.user.is_authenticated and self.arena.channel(self.user.id) == self.channel_name:
+            self.arena.leave(self.user.id)
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def run_command(self, command, data):
+        if command == 'join':
+            if not self.user.is_authenticated:
+                await self.send_message({'type': 'error', 'message': 'Login required'})
+                return
+            if timezone.now() >= self.arena.ends_at:
+                await self.send_message({'type': 'error', 'message': 'Tournament is over'})
+                return
+            elo, score = await database_sync_to_async(enter_tournament)(self.tournament_id, self.user.id)
+            self.arena.join(self.user.id, elo, score, self.channel_name)
+            ensure_arena_sweeper()
+            await self.send_message({'type': 'arena_joined', 'tournament_id': self.tournament_id, 'score': score})
+
+        elif command == 'pause':
+            if self.user.is_authenticated:
+                self.arena.leave(self.user.id)
+
+        elif command == 'get_standings':
+            standings = await database_sync_to_async(tournament_standings)(
+                self.tournament_id, limit=_arena_settings.get('STANDINGS_SIZE', 10))
+            await self.send_message({'type': 'arena_standings', 'tournament_id': self.tournament_id,
+                                     'standings': standings})
+
+    async def match_found(self, event):
+        await self.send_message({
+            'type': 'game_found',
+            'game_id': event['game_id'],
+            'color': event['color'],
+            'tournament_id': self.tournament_id,
+        })
+
+    async def arena_result(self, event):
+        # A game of this tournament ended, maybe in another worker
+        self.arena.game_finished(event['game_id'], event['scores'], event['ratings'])
+
+    async def arena_standings(self, event):
+        await self.send(text_data=event['text'])
+
+    async def arena_finished(self, event):
+        await self.send(text_data=event['text'])
@@ -0,0 +1,274 @@
+"""
+Antichess engine for the built-in bot.
+
+Iterative-deepening negamax with alpha-beta pruning on top of the bitboard
+generator in api.movegen. Forced moves (a single legal reply, which is common
+when captures are compulsory) don't use up depth, and at the horizon pending
+captures are followed a few plies further instead of evaluated, since the side
+to move can't decline them. Positions are stored in a Zobrist-keyed transposition table.
+Searches stop at a hard time budget; run them in a process pool (BotEngine)
+so they never block the event loop.
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .clocks import parse_cadence
+from .movegen import BISHOP, KING, KNIGHT, PAWN, QUEEN, ROOK, Position
+
+WIN = 100000
+MAX_PLY = 64
+# How far past the horizon pending captures are followed
+QUIESCENCE_DEPTH = 4
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Heavier pieces are harder to give away, so they count more against their owner
+PIECE_VALUES = {PAWN: 100, KNIGHT: 200, BISHOP: 250, ROOK: 300, QUEEN: 300, KING: 250}
+
+_rng = random.Random(20240601)
+ZOBRIST_PIECES = {color: {piece: [_rng.getrandbits(64) for _ in range(64)] for piece in PIECE_VALUES}
+                  for color in (True, False)}
+ZOBRIST_TURN = _rng.getrandbits(64)
+ZOBRIST_CASTLING = {square: _rng.getrandbits(64) for square in (0, 7, 56, 63)}
+ZOBRIST_EP = [_rng.getrandbits(64) for _ in range(8)]
+
+
+def _piece_boards(position):
+    return ((PAWN, position.pawns), (KNIGHT, position.knights), (BISHOP, position.bishops),
+            (ROOK, position.rooks), (QUEEN, position.queens), (KING, position.kings))
+
+
+def zobrist(position):
+    key = 0
+    for color, occupied in ((True, position.white), (False, position.black)):
+        tables = ZOBRIST_PIECES[color]
+        for piece, bb in _piece_boards(position):
+            pieces = occupied & bb
+            table = tables[piece]
+            while pieces:
+                low = pieces & -pieces
+                key ^= table[low.bit_length() - 1]
+                pieces ^= low
+    if position.turn:
+        key ^= ZOBRIST_TURN
+    for square, value in ZOBRIST_CASTLING.items():
+        if position.castling & (1 << square):
+            key ^= value
+    if position.ep_square is not None:
+        key ^= ZOBRIST_EP[position.ep_square & 7]
+    return key
+
+
+def evaluate(position):
+    """Static score for the side to move: less material of your own is better."""
+    score = 0
+    for piece, bb in _piece_boards(position):
+        value = PIECE_VALUES[piece]
+        score += value * (bin(position.white & bb).count('1') - bin(position.black & bb).count('1'))
+    return -score if position.turn else score
+
+
+def _to_tt(score, ply):
+    # Win scores count plies from the root; the table keeps them relative to the node
+    if score >= WIN - MAX_PLY:
+        return score + ply
+    if score <= MAX_PLY - WIN:
+        return score - ply
+    return score
+
+
+def _from_tt(score, ply):
+    if score >= WIN - MAX_PLY:
+        return score - ply
+    if score <= MAX_PLY - WIN:
+        return score + ply
+    return score
+
+
+def _is_capture(position, move):
+    theirs = position.black if position.turn else position.white
+    return bool(theirs & (1 << move[1])) or (move[1] == position.ep_square and position.pawns & (1 << move[0]))
+
+
+class _Timeout(Exception):
+    pass
+
+
+class Searcher:
+    def __init__(self, time_limit, max_depth=32, tt_size=200000):
+        self.deadline = time.perf_counter() + time_limit
+        self.max_depth = max_depth
+        self.tt_size = tt_size
+        self.tt = {}
+        self.nodes = 0
+
+    def search(self, position):
+        moves = position.legal_moves()
+        if not moves:
+            return {'move': None, 'score': WIN, 'depth': 0}
+        best = {'move': moves[0], 'score': 0, 'depth': 0}
+        if len(moves) == 1:
+            return best
+
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self._root(position, moves, depth)
+            except _Timeout:
+                break
+            best = {'move': move, 'score': score, 'depth': depth}
+            if abs(score) >= WIN - MAX_PLY:
+                break
+        return best
+
+    def _root(self, position, moves, depth):
+        entry = self.tt.get(zobrist(position))
+        if entry and entry[3] in moves:
+            moves = [entry[3]] + [move for move in moves if move != entry[3]]
+        alpha, best_move = -WIN - 1, moves[0]
+        for move in moves:
+            score = -self._negamax(position.push(move), depth - 1, -WIN - 1, -alpha, 1)
+            if score > alpha:
+                alpha, best_move = score, move
+        self._store(zobrist(position), depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def _negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & 1023 and time.perf_counter() > self.deadline:
+            raise _Timeout()
+
+        moves = position.legal_moves()
+        if not moves:
+            # No pieces left or no legal move: the side to move has won
+            return WIN - ply
+        if ply >= MAX_PLY:
+            return evaluate(position)
+
+        forced = len(moves) == 1
+        if depth <= 0 and (depth <= -QUIESCENCE_DEPTH or not (forced or _is_capture(position, moves[0]))):
+            return evaluate(position)
+        # Forced replies don't cost depth before the horizon
+        next_depth = depth if forced and depth > 0 else depth - 1
+
+        key = zobrist(position)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry:
+            entry_depth, entry_score, flag, tt_move = entry
+            entry_score = _from_tt(entry_score, ply)
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER and entry_score <= alpha:
+                    return entry_score
+            if tt_move in moves:
+                moves = [tt_move] + [move for move in moves if move != tt_move]
+
+        original_alpha = alpha
+        best_score, best_move = -WIN - 1, moves[0]
+        for move in moves:
+            score = -self._negamax(position.push(move), next_depth, -beta, -alpha, ply + 1)
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self._store(key, depth, best_score, flag, best_move, ply)
+        return best_score
+
+    def _store(self, key, depth, score, flag, move, ply=0):
+        if len(self.tt) >= self.tt_size:
+            self.tt.clear()
+        self.tt[key] = (depth, _to_tt(score, ply), flag, move)
+
+
+def search(fen, time_limit, max_depth=32):
+    """
+    Best move for the side to move in fen within time_limit seconds.
+    Returns a plain dict (safe to send back from a worker process).
+    """
+    start = time.perf_counter()
+    position = Position.from_fen(fen)
+    searcher = Searcher(time_limit, max_depth=max_depth)
+    best = searcher.search(position)
+    elapsed = time.perf_counter() - start
+    return {
+        'move': position.uci(best['move']) if best['move'] else None,
+        'score': best['score'],
+        'depth': best['depth'],
+        'nodes': searcher.nodes,
+        'seconds': elapsed,
+        'nps': searcher.nodes / elapsed if elapsed else 0.0,
+    }
+
+
+def analyse(fen, depth):
+    """
+    Score (for the side to move) and best move of fen searched to exactly
+    depth, with no time limit; unlike search(), forced moves are scored too.
+    """
+    position = Position.from_fen(fen)
+    moves = position.legal_moves()
+    if not moves:
+        return {'move': None, 'score': WIN, 'nodes': 0}
+    searcher = Searcher(float('inf'), max_depth=depth)
+    for iteration in range(1, depth + 1):
+        score, move = searcher._root(position, moves, iteration)
+    return {'move': position.uci(move), 'score': score, 'nodes': searcher.nodes}
+
+
+def think_time(cadence, remaining=None):
+    """Seconds to spend on one move: a slice of the remaining time plus most of the increment."""
+    base, increment = parse_cadence(cadence)
+    remaining = base if remaining is None else remaining
+    budget = remaining / 40 + increment * 0.8
+    return max(0.05, min(budget, remaining / 4, 10.0))
+
+
+class BotEngine:
+    """
+    Runs searches in a process pool, created on first use and again after a
+    worker dies (which breaks the whole pool).
+    """
+    def __init__(self, workers=2, max_depth=32):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.pending = 0
+        self._pool = None
+
+    async def choose_move(self, fen, time_limit):
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            for attempt in range(2):
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                pool = self._pool
+                try:
+                    return await loop.run_in_executor(pool, search, fen, time_limit, self.max_depth)
+                except BrokenProcessPool:
+                    # Searches running alongside see the same error; only the first replaces the pool
+                    if self._pool is pool:
+                        self._pool = None
+                        pool.shutdown(wait=False)
+                    if attempt:
+                        raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .profiler import profiler
+
+
+class RulesQueueFull(Exception):
+    """Raised when the rules executor already has max_pending calls queued or running."""
+    pass
+
+
+class RulesExecutor:
+    """
+    Thread pool for CPU-bound rules work (move validation, legal moves, results).
+    Kept apart from channels' thread-sensitive DB executor, so rules calls from
+    different games run side by side and never queue behind ORM queries.
+    """
+    def __init__(self, workers=4, max_pending=256, history=1024, observe=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        # observe(seconds, function name) gets the run time of each call, queueing excluded
+        self.observe = observe
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rules')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._calls = 0
+        self._rejected = 0
+        self._latencies = deque(maxlen=history)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and return its result.
+        Raises RulesQueueFull instead of queueing past max_pending.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise RulesQueueFull(f"{self._pending} rules calls pending")
+            self._pending += 1
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        call = profiler.tag(partial(fn, *args, **kwargs))
+        if self.observe is not None:
+            call = partial(self._timed, call, getattr(fn, '__name__', 'call'))
+        try:
+            return await loop.run_in_executor(self._pool, call)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._pending -= 1
+                self._calls += 1
+                self._latencies.append(elapsed)
+
+    def _timed(self, call, name):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self.observe(time.perf_counter() - start, name)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        """Queue depth and latency (seconds, queueing included) over the last calls."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'calls': self._calls,
+                'rejected': self._rejected,
+            }
+        if latencies:
+            stats['p50'] = latencies[len(latencies) // 2]
+            stats['p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            stats['max'] = latencies[-1]
+        return stats
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,140 @@
+"""
+Opening explorer: which moves were played from a position, and how they scored.
+
+PositionStat holds one row per (position, move) with white-win/black-win/draw
+counts. Positions are keyed by their 64-bit Zobrist hash (the Polyglot one,
+stored signed to fit a BIGINT), so equal positions reached by different move
+orders share a row and a lookup is a single range scan of the unique
+(position_key, move) index however many positions are stored. Only the first
+MAX_PLY plies of each game are indexed.
+
+finish_game adds the game inside its own transaction and marks it in_explorer,
+and backfill_explorer indexes older games; the flag keeps the two from
+counting a game twice. Counts are added with INSERT .. ON CONFLICT DO UPDATE,
+so concurrent finishes never lose an increment.
+"""
+from collections import Counter
+
+import chess
+import chess.polyglot
+import chess.variant
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Game, PositionStat
+from .pgn import game_result
+
+MAX_PLY = getattr(settings, 'OPENING_EXPLORER', {}).get('MAX_PLY', 30)
+RESULT_COLUMNS = {'1-0': 'white_wins', '0-1': 'black_wins', '1/2-1/2': 'draws'}
+
+
+def zobrist_key(board):
+    """The board's Polyglot Zobrist hash as a signed 64-bit integer."""
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def game_positions(pgn, max_ply=MAX_PLY):
+    """[(position_key, uci)] for the first max_ply moves of a space-separated SAN movetext."""
+    board = chess.variant.AntichessBoard()
+    positions = []
+    for san in pgn.split()[:max_ply]:
+        try:
+            move = board.parse_san(san)
+        except ValueError:
+            break
+        positions.append((zobrist_key(board), move.uci()))
+        board.push(move)
+    return positions
+
+
+def count_positions(positions, result):
+    """Counter of (position_key, uci, result column) for one game; a position repeated in a game counts once."""
+    column = RESULT_COLUMNS.get(result, 'draws')
+    return Counter((key, uci, column) for key, uci in set(positions))
+
+
+def add_counts(counts):
+    """Add a Counter of (position_key, uci, result column) -> games to PositionStat."""
+    if not counts:
+        return
+    rows = {}
+    for (key, uci, column), n in counts.items():
+        row = rows.setdefault((key, uci), {'white_wins': 0, 'black_wins': 0, 'draws': 0})
+        row[column] += n
+
+    qn = connection.ops.quote_name
+    table = qn(PositionStat._meta.db_table)
+    columns = ('white_wins', 'black_wins', 'draws')
+    updates = ', '.join(f'{qn(c)} = {table}.{qn(c)} + excluded.{qn(c)}' for c in columns)
+    sql = (
+        f"INSERT INTO {table} ({qn('position_key')}, {qn('move')}, {', '.join(qn(c) for c in columns)}) "
+        f"VALUES (%s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({qn('position_key')}, {qn('move')}) DO UPDATE SET {updates}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (key, uci, row['white_wins'], row['black_wins'], row['draws']) for (key, uci), row in rows.items()
+        ])
+
+
+def backfill_rows(start_id, end_id):
+    """Finished games with start_id <= id < end_id not yet in the explorer, as (id, pgn, result)."""
+    rows = (
+        Game.objects.filter(status='finished', in_explorer=False, id__gte=start_id, id__lt=end_id)
+        .values('id', 'pgn', 'winner_id', 'white_player_id')
+    )
+    return [(row['id'], row['pgn'], game_result(row)) for row in rows]
+
+
+def index_games(rows, max_ply=MAX_PLY):
+    """
+    Replay (id, pgn, result) rows into {game id: Counter}. Touches no database,
+    so backfill_explorer can run it in worker processes.
+    """
+    return {game_id: count_positions(game_positions(pgn, max_ply), result) for game_id, pgn, result in rows}
+
+
+def add_games(indexed):
+    """
+    Add games replayed by index_games, skipping any that were counted since
+    they were read. Returns the number of games added.
+    """
+    with transaction.atomic():
+        claimed = list(
+            Game.objects.select_for_update()
+            .filter(id__in=list(indexed), in_explorer=False).values_list('id', flat=True)
+        )
+        Game.objects.filter(id__in=claimed).update(in_explorer=True)
+        counts = Counter()
+        for game_id in claimed:
+            counts.update(indexed[game_id])
+        add_counts(counts)
+    return len(claimed)
+
+
+def explore(board):
+    """
+    Moves played from board's position, most played first:
+    [{'uci', 'san', 'white_wins', 'black_wins', 'draws', 'total'}].
+    """
+    entries = []
+    for stat in PositionStat.objects.filter(position_key=zobrist_key(board)):
+        try:
+            move = chess.Move.from_uci(stat.move)
+        except ValueError:
+            continue
+        # A hash collision can surface a move that isn't legal here
+        if not board.is_legal(move):
+            continue
+        total = stat.white_wins + stat.black_wins + stat.draws
+        entries.append({
+            'uci': stat.move,
+            'san': board.san(move),
+            'white_wins': stat.white_wins,
+            'black_wins': stat.black_wins,
+            'draws': stat.draws,
+            'total': total,
+        })
+    entries.sort(key=lambda entry: (-entry['total'], entry['uci']))
+    return entries
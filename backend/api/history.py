@@ -0,0 +1,87 @@
+"""
+Finished-game history with keyset pagination.
+
+Pages are ordered newest first by (finished_at, id) and continue from a cursor
+holding the last row's key, so page 1000 costs the same as page 1. A player's
+history is read as two index range scans, one per colour (see the Game
+indexes), merged in Python; an OR across the two foreign keys would defeat both.
+Archived games (see archive.py) are read the same way from ArchivedGame and
+merged in too; game ids are kept on archiving, so cursors stay valid.
+"""
+import base64
+import heapq
+from datetime import datetime
+
+from django.db.models import Q
+
+from .models import ArchivedGame, Game
+from .pgn import game_result
+
+HISTORY_FIELDS = (
+    'id', 'cadence', 'finished_at', 'white_player_id', 'black_player_id', 'winner_id',
+    'white_player__username', 'black_player__username', 'white_elo', 'black_elo',
+)
+RESULTS = ('win', 'loss', 'draw')
+
+
+def encode_cursor(row):
+    raw = f"{row['finished_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(finished_at, id) from a cursor; raises ValueError if it was tampered with."""
+    try:
+        finished_at, game_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(finished_at), int(game_id)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _before(cursor):
+    finished_at, game_id = cursor
+    return Q(finished_at__lt=finished_at) | Q(finished_at=finished_at, id__lt=game_id)
+
+
+def game_history(player_id=None, cadence=None, result=None, cursor=None, limit=20):
+    """
+    One page of finished games, newest first.
+    result ('win', 'loss', 'draw') is from player_id's point of view; without a
+    player only 'draw' makes sense. Returns (rows, next_cursor or None).
+    """
+    before = decode_cursor(cursor) if cursor else None
+    order = ('-finished_at', '-id')
+    scans = []
+    for games in (Game.objects.filter(status='finished', finished_at__isnull=False), ArchivedGame.objects.all()):
+        if cadence:
+            games = games.filter(cadence=cadence)
+        if result == 'draw':
+            games = games.filter(winner__isnull=True)
+        elif result == 'win':
+            games = games.filter(winner_id=player_id)
+        elif result == 'loss':
+            games = games.filter(winner__isnull=False).exclude(winner_id=player_id)
+        if before:
+            games = games.filter(_before(before))
+        if player_id is None:
+            scans.append(games)
+        else:
+            scans += [games.filter(white_player_id=player_id), games.filter(black_player_id=player_id)]
+
+    merged = heapq.merge(*(list(scan.order_by(*order).values(*HISTORY_FIELDS)[:limit + 1]) for scan in scans),
+                         key=lambda row: (row['finished_at'], row['id']), reverse=True)
+    rows = [row for _, row in zip(range(limit + 1), merged)]
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [_entry(row) for row in rows[:limit]], next_cursor
+
+
+def _entry(row):
+    return {
+        'id': row['id'],
+        'cadence': row['cadence'],
+        'finished_at': row['finished_at'],
+        'result': game_result(row),
+        'white': {'id': row['white_player_id'], 'username': row['white_player__username'], 'elo': row['white_elo']},
+        'black': {'id': row['black_player_id'], 'username': row['black_player__username'], 'elo': row['black_elo']},
+    }
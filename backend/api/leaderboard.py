@@ -0,0 +1,152 @@
+"""
+In-memory leaderboard.
+
+Players are ordered by Elo (highest first), ties by user id. A Fenwick tree
+over the Elo range counts players per rating, so a player's rank and the
+player at any position are both O(log n); players sharing a rating sit in a
+small sorted bucket. finish_game updates the index after commit, and the
+whole index is rebuilt from Profile (using the elo index) at startup, or
+lazily if it is older than refresh_interval.
+"""
+import bisect
+import threading
+import time
+
+
+class Leaderboard:
+    def __init__(self, min_elo=0, max_elo=4000, refresh_interval=300):
+        self.min_elo = min_elo
+        self.max_elo = max_elo
+        self.refresh_interval = refresh_interval
+        self.loaded_at = None
+        self._size = max_elo - min_elo + 1
+        self._tree = [0] * (self._size + 1)
+        self._buckets = {}  # slot -> sorted user ids
+        self._elo = {}      # user id -> elo
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._elo)
+
+    def _slot(self, elo):
+        """1-based tree index; higher ratings come first."""
+        elo = min(self.max_elo, max(self.min_elo, elo))
+        return self.max_elo - elo + 1
+
+    def _add(self, slot, delta):
+        while slot <= self._size:
+            self._tree[slot] += delta
+            slot += slot & -slot
+
+    def _prefix(self, slot):
+        """Players in slots 1..slot, i.e. rated at least as high as that slot."""
+        total = 0
+        while slot > 0:
+            total += self._tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def _find(self, position):
+        """Slot holding the 0-based position, and the number of players before that slot."""
+        slot, before = 0, 0
+        step = 1 << self._size.bit_length()
+        while step:
+            nxt = slot + step
+            if nxt <= self._size and before + self._tree[nxt] <= position:
+                slot = nxt
+                before += self._tree[nxt]
+            step >>= 1
+        return slot + 1, before
+
+    # Updates
+
+    def load(self, rows):
+        """Replace the index with (user_id, elo) rows."""
+        with self._lock:
+            self._tree = [0] * (self._size + 1)
+            self._buckets = {}
+            self._elo = {}
+            for user_id, elo in rows:
+                self._elo[user_id] = elo
+                self._buckets.setdefault(self._slot(elo), []).append(user_id)
+            counts = [0] * (self._size + 1)
+            for slot, users in self._buckets.items():
+                users.sort()
+                counts[slot] = len(users)
+            # Linear-time Fenwick construction
+            for slot in range(1, self._size + 1):
+                self._tree[slot] += counts[slot]
+                parent = slot + (slot & -slot)
+                if parent <= self._size:
+                    self._tree[parent] += self._tree[slot]
+            self.loaded_at = time.monotonic()
+
+    def update(self, user_id, elo):
+        with self._lock:
+            self._discard(user_id)
+            slot = self._slot(elo)
+            bisect.insort(self._buckets.setdefault(slot, []), user_id)
+            self._elo[user_id] = elo
+            self._add(slot, 1)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        elo = self._elo.pop(user_id, None)
+        if elo is None:
+            return
+        slot = self._slot(elo)
+        users = self._buckets[slot]
+        del users[bisect.bisect_left(users, user_id)]
+        if not users:
+            del self._buckets[slot]
+        self._add(slot, -1)
+
+    def stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_interval
+
+    # Queries
+
+    def rank(self, user_id):
+        """1-based rank (players on the same rating share it), or None if unranked."""
+        with self._lock:
+            elo = self._elo.get(user_id)
+            if elo is None:
+                return None
+            return self._prefix(self._slot(elo) - 1) + 1
+
+    def position(self, user_id):
+        """0-based place in the ordering, or None if unranked."""
+        with self._lock:
+            return self._position(user_id)
+
+    def _position(self, user_id):
+        elo = self._elo.get(user_id)
+        if elo is None:
+            return None
+        slot = self._slot(elo)
+        return self._prefix(slot - 1) + bisect.bisect_left(self._buckets[slot], user_id)
+
+    def page(self, offset, limit):
+        """[(rank, user_id, elo)] for positions offset .. offset + limit - 1."""
+        entries = []
+        with self._lock:
+            end = min(len(self._elo), offset + limit)
+            position = max(0, offset)
+            while position < end:
+                slot, before = self._find(position)
+                users = self._buckets[slot]
+                for user_id in users[position - before:end - before]:
+                    entries.append((before + 1, user_id, self._elo[user_id]))
+                position = before + len(users)
+        return entries
+
+    def around(self, user_id, radius=5):
+        """The player's own entry with up to radius players either side, or [] if unranked."""
+        position = self.position(user_id)
+        if position is None:
+            return []
+        start = max(0, position - radius)
+        return self.page(start, position + radius + 1 - start)
@@ -0,0 +1,81 @@
+"""
+Reaping games nobody plays.
+
+Matchmaking pairs players in memory, so a Game row only exists once both
+players are known and leaving the queue needs no cleanup. What can still go
+stale is a game nobody plays. reap() aborts (unrated) active games in which
+nobody moved ABORT_AFTER seconds after they started, and gives games whose
+side to move has been silent for ABANDON_AFTER seconds, longer than any clock
+allows, to the opponent on time, as the clock would have done had the process
+holding it not gone away. 'waiting' rows left by older versions are deleted.
+
+The socket workers do the same every REAP_INTERVAL, one game at a time
+(stale_games, reap_game) under the game's move lock; the reap_games command
+runs reap() from cron. Old finished and aborted games are moved out of Game by
+archive.py.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Game
+from .services import abort_game, finish_game
+
+_settings = getattr(settings, 'GAME_LIFECYCLE', {})
+ABORT_AFTER = _settings.get('ABORT_AFTER', 60)
+ABANDON_AFTER = _settings.get('ABANDON_AFTER', 1800)
+
+
+def reap(now=None):
+    """
+    End the games nobody is playing. Returns [(game, reason, result)] with
+    reason 'aborted' (result None) or 'abandoned'.
+    """
+    now = timezone.now() if now is None else now
+    purge_waiting(now)
+    reaped = []
+    for game in _stale(now):
+        ended = _end(game)
+        if ended is not None:
+            reaped.append(ended)
+    return reaped
+
+
+def purge_waiting(now=None):
+    now = timezone.now() if now is None else now
+    Game.objects.filter(status='waiting', created_at__lt=now - timedelta(seconds=ABORT_AFTER)).delete()
+
+
+def stale_games(now=None):
+    """(id, pgn) of the games reap() would end now; end them one by one with reap_game()."""
+    return list(_stale(timezone.now() if now is None else now).values_list('id', 'pgn'))
+
+
+def reap_game(game_id, now=None, replayed=None):
+    """
+    End game_id if it is still stale (a move may have come in since it was
+    found). replayed is (pgn, explorer.game_positions(pgn)), worked out off the
+    DB thread, and is used if the game's pgn still matches.
+    Returns (game, reason, result) or None.
+    """
+    game = _stale(timezone.now() if now is None else now).filter(id=game_id).first()
+    if game is None:
+        return None
+    return _end(game, replayed[1] if replayed is not None and replayed[0] == game.pgn else None)
+
+
+def _stale(now):
+    silent_since = now - timedelta(seconds=ABANDON_AFTER)
+    unstarted = Q(pgn='', created_at__lt=now - timedelta(seconds=ABORT_AFTER))
+    idle = ~Q(pgn='') & (Q(last_move_at__lt=silent_since) | Q(last_move_at__isnull=True, created_at__lt=silent_since))
+    return Game.objects.filter(unstarted | idle, status='active')
+
+
+def _end(game, positions=None):
+    if not game.pgn:
+        return (game, 'aborted', None) if abort_game(game) else None
+    # The side to move ran out of time
+    result = '0-1' if game.fen.split(' ')[1] == 'w' else '1-0'
+    return (game, 'abandoned', result) if finish_game(game, result, positions) is not None else None
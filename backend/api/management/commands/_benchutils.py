@@ -0,0 +1,52 @@
+"""Helpers shared by the bench_* and loadtest management commands."""
+import contextlib
+import platform
+import time
+
+import django
+from django.db import connection
+
+
+@contextlib.contextmanager
+def in_memory_database():
+    """
+    Run the block against a fresh, migrated in-memory test database
+    (the same one the test runner builds), leaving the real database untouched.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=False)
+
+
+def distribution(samples):
+    """Summary of a list of durations in seconds, reported in microseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1e6
+
+    return {
+        'count': len(samples),
+        'mean_us': sum(samples) / len(samples) * 1e6,
+        'p50_us': pct(0.50),
+        'p90_us': pct(0.90),
+        'p99_us': pct(0.99),
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def environment():
+    """Run metadata stored next to the results, so runs can be compared."""
+    import chess
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'python_chess': chess.__version__,
+        'machine': platform.machine(),
+    }
@@ -0,0 +1,63 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.analysis import DEPTH, analyse_game, claim_jobs, enqueue_finished, fail_job, save_analysis, worker_init
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Analyse finished games from the job queue in a low-priority process pool. '
+            'Run it apart from the web workers; interrupted jobs are picked up again once their lease expires')
+
+    def add_arguments(self, parser):
+        analysis = getattr(settings, 'ANALYSIS', {})
+        parser.add_argument('--workers', type=int, default=analysis.get('WORKERS', 1))
+        parser.add_argument('--batch-size', type=int, default=analysis.get('BATCH_SIZE', 8), help='Jobs claimed at a time')
+        parser.add_argument('--depth', type=int, default=DEPTH)
+        parser.add_argument('--poll', type=float, default=5.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--enqueue-finished', action='store_true',
+                            help='First queue finished games that were never queued (e.g. from before the pipeline)')
+
+    def handle(self, *args, **options):
+        if options['enqueue_finished']:
+            self.stdout.write(f'Queued {enqueue_finished()} games')
+
+        done = failed = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=worker_init) as pool:
+            try:
+                while True:
+                    token, jobs = claim_jobs(options['batch_size'])
+                    if not jobs:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+                        continue
+
+                    # Pool processes fork on first use; don't hand them our connection
+                    connections.close_all()
+                    futures = {pool.submit(analyse_game, pgn, options['depth']): job_id for job_id, _, pgn in jobs}
+                    for future in as_completed(futures):
+                        job_id = futures[future]
+                        try:
+                            evaluations = future.result()
+                        except Exception as e:
+                            logger.exception('Analysis job %s failed', job_id)
+                            fail_job(job_id, token, e)
+                            failed += 1
+                        else:
+                            done += save_analysis(job_id, token, evaluations)
+            except KeyboardInterrupt:
+                # Claimed but unsaved jobs go back to the queue when their lease expires
+                pass
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Analysed {done} games ({failed} failed) in {elapsed:.1f} s '
+                          f'({done * 60 / max(elapsed, 1e-9):.1f} jobs/min)')
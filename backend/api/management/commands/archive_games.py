@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_batch, archive_cutoff, delete_aborted
+
+
+class Command(BaseCommand):
+    help = ('Move finished games older than --days out of the live game table into the archive, '
+            'a batch per transaction, and delete aborted games as old; safe to rerun or interrupt')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        before = archive_cutoff(days=options['days'])
+        started = time.perf_counter()
+        archived = 0
+        while True:
+            moved = archive_batch(before, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            self.stdout.write(f'{archived} games archived', ending='\r')
+            time.sleep(options['pause'])
+        deleted = delete_aborted(before)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Archived {archived} games and deleted {deleted} aborted games in {elapsed:.1f} s '
+                          f'({archived / max(elapsed, 1e-9):.0f} games/s)')
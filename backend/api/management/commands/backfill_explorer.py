@@ -0,0 +1,53 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from api.explorer import MAX_PLY, add_games, backfill_rows, index_games
+from api.models import Game
+
+
+class Command(BaseCommand):
+    help = ('Add finished games that are not in the opening explorer yet, replaying them '
+            'in worker processes a chunk of ids at a time; safe to rerun or interrupt')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Game ids per chunk')
+        parser.add_argument('--max-ply', type=int, default=MAX_PLY)
+
+    def handle(self, *args, **options):
+        bounds = Game.objects.filter(status='finished', in_explorer=False).aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write('Nothing to backfill')
+            return
+        chunk_size = options['chunk_size']
+        starts = iter(range(bounds['low'], bounds['high'] + 1, chunk_size))
+
+        # Workers only replay moves; reading and writing stay in this process
+        connections.close_all()
+        added = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            pending = set()
+            while True:
+                # Keep every worker busy with one chunk queued behind it
+                while len(pending) < options['workers'] * 2:
+                    start = next(starts, None)
+                    if start is None:
+                        break
+                    rows = backfill_rows(start, start + chunk_size)
+                    if rows:
+                        pending.add(pool.submit(index_games, rows, options['max_ply']))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    added += add_games(future.result())
+                self.stdout.write(f'{added} games indexed', ending='\r')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Indexed {added} games in {elapsed:.1f} s ({added / max(elapsed, 1e-9):.0f} games/s)')
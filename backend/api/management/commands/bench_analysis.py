@@ -0,0 +1,61 @@
+import io
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from api.analysis import DEPTH, enqueue_finished
+from api.models import AnalysisJob, Game, MoveEvaluation
+from api.rules import get_initial_fen, get_legal_moves, make_move
+
+from ._benchutils import in_memory_database
+
+
+class Command(BaseCommand):
+    help = 'Seed an in-memory database with finished games and measure analyse_games throughput in jobs/min'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=40)
+        parser.add_argument('--plies', type=int, default=40, help='Plies per seeded game (fewer if it ends sooner)')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+        parser.add_argument('--batch-size', type=int, default=8)
+        parser.add_argument('--depth', type=int, default=DEPTH)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with in_memory_database():
+            plies = self.seed(options['games'], options['plies'], random.Random(options['seed']))
+            self.stdout.write(f"{options['games']} games, {plies} plies, depth {options['depth']}")
+            for workers in options['workers']:
+                AnalysisJob.objects.update(status='queued', attempts=0, token='', locked_until=None)
+                MoveEvaluation.objects.all().delete()
+                start = time.perf_counter()
+                call_command('analyse_games', once=True, workers=workers, batch_size=options['batch_size'],
+                             depth=options['depth'], stdout=io.StringIO())
+                elapsed = time.perf_counter() - start
+                done = AnalysisJob.objects.filter(status='done').count()
+                self.stdout.write(f'  {workers} worker(s): {done} jobs in {elapsed:.1f} s, '
+                                  f'{done * 60 / elapsed:.1f} jobs/min, {plies / elapsed:.0f} positions/s')
+
+    def seed(self, games, plies, rng):
+        User = get_user_model()
+        white = User.objects.create_user(username='bench_white', password='password')
+        black = User.objects.create_user(username='bench_black', password='password')
+        total = 0
+        rows = []
+        for _ in range(games):
+            fen, sans = get_initial_fen(), []
+            for _ in range(plies):
+                legal = get_legal_moves(fen)
+                if not legal:
+                    break
+                fen, san, _ = make_move(fen, rng.choice(legal))
+                sans.append(san)
+            total += len(sans)
+            rows.append(Game(white_player=white, black_player=black, cadence='3+0', status='finished',
+                             fen=fen, pgn=' '.join(sans)))
+        Game.objects.bulk_create(rows)
+        enqueue_finished()
+        return total
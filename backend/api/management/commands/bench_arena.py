@@ -0,0 +1,106 @@
+import collections
+import heapq
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.arena import Arena, award
+
+from ._benchutils import distribution, environment
+
+
+class Command(BaseCommand):
+    help = ('Simulate an arena tournament in memory: players are re-paired after every game and '
+            'each pairing round is timed; also reports pairing quality')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[100, 1000, 5000])
+        parser.add_argument('--minutes', type=int, default=60, help='Simulated tournament length')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between pairing rounds')
+        parser.add_argument('--game-seconds', type=int, nargs=2, default=[60, 360],
+                            help='Range of simulated game lengths')
+        parser.add_argument('--arrival-seconds', type=float, default=0,
+                            help='Players arrive over this long; 0 puts everyone in the first round')
+        parser.add_argument('--window', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write JSON results here ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        results = {'environment': environment(), 'runs': {}}
+        self.stdout.write(f"{'players':>8} {'rounds':>7} {'games':>8} {'pool p50':>9} {'p50 ms':>8} "
+                          f"{'p99 ms':>8} {'max ms':>8} {'rematch':>8} {'elo gap':>8} {'score gap':>10} {'wait s':>7}")
+        for players in options['players']:
+            run = self.simulate(players, options, random.Random(options['seed']))
+            results['runs'][players] = run
+            self.stdout.write(
+                f"{players:>8} {run['rounds']:>7} {run['games']:>8} {run['pool_p50']:>9} "
+                f"{run['pairing']['p50_us'] / 1000:>8.2f} {run['pairing']['p99_us'] / 1000:>8.2f} "
+                f"{run['pairing']['max_us'] / 1000:>8.2f} {run['rematch_rate']:>7.1%} {run['mean_elo_gap']:>8.0f} "
+                f"{run['mean_score_gap']:>10.2f} {run['mean_wait']:>7.1f}"
+            )
+
+        if options['output']:
+            payload = json.dumps(results, indent=2)
+            if options['output'] == '-':
+                self.stdout.write(payload)
+            else:
+                with open(options['output'], 'w') as f:
+                    f.write(payload)
+
+    def simulate(self, players, options, rng):
+        arena = Arena(1, '3+0', 0, options['minutes'] * 60, window=options['window'])
+        strength = {user_id: rng.gauss(1500, 250) for user_id in range(1, players + 1)}
+        scores = dict.fromkeys(strength, 0)
+        streaks = dict.fromkeys(strength, 0)
+        free_since = {}
+        arrivals = collections.deque(sorted(
+            (rng.uniform(0, options['arrival_seconds']), user_id) for user_id in strength))
+        running = []  # (ends at, white id, black id) heap
+        last_opponent = {}
+        samples, pools, waits = [], [], []
+        games = rematches = 0
+        elo_gap = score_gap = 0.0
+
+        now = 0.0
+        while now < options['minutes'] * 60:
+            while arrivals and arrivals[0][0] <= now:
+                arrived_at, user_id = arrivals.popleft()
+                arena.join(user_id, round(strength[user_id]), 0, f'channel.{user_id}')
+                free_since[user_id] = arrived_at
+            while running and running[0][0] <= now:
+                ended_at, white_id, black_id = heapq.heappop(running)
+                expected = 1 / (1 + 10 ** ((strength[black_id] - strength[white_id]) / 400))
+                roll = rng.random()
+                score_white = 0.5 if abs(roll - expected) < 0.05 else (1 if roll < expected else 0)
+                for user_id, score in ((white_id, score_white), (black_id, 1 - score_white)):
+                    points, streaks[user_id] = award(score, streaks[user_id])
+                    scores[user_id] += points
+                    arena.finished(user_id, scores[user_id])
+                    free_since[user_id] = ended_at
+
+            pools.append(arena.waiting())
+            start = time.perf_counter()
+            pairs = arena.pair()
+            samples.append(time.perf_counter() - start)
+            for white, black in pairs:
+                games += 1
+                rematches += last_opponent.get(white.user_id) == black.user_id
+                last_opponent[white.user_id], last_opponent[black.user_id] = black.user_id, white.user_id
+                elo_gap += abs(white.rating - black.rating)
+                score_gap += abs(white.score - black.score)
+                waits.extend((now - free_since[white.user_id], now - free_since[black.user_id]))
+                heapq.heappush(running, (now + rng.uniform(*options['game_seconds']), white.user_id, black.user_id))
+            now += options['interval']
+
+        return {
+            'rounds': len(samples),
+            'games': games,
+            'pool_p50': sorted(pools)[len(pools) // 2],
+            'pairing': distribution(samples),
+            'rematch_rate': rematches / max(games, 1),
+            'mean_elo_gap': elo_gap / max(games, 1),
+            'mean_score_gap': score_gap / max(games, 1),
+            'mean_wait': sum(waits) / max(len(waits), 1),
+        }
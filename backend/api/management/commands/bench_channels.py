@@ -0,0 +1,132 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.channel_layer import ChannelHub, UnixSocketChannelLayer
+
+
+def _run_hub(path):
+    asyncio.run(ChannelHub(path).serve_forever())
+
+
+def _run_worker(index, workers, path, options, barrier, results):
+    results.put(asyncio.run(_worker(index, workers, path, options, barrier)))
+
+
+async def _worker(index, workers, path, options, barrier):
+    """
+    Host both players of the games this worker owns, except that a `remote` fraction
+    of games has its second player on the next worker, then broadcast `messages`
+    moves into every owned game and wait until every local player has received all of them.
+    """
+    games, messages = options['games'], options['messages']
+    layer = UnixSocketChannelLayer(path=path, capacity=messages * 2)
+    rng = random.Random(options['seed'])
+    split = [rng.random() < options['remote'] for _ in range(games)]
+
+    owned, hosted = [], []
+    for game in range(games):
+        owner = game % workers
+        second = (owner + 1) % workers if split[game] else owner
+        if owner == index:
+            owned.append(f'game_{game}')
+            hosted.append(f'game_{game}')
+        if second == index:
+            hosted.append(f'game_{game}')
+
+    channels = []
+    for group in hosted:
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        channels.append(channel)
+    # Give the hub time to tell everyone about shared groups
+    await asyncio.sleep(0.5)
+
+    expected = len(channels) * messages
+    received = 0
+    done = asyncio.Event()
+
+    async def drain(channel):
+        nonlocal received
+        for _ in range(messages):
+            await layer.receive(channel)
+            received += 1
+        if received == expected:
+            done.set()
+
+    tasks = [asyncio.ensure_future(drain(channel)) for channel in channels]
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    start = time.perf_counter()
+    for ply in range(messages):
+        for group in owned:
+            await layer.group_send(group, {'type': 'move_applied', 'move': {'ply': ply, 'uci': 'e2e3'}})
+        await asyncio.sleep(0)
+    try:
+        await asyncio.wait_for(done.wait(), options['timeout'])
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await layer.close()
+    return {'received': received, 'expected': expected, 'seconds': elapsed, 'forwarded': layer.forwarded}
+
+
+class Command(BaseCommand):
+    help = ('Benchmark group_send throughput of the unix-socket channel layer '
+            'with 1, 2, 4 and 8 worker processes sharing one hub')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--games', type=int, default=400)
+        parser.add_argument('--messages', type=int, default=50, help='Moves broadcast per game')
+        parser.add_argument('--remote', type=float, nargs='+', default=[0.0, 0.1, 1.0],
+                            help='Fraction of games whose players sit on two different workers')
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{os.cpu_count()} CPUs, {options['games']} games, {options['messages']} moves each")
+        for remote in options['remote']:
+            for workers in options['workers']:
+                stats = self.run(workers, dict(options, remote=remote))
+                lost = stats['expected'] - stats['received']
+                self.stdout.write(
+                    f"remote {remote:>4.0%}, {workers} workers: {stats['received'] / stats['seconds']:,.0f} deliveries/s, "
+                    f"{stats['forwarded']} via hub, {stats['seconds']:.2f} s" + (f", {lost} lost" if lost else '')
+                )
+
+    def run(self, workers, options):
+        ctx = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.sock')
+            hub = ctx.Process(target=_run_hub, args=(path,), daemon=True)
+            hub.start()
+            while not os.path.exists(path):
+                time.sleep(0.01)
+
+            barrier = ctx.Barrier(workers)
+            results = ctx.Queue()
+            processes = [
+                ctx.Process(target=_run_worker, args=(index, workers, path, options, barrier, results))
+                for index in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            per_worker = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            hub.terminate()
+            hub.join()
+
+        return {
+            'received': sum(stats['received'] for stats in per_worker),
+            'expected': sum(stats['expected'] for stats in per_worker),
+            'forwarded': sum(stats['forwarded'] for stats in per_worker),
+            'seconds': max(stats['seconds'] for stats in per_worker),
+        }
@@ -0,0 +1,68 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.clocks import TimeoutScheduler
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the shared timeout scheduler as the number of active games grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--moves', type=int, default=20, help='Reschedules per game')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for games in options['games']:
+            stats = asyncio.run(self.run(games, options['moves'], random.Random(options['seed'])))
+            self.stdout.write(
+                f"{games:>7} games: schedule {stats['schedule_us']:.2f} us/op, "
+                f"heap {stats['heap']}, fire lag p50 {stats['lag_p50_ms']:.2f} ms "
+                f"p99 {stats['lag_p99_ms']:.2f} ms, loop lag max {stats['loop_lag_ms']:.2f} ms"
+            )
+
+    async def run(self, games, moves, rng):
+        lags = []
+        deadlines = {}
+
+        async def on_timeout(game_id):
+            lags.append(time.monotonic() - deadlines[game_id])
+
+        # 1. Every game makes `moves` moves, each pushing its deadline out again
+        scheduler = TimeoutScheduler(on_timeout)
+        now = time.monotonic()
+        start = time.perf_counter()
+        for _ in range(moves):
+            for game_id in range(games):
+                scheduler.schedule(game_id, now + 3600 + rng.random())
+        schedule_us = (time.perf_counter() - start) / (games * moves) * 1e6
+        heap = len(scheduler._heap)
+        for game_id in range(games):
+            scheduler.cancel(game_id)
+
+        # 2. Flags spread at ~10k per second, starting one second from now
+        scheduler = TimeoutScheduler(on_timeout)
+        now = time.monotonic() + 1
+        spread = games / 10000
+        for game_id in range(games):
+            deadlines[game_id] = now + rng.random() * spread
+            scheduler.schedule(game_id, deadlines[game_id])
+
+        # Let everything flag while measuring how late the event loop wakes up
+        loop_lag = 0.0
+        while len(lags) < games:
+            before = time.monotonic()
+            await asyncio.sleep(0.01)
+            loop_lag = max(loop_lag, time.monotonic() - before - 0.01)
+
+        lags.sort()
+        return {
+            'schedule_us': schedule_us,
+            'heap': heap,
+            'lag_p50_ms': lags[len(lags) // 2] * 1000,
+            'lag_p99_ms': lags[int(len(lags) * 0.99)] * 1000,
+            'loop_lag_ms': loop_lag * 1000,
+        }
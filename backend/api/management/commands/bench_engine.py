@@ -0,0 +1,46 @@
+import random
+
+import chess.variant
+from django.core.management.base import BaseCommand
+
+from api.engine import search, think_time
+from api.models import Game
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the bot engine: nodes per second and depth reached at each cadence\'s time budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--positions', type=int, default=8, help='Positions searched per cadence')
+        parser.add_argument('--cadences', nargs='+', default=[c for c, _ in Game.CADENCE_CHOICES])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        positions = self.sample_positions(options['positions'], random.Random(options['seed']))
+        for cadence in options['cadences']:
+            budget = think_time(cadence)
+            runs = [search(fen, budget) for fen in positions]
+            nodes = sum(run['nodes'] for run in runs)
+            seconds = sum(run['seconds'] for run in runs)
+            depths = sorted(run['depth'] for run in runs)
+            overrun = max(run['seconds'] for run in runs) - budget
+            self.stdout.write(
+                f"{cadence:>4}: budget {budget * 1000:.0f} ms, {nodes / seconds:,.0f} nodes/s, "
+                f"depth min {depths[0]} median {depths[len(depths) // 2]} max {depths[-1]}, "
+                f"worst overrun {max(0.0, overrun) * 1000:.1f} ms"
+            )
+
+    def sample_positions(self, count, rng):
+        """Positions from random games, spread over the opening and middlegame."""
+        positions = []
+        while len(positions) < count:
+            board = chess.variant.AntichessBoard()
+            stop = rng.randrange(0, 30)
+            for _ in range(stop):
+                moves = list(board.legal_moves)
+                if not moves or board.is_variant_end():
+                    break
+                board.push(rng.choice(moves))
+            if not board.is_game_over() and board.legal_moves.count() > 1:
+                positions.append(board.fen())
+        return positions
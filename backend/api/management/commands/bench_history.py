@@ -0,0 +1,104 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.history import HISTORY_FIELDS, game_history
+from api.models import Game
+
+from ._benchutils import distribution, in_memory_database
+
+
+class Command(BaseCommand):
+    help = ('Seed an in-memory database with finished games and measure /api/games/ '
+            'query counts and latency, keyset cursors against OFFSET, at increasing depth')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=1000000)
+        parser.add_argument('--players', type=int, default=2000)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 500])
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with in_memory_database():
+            start = time.perf_counter()
+            heavy = self.seed(options['games'], options['players'], random.Random(options['seed']))
+            self.stdout.write(f"seeded {options['games']:,} games in {time.perf_counter() - start:.1f} s")
+            self.explain(heavy)
+            for label, params in (('all games', ''), (f'player {heavy}', f'player={heavy}&')):
+                self.stdout.write(label)
+                for page in options['pages']:
+                    self.measure(params, page, options['limit'], options['repeat'])
+
+    def seed(self, games, players, rng):
+        User = get_user_model()
+        User.objects.bulk_create([User(username=f'p{i}') for i in range(players)], batch_size=5000)
+        ids = list(User.objects.values_list('id', flat=True))
+        # A fifth of the games involve one very active player
+        heavy_id = ids[0]
+        now = timezone.now()
+        cadences = [c for c, _ in Game.CADENCE_CHOICES]
+        batch = []
+        for i in range(games):
+            white, black = rng.sample(ids, 2)
+            if rng.random() < 0.2:
+                white, black = (heavy_id, black) if rng.random() < 0.5 else (white, heavy_id)
+            if white == black:
+                black = ids[1]
+            finished = now - timedelta(seconds=rng.randrange(365 * 86400))
+            batch.append(Game(
+                white_player_id=white, black_player_id=black, status='finished', cadence=rng.choice(cadences),
+                winner_id=rng.choice((white, black, None)), finished_at=finished, white_elo=1500, black_elo=1500,
+            ))
+            if len(batch) == 10000:
+                Game.objects.bulk_create(batch)
+                batch = []
+        Game.objects.bulk_create(batch)
+        return User.objects.get(id=heavy_id).username
+
+    def explain(self, username):
+        with CaptureQueriesContext(connection) as queries:
+            user_id = get_user_model().objects.get(username=username).id
+            game_history(user_id, limit=20)
+        for query in queries.captured_queries[1:]:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = '; '.join(row[-1] for row in cursor.fetchall())
+            self.stdout.write(f'  plan: {plan}')
+
+    def measure(self, params, page, limit, repeat):
+        client = Client(SERVER_NAME='localhost')
+        # Walk the cursors to the requested page through the endpoint
+        cursor = None
+        for _ in range(page - 1):
+            cursor = client.get(f'/api/games/?{params}limit={limit}' + (f'&cursor={cursor}' if cursor else '')).json()['next']
+        with CaptureQueriesContext(connection) as queries:
+            client.get(f'/api/games/?{params}limit={limit}' + (f'&cursor={cursor}' if cursor else ''))
+
+        # Then time the same page as a keyset read and as an OFFSET read
+        player_id = None
+        finished = Game.objects.filter(status='finished', finished_at__isnull=False).order_by('-finished_at', '-id')
+        if params:
+            player_id = get_user_model().objects.get(username=params.split('=')[1].rstrip('&')).id
+            finished = finished.filter(Q(white_player_id=player_id) | Q(black_player_id=player_id))
+        keyset, offset = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            game_history(player_id, cursor=cursor, limit=limit)
+            keyset.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            list(finished.values(*HISTORY_FIELDS)[(page - 1) * limit:page * limit])
+            offset.append(time.perf_counter() - start)
+        self.stdout.write(
+            f"  page {page:>4}: {len(queries)} queries per request, keyset p50 {distribution(keyset)['p50_us'] / 1000:.2f} ms, "
+            f"OFFSET p50 {distribution(offset)['p50_us'] / 1000:.2f} ms"
+        )
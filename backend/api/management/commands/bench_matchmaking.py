@@ -0,0 +1,54 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.matchmaking import MatchmakingEngine
+
+
+class Command(BaseCommand):
+    help = 'Benchmark matchmaking pairing throughput with many queued players'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=5000, help='Players queued per cadence')
+        parser.add_argument('--cadences', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cadences = ['1+0', '2+1', '3+0', '5+0'][:options['cadences']]
+        players = options['players']
+
+        # 1. Fill the queues; distinct ratings and a zero band mean nobody pairs yet
+        engine = MatchmakingEngine(base_band=0, band_growth=0, max_band=800)
+        start = time.perf_counter()
+        user_id = 0
+        for cadence in cadences:
+            ratings = [800 + 2000 * i / players for i in range(players)]
+            rng.shuffle(ratings)
+            for elo in ratings:
+                user_id += 1
+                engine.join(cadence, user_id, elo, f'chan{user_id}', now=0.0)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'join (no band): {user_id} players in {elapsed * 1000:.1f} ms '
+                          f'({user_id / elapsed:,.0f} joins/s), {engine.waiting()} waiting')
+
+        # 2. Newcomers pairing against full queues
+        engine.band_growth = 50
+        arrivals = players
+        queued = engine.waiting()
+        start = time.perf_counter()
+        paired = 0
+        for i in range(arrivals):
+            user_id += 1
+            if engine.join(rng.choice(cadences), user_id, rng.randint(800, 2800), f'chan{user_id}', now=10.0):
+                paired += 1
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'join with {queued} queued: {arrivals} arrivals in {elapsed * 1000:.1f} ms '
+                          f'({arrivals / elapsed:,.0f} joins/s), {paired} paired immediately')
+
+        # 3. Band widening sweep over the remaining queues
+        start = time.perf_counter()
+        pairs = engine.sweep(now=20.0)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'sweep: {len(pairs)} pairs in {elapsed * 1000:.1f} ms, {engine.waiting()} still waiting')
@@ -0,0 +1,59 @@
+import io
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Game, Profile
+
+from ._benchutils import in_memory_database
+
+
+class Command(BaseCommand):
+    help = 'Seed an in-memory database with a finished-game history and time recompute_ratings on it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=200000)
+        parser.add_argument('--players', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365, help='Span of the seeded history')
+        parser.add_argument('--period-hours', type=float, nargs='+', default=[24, 1])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with in_memory_database():
+            start = time.perf_counter()
+            self.seed(options['games'], options['players'], options['days'], random.Random(options['seed']))
+            self.stdout.write(f"Seeded {options['games']} games between {options['players']} players "
+                              f"in {time.perf_counter() - start:.1f} s")
+            for hours in options['period_hours']:
+                output = io.StringIO()
+                start = time.perf_counter()
+                call_command('recompute_ratings', period_hours=hours, stdout=output)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'  {hours:g} h periods: {elapsed:.1f} s '
+                                  f"({options['games'] / elapsed:,.0f} games/s)")
+                for line in output.getvalue().splitlines():
+                    self.stdout.write(f'    {line}')
+
+    def seed(self, games, players, days, rng):
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            [User(username=f'bench_{i}', password='!') for i in range(players)], batch_size=2000)
+        Profile.objects.bulk_create([Profile(user=user) for user in users], batch_size=2000)
+        ids = [user.id for user in users]
+        first = timezone.now() - timedelta(days=days)
+        span = days * 86400
+        batch = []
+        for _ in range(games):
+            white, black = rng.sample(ids, 2)
+            winner = rng.choice((white, black, None))
+            batch.append(Game(white_player_id=white, black_player_id=black, winner_id=winner, cadence='3+0',
+                              status='finished', finished_at=first + timedelta(seconds=rng.randrange(span))))
+            if len(batch) == 5000:
+                Game.objects.bulk_create(batch)
+                batch = []
+        Game.objects.bulk_create(batch)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import random
+import time
+
+import chess
+import chess.variant
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.consumers import GameConsumer
+from api import movegen
+from api.models import Game, Profile
+from api.rules import (
+    GameSession, calculate_elo, get_game_result, get_initial_fen, get_legal_moves,
+    is_game_over, make_move, perft, position_cache,
+)
+
+from ._benchutils import distribution, environment, in_memory_database
+
+# Reference positions (White to move unless noted) reached in real-looking games
+MIDDLEGAME_FENS = [
+    'rnb2k2/1p4p1/3p4/p4p2/8/2P5/P1PP4/R1BQ1B2 w - - 0 16',
+    'r1b4r/p5n1/1pnp3p/8/P1PP4/P3K3/6P1/5BN1 w - - 1 21',
+    '1n1k3r/1b1pb3/2p1p1pp/1p6/5P2/3PP1P1/1PP3K1/RNBQ2N1 w - - 2 16',
+    'r2k2n1/p1p1b3/bp6/8/3P4/7P/PPP2P2/R2QK3 w - - 1 16',
+]
+ENDGAME_FENS = [
+    '1n3k2/5p2/1p6/3p4/8/R7/8/8 w - - 0 26',
+    '2B5/5k2/1P6/8/2N4p/5P2/5K2/8 w - - 0 31',
+    '4k3/8/4p3/7r/8/1PP4P/3B4/1N5R w - - 0 26',
+    '8/8/1p5p/p3p3/P3P1PP/2R2N2/8/8 w - - 0 31',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark api.rules (perft, per-function latency, end-to-end moves/sec) and write JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='Perft depth')
+        parser.add_argument('--iterations', type=int, default=200, help='Calls per function and position')
+        parser.add_argument('--moves', type=int, default=500, help='Moves for the end-to-end run (0 to skip)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='bench_rules.json', help="JSON output path ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = {
+            'environment': environment(),
+            'perft': self.bench_perft(options['depth']),
+            'functions': self.bench_functions(options['iterations'], rng),
+        }
+        if options['moves']:
+            with in_memory_database():
+                results['end_to_end'] = asyncio.run(self.bench_end_to_end(options['moves'], rng))
+
+        for name, stats in results['functions'].items():
+            self.stdout.write(f"{name:<24} p50 {stats['p50_us']:8.1f} us  p99 {stats['p99_us']:8.1f} us")
+        for row in results['perft']:
+            self.stdout.write(f"perft({row['depth']}) {row['fen']}: {row['nodes']} nodes, {row['nps']:,.0f} nodes/s, "
+                              f"bitboard {row['bitboard_nps']:,.0f} nodes/s (x{row['bitboard_speedup']:.1f})")
+        if 'end_to_end' in results:
+            self.stdout.write(f"process_move: {results['end_to_end']['moves_per_second']:.1f} moves/s")
+
+        payload = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(payload)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def bench_perft(self, depth):
+        rows = []
+        for fen in [get_initial_fen()] + MIDDLEGAME_FENS + ENDGAME_FENS:
+            board = chess.variant.AntichessBoard(fen)
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            bitboard_nodes = movegen.perft(movegen.Position.from_fen(fen), depth)
+            bitboard_elapsed = time.perf_counter() - start
+            if bitboard_nodes != nodes:
+                raise CommandError(f'bitboard perft mismatch for {fen}: {bitboard_nodes} != {nodes}')
+
+            rows.append({
+                'fen': fen, 'depth': depth, 'nodes': nodes, 'seconds': elapsed, 'nps': nodes / elapsed,
+                'bitboard_seconds': bitboard_elapsed, 'bitboard_nps': nodes / bitboard_elapsed,
+                'bitboard_speedup': elapsed / bitboard_elapsed,
+            })
+        return rows
+
+    def bench_functions(self, iterations, rng):
+        positions = [get_initial_fen()] + MIDDLEGAME_FENS + ENDGAME_FENS
+        moves = {fen: get_legal_moves(fen) for fen in positions}
+
+        def timed(fn, *args):
+            start = time.perf_counter()
+            fn(*args)
+            return time.perf_counter() - start
+
+        def cold(fn, *args):
+            # Computed from scratch, as before the position cache; comparable with older runs
+            position_cache.clear()
+            return timed(fn, *args)
+
+        samples = {name: [] for name in (
+            'make_move', 'get_legal_moves', 'bitboard_legal_moves', 'is_game_over', 'get_game_result',
+            'get_legal_moves_cached', 'is_game_over_cached', 'get_game_result_cached', 'calculate_elo',
+            'session_push')}
+        for _ in range(iterations):
+            for fen in positions:
+                move = rng.choice(moves[fen])
+                samples['make_move'].append(timed(make_move, fen, move))
+                samples['get_legal_moves'].append(cold(get_legal_moves, fen))
+                samples['bitboard_legal_moves'].append(
+                    timed(lambda: movegen.Position.from_fen(fen).legal_moves_uci()))
+                samples['is_game_over'].append(cold(is_game_over, fen))
+                samples['get_game_result'].append(cold(get_game_result, fen))
+                # The same calls answered by the position cache
+                get_legal_moves(fen)
+                get_game_result(fen)
+                samples['get_legal_moves_cached'].append(timed(get_legal_moves, fen))
+                samples['is_game_over_cached'].append(timed(is_game_over, fen))
+                samples['get_game_result_cached'].append(timed(get_game_result, fen))
+                samples['calculate_elo'].append(timed(calculate_elo, rng.randint(800, 2800), rng.randint(800, 2800), 1))
+                session = GameSession(0, fen)
+                samples['session_push'].append(timed(session.push, move))
+        position_cache.clear()
+        return {name: distribution(values) for name, values in samples.items()}
+
+    async def bench_end_to_end(self, target, rng):
+        User = get_user_model()
+
+        @database_sync_to_async
+        def setup():
+            players = []
+            for name in ('bench_white', 'bench_black'):
+                user = User.objects.create_user(username=name, password='bench')
+                Profile.objects.create(user=user)
+                players.append(user)
+            return players
+
+        new_game = database_sync_to_async(lambda white, black: Game.objects.create(
+            white_player=white, black_player=black, cadence='5+0', status='active', fen=get_initial_fen()))
+
+        async def connect(user, game):
+            communicator = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{game.id}/')
+            communicator.scope['user'] = user
+            communicator.scope['url_route'] = {'kwargs': {'game_id': str(game.id)}}
+            await communicator.connect()
+            return communicator
+
+        players = await setup()
+        played = games = 0
+        start = time.perf_counter()
+        while played < target:
+            game = await new_game(*players)
+            games += 1
+            sockets = [await connect(user, game) for user in players]
+            legal, turn = get_legal_moves(game.fen), 0
+            for _ in range(200):
+                await sockets[turn].send_json_to({'command': 'make_move', 'move': rng.choice(legal)})
+                event = await sockets[0].receive_json_from(timeout=10)
+                await sockets[1].receive_json_from(timeout=10)
+                played += 1
+                if event['status'] == 'finished' or played >= target:
+                    break
+                legal, turn = event['legal_moves'], 1 - turn
+            for communicator in sockets:
+                await communicator.disconnect()
+        elapsed = time.perf_counter() - start
+        return {'moves': played, 'games': games, 'seconds': elapsed, 'moves_per_second': played / elapsed}
@@ -0,0 +1,108 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api import wire
+from api.clocks import GameClock
+from api.consumers import load_game_data, sessions
+from api.models import Game, Profile
+from api.rules import get_initial_fen, get_legal_moves, get_game_result, make_move
+
+from ._benchutils import distribution, environment, in_memory_database
+
+
+class Command(BaseCommand):
+    help = 'Compare the JSON and binary (wire.py) socket messages: bytes per message and encode time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plies', type=int, default=20, help='Plies played before the mid-game samples')
+        parser.add_argument('--iterations', type=int, default=2000, help='Encodes timed per message')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write JSON results here ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        with in_memory_database():
+            messages = self.sample_messages(options['plies'], random.Random(options['seed']))
+
+        results = {'environment': environment(), 'messages': {}}
+        self.stdout.write(f"{'message':<24} {'json B':>8} {'binary B':>9} {'ratio':>6} "
+                          f"{'json us':>8} {'binary us':>10}")
+        for name, message in messages.items():
+            text, data = self.encode_json(name, message), self.encode_binary(name, message)
+            row = {
+                'json_bytes': len(text.encode()),
+                'binary_bytes': len(data),
+                'json_encode': distribution(self.time(lambda: self.encode_json(name, message), options['iterations'])),
+                'binary_encode': distribution(self.time(lambda: self.encode_binary(name, message), options['iterations'])),
+            }
+            results['messages'][name] = row
+            self.stdout.write(
+                f"{name:<24} {row['json_bytes']:>8} {row['binary_bytes']:>9} "
+                f"{row['json_bytes'] / row['binary_bytes']:>5.1f}x "
+                f"{row['json_encode']['p50_us']:>8.1f} {row['binary_encode']['p50_us']:>10.1f}"
+            )
+
+        if options['output']:
+            payload = json.dumps(results, indent=2)
+            if options['output'] == '-':
+                self.stdout.write(payload)
+            else:
+                with open(options['output'], 'w') as f:
+                    f.write(payload)
+
+    def sample_messages(self, plies, rng):
+        """Real payloads from a game played with random legal moves."""
+        User = get_user_model()
+        white = User.objects.create_user(username='bench_white', password='password')
+        black = User.objects.create_user(username='bench_black', password='password')
+        Profile.objects.bulk_create([Profile(user=white), Profile(user=black)])
+        game = Game.objects.create(white_player=white, black_player=black, cadence='3+0', status='active',
+                                   fen=get_initial_fen())
+        clock = GameClock.for_cadence(game.cadence)
+        messages = {'game_state (start)': {'type': 'game_state', 'game': load_game_data(game.id)}}
+
+        moves, fen, sans = [], game.fen, []
+        for ply in range(1, plies + 1):
+            legal = get_legal_moves(fen)
+            if not legal:
+                break
+            uci = rng.choice(legal)
+            fen, san, _ = make_move(fen, uci)
+            sans.append(san)
+            clock.press()
+            moves.append({
+                'type': 'move_applied', 'ply': ply, 'uci': uci, 'san': san, 'fen': fen,
+                'legal_moves': get_legal_moves(fen), 'status': 'active', 'result': get_game_result(fen),
+                'winner': None, 'clock': clock.snapshot(),
+            })
+        Game.objects.filter(id=game.id).update(fen=fen, pgn=' '.join(sans))
+        sessions.get(game.id, fen).clock = clock
+
+        messages[f'game_state (ply {len(moves)})'] = {'type': 'game_state', 'game': load_game_data(game.id)}
+        messages['move_applied'] = moves[-1]
+        messages['batch (8 moves)'] = moves[-8:]
+        messages['game_finished'] = {'type': 'game_finished', 'status': 'finished', 'result': '1-0',
+                                     'winner': white.id, 'reason': 'timeout', 'clock': clock.snapshot()}
+        messages['game_found'] = {'type': 'game_found', 'game_id': game.id, 'color': 'white'}
+        return messages
+
+    def encode_json(self, name, message):
+        if name.startswith('batch'):
+            return '{"type": "batch", "messages": [' + ', '.join(json.dumps(m) for m in message) + ']}'
+        return json.dumps(message)
+
+    def encode_binary(self, name, message):
+        if name.startswith('batch'):
+            return wire.batch([wire.encode(m) for m in message])
+        return wire.encode(message)
+
+    def time(self, fn, iterations):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return samples
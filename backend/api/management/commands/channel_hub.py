@@ -0,0 +1,22 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.channel_layer import ChannelHub
+
+
+class Command(BaseCommand):
+    help = 'Run the hub that lets ASGI workers on this host share channel groups'
+
+    def add_arguments(self, parser):
+        default = settings.CHANNEL_LAYERS['default'].get('CONFIG', {}).get('path', '/tmp/antichess-channels.sock')
+        parser.add_argument('--path', default=default, help='Unix socket the workers connect to')
+
+    def handle(self, *args, **options):
+        hub = ChannelHub(options['path'])
+        self.stdout.write(f"Channel hub listening on {options['path']}")
+        try:
+            asyncio.run(hub.serve_forever())
+        except KeyboardInterrupt:
+            pass
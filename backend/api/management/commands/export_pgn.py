@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.models import Game
+from api.pgn import export_queryset, iter_pgn
+
+
+class Command(BaseCommand):
+    help = 'Write finished games as PGN to a file (or stdout), streaming rows from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write; defaults to stdout')
+        parser.add_argument('--since', help='Games finished on or after YYYY-MM-DD')
+        parser.add_argument('--until', help='Games finished on or before YYYY-MM-DD')
+        parser.add_argument('--cadence', choices=[c for c, _ in Game.CADENCE_CHOICES])
+        parser.add_argument('--player', help='Username playing either colour')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        filters = {}
+        for name in ('since', 'until'):
+            if options[name]:
+                filters[name] = parse_date(options[name])
+                if filters[name] is None:
+                    raise CommandError(f'--{name} must be YYYY-MM-DD')
+        filters.update(cadence=options['cadence'], player=options['player'])
+        # Archived games first; their ids are the older ones
+        games = (export_queryset(archived=True, **filters), export_queryset(**filters))
+
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        count = 0
+        try:
+            for record in iter_pgn(*games, chunk_size=options['chunk_size']):
+                out.write(record)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if options['output']:
+            self.stdout.write(f"Exported {count} games to {options['output']}")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import random
+import time
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+
+from api.consumers import GameConsumer, MatchmakingConsumer
+from api.models import Profile
+
+from ._benchutils import distribution, environment, in_memory_database
+
+
+class LoadStats:
+    def __init__(self):
+        self.moves = 0
+        self.games = 0
+        self.queries = 0
+        self.errors = 0
+        self.sent_at = {}           # (game_id, ply) -> time the move was sent
+        self.broadcast_latency = []  # move sent -> move_applied received, per receiving socket
+        self.matchmaking_wait = []
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Simulate players queueing through ws/matchmaking/ and playing random games '
+            'through ws/game/<id>/ against an in-memory database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20)
+        parser.add_argument('--games', type=int, default=2, help='Games each player plays')
+        parser.add_argument('--cadence', default='5+0')
+        parser.add_argument('--max-plies', type=int, default=300, help='Abandon games longer than this')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results as JSON to this path')
+
+    def handle(self, *args, **options):
+        with in_memory_database():
+            results = asyncio.run(self.run(options))
+
+        self.stdout.write(
+            f"{results['players']} players, {results['games']} games, {results['moves']} moves "
+            f"in {results['seconds']:.1f} s: {results['moves_per_second']:.1f} moves/s"
+        )
+        latency = results['broadcast_latency']
+        self.stdout.write(f"move -> broadcast p50 {latency.get('p50_us', 0) / 1000:.2f} ms, "
+                          f"p99 {latency.get('p99_us', 0) / 1000:.2f} ms")
+        self.stdout.write(f"DB queries per move: {results['queries_per_move']:.2f}, errors: {results['errors']}")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    async def run(self, options):
+        stats = LoadStats()
+
+        # Consumers run their DB calls in executor threads, each with its own connection;
+        # hook every connection as it is opened
+        def instrument(sender, connection, **kwargs):
+            connection.execute_wrappers.append(stats.count_query)
+
+        connection_created.connect(instrument)
+        users = await self.create_players(options['players'])
+        stats.queries = 0
+
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            self.play(user, options, stats, random.Random(rng.random())) for user in users
+        ])
+        elapsed = time.perf_counter() - start
+        connection_created.disconnect(instrument)
+
+        return {
+            'environment': environment(),
+            'players': len(users),
+            'games': stats.games,
+            'moves': stats.moves,
+            'errors': stats.errors,
+            'seconds': elapsed,
+            'moves_per_second': stats.moves / elapsed,
+            'queries_per_move': stats.queries / max(1, stats.moves),
+            'broadcast_latency': distribution(stats.broadcast_latency),
+            'matchmaking_wait': distribution(stats.matchmaking_wait),
+        }
+
+    @database_sync_to_async
+    def create_players(self, count):
+        User = get_user_model()
+        users = []
+        for i in range(count):
+            user = User.objects.create_user(username=f'load{i}', password='load')
+            Profile.objects.create(user=user)
+            users.append(user)
+        return users
+
+    async def connect(self, consumer, path, user, game_id=None):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        communicator.scope['user'] = user
+        if game_id is not None:
+            communicator.scope['url_route'] = {'kwargs': {'game_id': str(game_id)}}
+        await communicator.connect()
+        return communicator
+
+    async def play(self, user, options, stats, rng):
+        for _ in range(options['games']):
+            queued = time.perf_counter()
+            matchmaking = await self.connect(MatchmakingConsumer, '/ws/matchmaking/', user)
+            await matchmaking.send_json_to({'command': 'find_game', 'cadence': options['cadence']})
+            found = await matchmaking.receive_json_from(timeout=60)
+            stats.matchmaking_wait.append(time.perf_counter() - queued)
+            await matchmaking.disconnect()
+
+            game_id, color = found['game_id'], found['color'][0]
+            socket = await self.connect(GameConsumer, f'/ws/game/{game_id}/', user, game_id)
+            await socket.send_json_to({'command': 'join_game'})
+            ply = -1
+            try:
+                while True:
+                    event = await socket.receive_json_from(timeout=60)
+                    now = time.perf_counter()
+                    if event['type'] == 'game_state':
+                        state = event['game']
+                        fen, legal, status = state['fen'], state['legal_moves'], state['status']
+                        event_ply = state['ply']
+                    elif event['type'] == 'move_applied':
+                        fen, legal, status = event['fen'], event['legal_moves'], event['status']
+                        event_ply = event['ply']
+                        sent = stats.sent_at.get((game_id, event_ply))
+                        if sent is not None:
+                            stats.broadcast_latency.append(now - sent)
+                        if color == 'w':
+                            stats.moves += 1
+                    elif event['type'] == 'game_finished':
+                        break
+                    else:
+                        stats.errors += 1
+                        break
+
+                    # Act once per new position: the join snapshot and the broadcasts may overlap
+                    if event_ply <= ply:
+                        continue
+                    ply = event_ply
+                    if status == 'finished' or ply >= options['max_plies']:
+                        break
+                    if fen.split(' ')[1] == color and legal:
+                        stats.sent_at[(game_id, ply + 1)] = time.perf_counter()
+                        await socket.send_json_to({'command': 'make_move', 'move': rng.choice(legal)})
+            finally:
+                await socket.disconnect()
+            if color == 'w':
+                stats.games += 1
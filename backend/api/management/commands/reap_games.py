@@ -0,0 +1,14 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from api.lifecycle import reap
+
+
+class Command(BaseCommand):
+    help = ('Abort active games nobody started and give games abandoned mid-play to the opponent on time. '
+            'The socket workers do this every GAME_LIFECYCLE REAP_INTERVAL; run this from cron when they do not')
+
+    def handle(self, *args, **options):
+        reasons = Counter(reason for _, reason, _ in reap())
+        self.stdout.write(f"Aborted {reasons['aborted']} games, ended {reasons['abandoned']} abandoned games")
@@ -0,0 +1,122 @@
+import heapq
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from api import ratings
+from api.models import ArchivedGame, Game, Profile
+from api.services import rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = ('Recompute every profile rating (Elo and Glicko-2) and the win/loss counters from the full '
+            'finished-game history in one vectorised pass over rating periods. Profiles stay locked until it '
+            'commits, so games finishing meanwhile wait for it instead of being lost or counted twice')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period-hours', type=float, default=24, help='Length of a rating period')
+        parser.add_argument('--k', type=float, default=ratings.ELO_K, help='Elo K factor')
+        parser.add_argument('--tau', type=float, default=ratings.GLICKO_TAU, help='Glicko-2 volatility constraint')
+        parser.add_argument('--chunk-size', type=int, default=20000, help='Rows fetched and written at a time')
+        parser.add_argument('--dry-run', action='store_true', help='Compute and report without saving')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.recompute(options)
+            return
+        with transaction.atomic():
+            # Resetting every profile before reading the history also locks them all (SQLite: the
+            # database), so a game finishing meanwhile waits and then adds itself on top of the result
+            self.reset()
+            rows = self.recompute(options)
+            saving = time.perf_counter()
+            saved = self.save(rows, options['chunk_size'])
+        players_ranked = rebuild_leaderboard()
+        self.stdout.write(f'Saved {saved} profiles and ranked {players_ranked} players in '
+                          f'{time.perf_counter() - saving:.1f} s')
+
+    def recompute(self, options):
+        """Load the history and rate it. Returns the rows for save()."""
+        started = time.perf_counter()
+        user_ids, white, black, score, timestamps = self.load(options['chunk_size'])
+        loaded = time.perf_counter()
+        self.stdout.write(f'Loaded {len(score)} games between {len(user_ids)} players in {loaded - started:.1f} s')
+
+        period_index = ratings.periods(timestamps, options['period_hours'] * 3600)
+        players = len(user_ids)
+        elo, highest = ratings.elo(white, black, score, period_index, players, k=options['k'])
+        glicko = ratings.glicko2(white, black, score, period_index, players, tau=options['tau'])
+        counters = ratings.tallies(white, black, score, players)
+        computed = time.perf_counter()
+        period_count = len(np.unique(period_index))
+        self.stdout.write(f'Rated {period_count} periods in {computed - loaded:.1f} s')
+        return zip(
+            np.rint(elo).astype(np.int64).tolist(), np.rint(highest).astype(np.int64).tolist(),
+            *(column.tolist() for column in counters), *(column.tolist() for column in glicko),
+            user_ids.tolist(),
+        )
+
+    def load(self, chunk_size):
+        """
+        The finished-game history, archived games included, in play order as arrays: the distinct
+        user ids, then per game the white and black indexes into them, White's score and the finish
+        time in seconds.
+        """
+        live = (
+            Game.objects.filter(status='finished')
+            # Games finished before finished_at was recorded sort by when they were created
+            .annotate(played_at=Coalesce('finished_at', 'created_at'))
+        )
+        archived = ArchivedGame.objects.annotate(played_at=F('finished_at'))
+        scans = [
+            games.filter(white_player__isnull=False, black_player__isnull=False).order_by('played_at', 'id')
+            .values_list('played_at', 'id', 'white_player_id', 'black_player_id', 'winner_id')
+            .iterator(chunk_size=chunk_size)
+            for games in (archived, live)
+        ]
+        white_ids, black_ids, winner_ids, timestamps = [], [], [], []
+        for played_at, _, white_id, black_id, winner_id in heapq.merge(*scans):
+            white_ids.append(white_id)
+            black_ids.append(black_id)
+            winner_ids.append(winner_id or 0)
+            timestamps.append(played_at.timestamp())
+
+        white_ids = np.array(white_ids, dtype=np.int64)
+        black_ids = np.array(black_ids, dtype=np.int64)
+        score = ratings.results(white_ids, black_ids, np.array(winner_ids, dtype=np.int64))
+        user_ids, indexes = np.unique(np.concatenate((white_ids, black_ids)), return_inverse=True)
+        white, black = np.split(indexes, 2)
+        return user_ids, white, black, score, np.array(timestamps, dtype=np.float64)
+
+    def reset(self):
+        """Every profile back to the defaults; those with a finished game are then rewritten by save()."""
+        Profile.objects.update(
+            elo=ratings.ELO_START, highest_elo=ratings.ELO_START, games_played=0, wins=0, losses=0, draws=0,
+            glicko_rating=ratings.GLICKO_RATING, glicko_rd=ratings.GLICKO_RD,
+            glicko_volatility=ratings.GLICKO_VOLATILITY,
+        )
+
+    def save(self, rows, chunk_size):
+        """Write the recomputed columns, in the transaction that reset() started."""
+        table = connection.ops.quote_name(Profile._meta.db_table)
+        update = (
+            f'UPDATE {table} SET elo = %s, highest_elo = %s, games_played = %s, wins = %s, losses = %s, '
+            f'draws = %s, glicko_rating = %s, glicko_rd = %s, glicko_volatility = %s WHERE user_id = %s'
+        )
+        saved = 0
+        with connection.cursor() as cursor:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == chunk_size:
+                    cursor.executemany(update, batch)
+                    saved += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(update, batch)
+                saved += len(batch)
+        return saved
@@ -0,0 +1,175 @@
+import bisect
+import itertools
+import threading
+import time
+
+
+class QueueEntry:
+    __slots__ = ('user_id', 'elo', 'channel_name', 'cadence', 'joined_at', 'seq')
+
+    def __init__(self, user_id, elo, channel_name, cadence, joined_at, seq):
+        self.user_id = user_id
+        self.elo = elo
+        self.channel_name = channel_name
+        self.cadence = cadence
+        self.joined_at = joined_at
+        self.seq = seq
+
+    @property
+    def key(self):
+        return (self.elo, self.seq)
+
+
+class MatchmakingEngine:
+    """
+    In-process matchmaking with one queue per cadence.
+    Each queue is kept sorted by Elo so the closest opponent is found with a
+    bisect. A player accepts opponents within an Elo band that starts at
+    base_band and grows by band_growth per second of waiting, up to max_band.
+    All queue changes happen under one lock, so a player is paired at most once.
+    """
+    def __init__(self, base_band=100, band_growth=50, max_band=800):
+        self.base_band = base_band
+        self.band_growth = band_growth
+        self.max_band = max_band
+        self._queues = {}   # cadence -> sorted list of (elo, seq)
+        self._by_key = {}   # cadence -> {(elo, seq): QueueEntry}
+        self._by_user = {}  # user_id -> QueueEntry
+        self._arrivals = {} # cadence -> {seq: QueueEntry}, oldest first
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def band(self, entry, now):
+        waited = max(0.0, now - entry.joined_at)
+        return min(self.max_band, self.base_band + self.band_growth * waited)
+
+    def join(self, cadence, user_id, elo, channel_name, now=None):
+        """
+        Queue a player for cadence.
+        Returns (opponent, player) if a pair was formed right away, else None.
+        The opponent is the one who waited, so it plays White.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._remove(user_id)
+            entry = QueueEntry(user_id, elo, channel_name, cadence, now, next(self._seq))
+            opponent = self._closest(entry, now)
+            if opponent:
+                self._remove(opponent.user_id)
+                return opponent, entry
+            self._insert(entry)
+            return None
+
+    def leave(self, user_id, channel_name=None):
+        """
+        Take user_id out of the queue. With channel_name, only if they queued from
+        that channel: another tab of the same player keeps its place.
+        """
+        with self._lock:
+            entry = self._by_user.get(user_id)
+            if entry is None or (channel_name is not None and entry.channel_name != channel_name):
+                return False
+            self._remove(user_id)
+            return True
+
+    def sweep(self, now=None):
+        """
+        Pair waiting players whose bands have widened enough since they joined.
+        Returns a list of (white, black) entries; the longer waiter plays White.
+        """
+        now = time.monotonic() if now is None else now
+        pairs = []
+        with self._lock:
+            for cadence in list(self._queues):
+                keys = self._queues[cadence]
+                entries = self._by_key[cadence]
+                i = 0
+                while i < len(keys) - 1:
+                    a, b = entries[keys[i]], entries[keys[i + 1]]
+                    if b.elo - a.elo <= max(self.band(a, now), self.band(b, now)):
+                        white, black = (a, b) if a.joined_at <= b.joined_at else (b, a)
+                        pairs.append((white, black))
+                        self._remove(a.user_id)
+                        self._remove(b.user_id)
+                    else:
+                        i += 1
+        return pairs
+
+    def expire(self, max_wait, now=None):
+        """Remove and return everyone who has waited longer than max_wait seconds, oldest first."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            for cadence in list(self._arrivals):
+                for entry in list(self._arrivals[cadence].values()):
+                    if now - entry.joined_at <= max_wait:
+                        break
+                    expired.append(entry)
+                    self._remove(entry.user_id)
+        expired.sort(key=lambda entry: entry.seq)
+        return expired
+
+    def requeue(self, entries):
+        """
+        Put entries returned by sweep() or expire() back in their queues, as they were
+        when they joined, e.g. when their game could not be started. Players who
+        joined again in the meantime keep their new entry.
+        """
+        with self._lock:
+            for entry in entries:
+                if entry.user_id not in self._by_user:
+                    self._insert(entry)
+                    arrivals = self._arrivals[entry.cadence]
+                    self._arrivals[entry.cadence] = dict(sorted(arrivals.items()))
+
+    def waiting(self, cadence=None):
+        with self._lock:
+            if cadence is None:
+                return len(self._by_user)
+            return len(self._queues.get(cadence, ()))
+
+    def _closest(self, entry, now):
+        keys = self._queues.get(entry.cadence)
+        if not keys:
+            return None
+        entries = self._by_key[entry.cadence]
+        # Nobody has a wider band than the longest waiter, so nobody further away can qualify
+        oldest = next(iter(self._arrivals[entry.cadence].values()))
+        reach = self.band(oldest, now)
+        i = bisect.bisect_left(keys, entry.key)
+        best = None
+        best_diff = None
+        for step in (-1, 1):
+            j = i - 1 if step < 0 else i
+            while 0 <= j < len(keys):
+                candidate = entries[keys[j]]
+                diff = abs(candidate.elo - entry.elo)
+                if diff > reach or (best_diff is not None and diff >= best_diff):
+                    break
+                # The newcomer's band is base_band, never wider than the candidate's
+                if diff <= self.band(candidate, now):
+                    best, best_diff = candidate, diff
+                    break
+                j += step
+        return best
+
+    def _insert(self, entry):
+        keys = self._queues.setdefault(entry.cadence, [])
+        bisect.insort(keys, entry.key)
+        self._by_key.setdefault(entry.cadence, {})[entry.key] = entry
+        self._arrivals.setdefault(entry.cadence, {})[entry.seq] = entry
+        self._by_user[entry.user_id] = entry
+
+    def _remove(self, user_id):
+        entry = self._by_user.pop(user_id, None)
+        if entry is None:
+            return None
+        keys = self._queues[entry.cadence]
+        del keys[bisect.bisect_left(keys, entry.key)]
+        del self._by_key[entry.cadence][entry.key]
+        del self._arrivals[entry.cadence][entry.seq]
+        if not keys:
+            del self._queues[entry.cadence]
+            del self._by_key[entry.cadence]
+            del self._arrivals[entry.cadence]
+        return entry
@@ -0,0 +1,225 @@
+"""
+Process-local metrics in the Prometheus text format.
+
+A deliberately small registry (counters, gauges, histograms with fixed
+buckets), so instrumentation needs no extra dependency. Gauges can read
+their value from a function at scrape time, which is how queue depths and
+live-object counts are reported without touching the hot path. Each worker
+process has its own registry: scrape every worker, not the proxy.
+
+count_queries() counts the database queries made while it is active,
+including those run on database_sync_to_async threads (asgiref carries the
+context over); install_query_counter() hooks it into each new connection.
+"""
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labelvalues):
+        if len(labelvalues) != len(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {labelvalues}')
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self):
+        """[(suffix, label names, label values, extra labels, value)] for render()."""
+        with self._lock:
+            return [('', self.labels, key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, names, values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(self._key(labelvalues), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        # Called at scrape time: a number, or {label values: number} for labelled gauges
+        self.function = function
+
+    def set(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def value(self, *labelvalues):
+        if self.function is not None and not self.labels:
+            return self.function()
+        return self._values.get(self._key(labelvalues), 0)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        value = self.function()
+        if not self.labels:
+            return [('', (), (), (), value)]
+        return [('', self.labels, self._key(key if isinstance(key, tuple) else (key,)), (), v)
+                for key, v in sorted(value.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues):
+        entry = self._values.get(self._key(labelvalues))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(('_bucket', self.labels, key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', self.labels, key, (), total))
+                samples.append(('_count', self.labels, key, (), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-registering (e.g. a module imported twice) returns the original
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._register(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+
+# Query counting
+
+_query_count = contextvars.ContextVar('query_count', default=None)
+
+
+class QueryCount:
+    count = 0
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Count queries made in this context (and threads it hands work to) while the block runs."""
+    counter = QueryCount()
+    token = _query_count.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_count.reset(token)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_customuser_is_bot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='white_elo',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='black_elo',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
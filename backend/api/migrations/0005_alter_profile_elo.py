@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_game_white_elo_black_elo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='elo',
+            field=models.IntegerField(db_index=True, default=1500),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_alter_profile_elo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'cadence', 'created_at'], name='game_status_cadence_created'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'finished_at', 'id'], name='game_status_finished'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['white_player', 'finished_at', 'id'], name='game_white_finished'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['black_player', 'finished_at', 'id'], name='game_black_finished'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_game_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='in_explorer',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PositionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position_key', models.BigIntegerField()),
+                ('move', models.CharField(max_length=5)),
+                ('white_wins', models.IntegerField(default=0)),
+                ('black_wins', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('position_key', 'move'), name='positionstat_key_move')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_positionstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('token', models.CharField(blank=True, max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis_job', to='api.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='analysisjob_status')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MoveEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.IntegerField()),
+                ('move', models.CharField(max_length=5)),
+                ('san', models.CharField(max_length=10)),
+                ('best_move', models.CharField(blank=True, max_length=5)),
+                ('best_score', models.IntegerField()),
+                ('played_score', models.IntegerField()),
+                ('loss', models.IntegerField()),
+                ('blunder', models.BooleanField(default=False)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evaluations', to='api.game')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('game', 'ply'), name='moveevaluation_game_ply')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_analysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='glicko_rating',
+            field=models.FloatField(default=1500),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='glicko_rd',
+            field=models.FloatField(default=350),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='glicko_volatility',
+            field=models.FloatField(default=0.06),
+        ),
+    ]
@@ -0,0 +1,48 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_tournament'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='status',
+            field=models.CharField(choices=[('waiting', 'Waiting'), ('active', 'Active'), ('finished', 'Finished'), ('aborted', 'Aborted')], default='waiting', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='last_move_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedGame',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('cadence', models.CharField(choices=[('1+0', '1+0'), ('2+1', '2+1'), ('3+0', '3+0'), ('5+0', '5+0')], max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('white_elo', models.IntegerField(blank=True, null=True)),
+                ('black_elo', models.IntegerField(blank=True, null=True)),
+                ('tournament_id', models.IntegerField(blank=True, null=True)),
+                ('moves', models.BinaryField()),
+                ('evaluations', models.BinaryField(blank=True, null=True)),
+                ('white_player', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_as_white', to=settings.AUTH_USER_MODEL)),
+                ('black_player', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_as_black', to=settings.AUTH_USER_MODEL)),
+                ('winner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['finished_at', 'id'], name='archivedgame_finished'),
+                    models.Index(fields=['white_player', 'finished_at', 'id'], name='archivedgame_white_finished'),
+                    models.Index(fields=['black_player', 'finished_at', 'id'], name='archivedgame_black_finished'),
+                ],
+            },
+        ),
+    ]
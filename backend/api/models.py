@@ -2,12 +2,12 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 
 class CustomUser(AbstractUser):
-    # Additional fields if needed
-    pass
+    # Built-in engine account; its moves are played by the server
+    is_bot = models.BooleanField(default=False)
 
 class Profile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='profile')
-    elo = models.IntegerField(default=1500)
+    elo = models.IntegerField(default=1500, db_index=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     highest_elo = models.IntegerField(default=1500)
     
@@ -17,6 +17,11 @@ class Profile(models.Model):
     losses = models.IntegerField(default=0)
     draws = models.IntegerField(default=0)
 
+    # Glicko-2, only written by the recompute_ratings command (see ratings.py)
+    glicko_rating = models.FloatField(default=1500)
+    glicko_rd = models.FloatField(default=350)
+    glicko_volatility = models.FloatField(default=0.06)
+
     def __str__(self):
         return f"{self.user.username} ({self.elo})"
 
@@ -25,6 +30,8 @@ class Game(models.Model):
         ('waiting', 'Waiting'),
         ('active', 'Active'),
         ('finished', 'Finished'),
+        # Nobody moved in time; unrated (see lifecycle.py)
+        ('aborted', 'Aborted'),
     )
     CADENCE_CHOICES = (
         ('1+0', '1+0'),
@@ -45,7 +52,154 @@ class Game(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(null=True, blank=True)
+    # Lets the reaper find games nobody is playing any more
+    last_move_at = models.DateTimeField(null=True, blank=True)
+
+    # Ratings going into the game, recorded when it finishes
+    white_elo = models.IntegerField(null=True, blank=True)
+    black_elo = models.IntegerField(null=True, blank=True)
+    # Counted in PositionStat (see explorer.py)
+    in_explorer = models.BooleanField(default=False)
+    # Arena game, scored in TournamentPlayer when it finishes (see arena.py)
+    tournament = models.ForeignKey('Tournament', on_delete=models.SET_NULL, null=True, blank=True, related_name='games')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'cadence', 'created_at'], name='game_status_cadence_created'),
+            # Keyset pagination of finished games, overall and per player
+            models.Index(fields=['status', 'finished_at', 'id'], name='game_status_finished'),
+            models.Index(fields=['white_player', 'finished_at', 'id'], name='game_white_finished'),
+            models.Index(fields=['black_player', 'finished_at', 'id'], name='game_black_finished'),
+        ]
 
     def __str__(self):
         return f"Game {self.id} ({self.white_player} vs {self.black_player})"
 
+
+class ArchivedGame(models.Model):
+    """
+    A finished game moved out of Game by archive_games, keeping its id. Moves and
+    analysis are packed into bytes (see archive.py); there is no FEN or status.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    # Indexed by the composite indexes below
+    white_player = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='archived_as_white', db_index=False)
+    black_player = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='archived_as_black', db_index=False)
+    winner = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    cadence = models.CharField(max_length=10, choices=Game.CADENCE_CHOICES)
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    white_elo = models.IntegerField(null=True, blank=True)
+    black_elo = models.IntegerField(null=True, blank=True)
+    tournament_id = models.IntegerField(null=True, blank=True)
+    moves = models.BinaryField()
+    evaluations = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['finished_at', 'id'], name='archivedgame_finished'),
+            models.Index(fields=['white_player', 'finished_at', 'id'], name='archivedgame_white_finished'),
+            models.Index(fields=['black_player', 'finished_at', 'id'], name='archivedgame_black_finished'),
+        ]
+
+
+
+class PositionStat(models.Model):
+    """How often a move was played from a position, by game result (see explorer.py)."""
+    position_key = models.BigIntegerField()
+    move = models.CharField(max_length=5)
+    white_wins = models.IntegerField(default=0)
+    black_wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['position_key', 'move'], name='positionstat_key_move'),
+        ]
+
+
+class AnalysisJob(models.Model):
+    """A finished game waiting for (or done with) post-game analysis; see analysis.py."""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='analysis_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    # Lease held by the worker that claimed the job
+    token = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='analysisjob_status'),
+        ]
+
+
+class MoveEvaluation(models.Model):
+    """Engine verdict on one move of a finished game; scores are from the mover's side."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='evaluations')
+    ply = models.IntegerField()
+    move = models.CharField(max_length=5)
+    san = models.CharField(max_length=10)
+    best_move = models.CharField(max_length=5, blank=True)
+    best_score = models.IntegerField()
+    played_score = models.IntegerField()
+    loss = models.IntegerField()
+    blunder = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'ply'], name='moveevaluation_game_ply'),
+        ]
+
+
+class Tournament(models.Model):
+    """An arena: players are paired again as soon as they finish a game until ends_at (see arena.py)."""
+    name = models.CharField(max_length=100)
+    cadence = models.CharField(max_length=10, choices=Game.CADENCE_CHOICES)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ends_at'], name='tournament_ends_at'),
+        ]
+
+    def state(self, now):
+        if now < self.starts_at:
+            return 'upcoming'
+        return 'running' if now < self.ends_at else 'finished'
+
+    def __str__(self):
+        return f"{self.name} ({self.cadence})"
+
+
+class TournamentPlayer(models.Model):
+    """A player's standing in a tournament."""
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='players')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='tournament_entries')
+    score = models.IntegerField(default=0)
+    # Wins in a row; from arena.STREAK on, points are doubled
+    streak = models.IntegerField(default=0)
+    games = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tournament', 'user'], name='tournamentplayer_tournament_user'),
+        ]
+        indexes = [
+            models.Index(fields=['tournament', '-score', 'user'], name='tournamentplayer_standings'),
+        ]
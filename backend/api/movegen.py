@@ -0,0 +1,378 @@
+"""
+Bitboard antichess move generator.
+
+A lean alternative to python-chess's AntichessBoard for the server's
+legality-checking path: captures are generated first, and quiet moves are
+never generated when a capture exists. Move lists (including their order)
+match AntichessBoard.legal_moves.
+
+Squares are numbered like python-chess: a1 = 0, b1 = 1, ..., h8 = 63.
+Moves are (from_square, to_square, promotion) tuples; castling is stored
+king-to-rook internally and written as e1g1/e1c1 in UCI.
+"""
+
+WHITE, BLACK = True, False
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+
+SQUARE_NAMES = [f + r for r in '12345678' for f in 'abcdefgh']
+UCI_NAMES = [[a + b for b in SQUARE_NAMES] for a in SQUARE_NAMES]
+PROMOTION_SYMBOLS = {KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}
+PIECE_SYMBOLS = {'p': PAWN, 'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN, 'k': KING}
+# Antichess allows promoting to a king; python-chess lists it just before the queen
+PROMOTIONS = (KING, QUEEN, ROOK, BISHOP, KNIGHT)
+
+BB_RANK_1 = 0xFF
+BB_RANK_8 = 0xFF << 56
+BB_ALL = (1 << 64) - 1
+E1, E8 = 4, 60
+A1, H1, A8, H8 = 0, 7, 56, 63
+
+
+def _step_table(steps):
+    table = []
+    for square in range(64):
+        file, rank = square & 7, square >> 3
+        bb = 0
+        for df, dr in steps:
+            f, r = file + df, rank + dr
+            if 0 <= f < 8 and 0 <= r < 8:
+                bb |= 1 << (r * 8 + f)
+        table.append(bb)
+    return table
+
+
+def _ray_table(df, dr):
+    table = []
+    for square in range(64):
+        f, r = (square & 7) + df, (square >> 3) + dr
+        bb = 0
+        while 0 <= f < 8 and 0 <= r < 8:
+            bb |= 1 << (r * 8 + f)
+            f, r = f + df, r + dr
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_table([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _step_table([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+PAWN_ATTACKS = {
+    WHITE: _step_table([(-1, 1), (1, 1)]),
+    BLACK: _step_table([(-1, -1), (1, -1)]),
+}
+
+# (ray table, True if the nearest blocker is the lowest set bit)
+ROOK_RAYS = [(_ray_table(0, 1), True), (_ray_table(1, 0), True),
+             (_ray_table(0, -1), False), (_ray_table(-1, 0), False)]
+BISHOP_RAYS = [(_ray_table(1, 1), True), (_ray_table(-1, 1), True),
+               (_ray_table(1, -1), False), (_ray_table(-1, -1), False)]
+
+
+def _slide(square, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[square]
+        blockers = ray & occupied
+        if blockers:
+            nearest = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+            ray ^= table[nearest]
+        attacks |= ray
+    return attacks
+
+
+def _between_on_rank(a, b):
+    """Squares strictly between a and b, which are on the same rank."""
+    low, high = min(a, b), max(a, b)
+    return ((1 << high) - 1) & ~((1 << (low + 1)) - 1)
+
+
+def _scan_reversed(bb):
+    while bb:
+        square = bb.bit_length() - 1
+        yield square
+        bb ^= 1 << square
+
+
+class Position:
+    """Just enough antichess state for move generation and perft."""
+    __slots__ = ('white', 'black', 'pawns', 'knights', 'bishops', 'rooks', 'queens', 'kings',
+                 'promoted', 'turn', 'ep_square', 'castling')
+
+    def __init__(self):
+        self.white = self.black = 0
+        self.pawns = self.knights = self.bishops = self.rooks = self.queens = self.kings = 0
+        self.promoted = 0
+        self.turn = WHITE
+        self.ep_square = None
+        self.castling = 0
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        position = cls()
+        square = 56
+        for char in fields[0]:
+            if char == '/':
+                square -= 16
+            elif char.isdigit():
+                square += int(char)
+            elif char == '~':
+                position.promoted |= 1 << (square - 1)
+            else:
+                position._set(square, PIECE_SYMBOLS[char.lower()], char.isupper())
+                square += 1
+        position.turn = fields[1] == 'w' if len(fields) > 1 else WHITE
+
+        castling = fields[2] if len(fields) > 2 else '-'
+        rights = 0
+        for char, square in (('K', H1), ('Q', A1), ('k', H8), ('q', A8)):
+            if char in castling:
+                rights |= 1 << square
+        position.castling = position._clean_castling(rights)
+
+        ep = fields[3] if len(fields) > 3 else '-'
+        position.ep_square = SQUARE_NAMES.index(ep) if ep != '-' else None
+        return position
+
+    @classmethod
+    def from_board(cls, board):
+        """Read the bitboards of a python-chess board (no FEN round trip)."""
+        position = cls()
+        position.white, position.black = board.occupied_co[WHITE], board.occupied_co[BLACK]
+        position.pawns, position.knights, position.bishops = board.pawns, board.knights, board.bishops
+        position.rooks, position.queens, position.kings = board.rooks, board.queens, board.kings
+        position.promoted = board.promoted
+        position.turn = board.turn
+        position.ep_square = board.ep_square
+        position.castling = board.clean_castling_rights()
+        return position
+
+    def copy(self):
+        position = Position.__new__(Position)
+        for slot in Position.__slots__:
+            setattr(position, slot, getattr(self, slot))
+        return position
+
+    def _set(self, square, piece_type, color):
+        bb = 1 << square
+        if color:
+            self.white |= bb
+        else:
+            self.black |= bb
+        if piece_type == PAWN:
+            self.pawns |= bb
+        elif piece_type == KNIGHT:
+            self.knights |= bb
+        elif piece_type == BISHOP:
+            self.bishops |= bb
+        elif piece_type == ROOK:
+            self.rooks |= bb
+        elif piece_type == QUEEN:
+            self.queens |= bb
+        else:
+            self.kings |= bb
+
+    def _remove(self, square):
+        bb = 1 << square
+        if self.pawns & bb:
+            piece_type = PAWN
+        elif self.knights & bb:
+            piece_type = KNIGHT
+        elif self.bishops & bb:
+            piece_type = BISHOP
+        elif self.rooks & bb:
+            piece_type = ROOK
+        elif self.queens & bb:
+            piece_type = QUEEN
+        elif self.kings & bb:
+            piece_type = KING
+        else:
+            return None
+        mask = ~bb
+        self.pawns &= mask
+        self.knights &= mask
+        self.bishops &= mask
+        self.rooks &= mask
+        self.queens &= mask
+        self.kings &= mask
+        self.white &= mask
+        self.black &= mask
+        self.promoted &= mask
+        return piece_type
+
+    def _clean_castling(self, rights):
+        # Standard (non-960) rules: rooks in the corners, unpromoted king on e1/e8
+        castling = rights & self.rooks
+        white = castling & BB_RANK_1 & self.white & ((1 << A1) | (1 << H1))
+        black = castling & BB_RANK_8 & self.black & ((1 << A8) | (1 << H8))
+        if not self.white & self.kings & ~self.promoted & (1 << E1):
+            white = 0
+        if not self.black & self.kings & ~self.promoted & (1 << E8):
+            black = 0
+        return white | black
+
+    def _attacks(self, square, occupied):
+        bb = 1 << square
+        if self.knights & bb:
+            return KNIGHT_ATTACKS[square]
+        if self.kings & bb:
+            return KING_ATTACKS[square]
+        if self.bishops & bb:
+            return _slide(square, occupied, BISHOP_RAYS)
+        if self.rooks & bb:
+            return _slide(square, occupied, ROOK_RAYS)
+        return _slide(square, occupied, ROOK_RAYS) | _slide(square, occupied, BISHOP_RAYS)
+
+    def legal_moves(self):
+        """Legal antichess moves in python-chess order; quiet moves only if nothing can be captured."""
+        if not self.white or not self.black:
+            return []
+        ours, theirs = (self.white, self.black) if self.turn else (self.black, self.white)
+        occupied = ours | theirs
+
+        moves = self._captures(ours, theirs, occupied)
+        if moves:
+            return moves
+        return self._quiet_moves(ours, theirs, occupied)
+
+    def _captures(self, ours, theirs, occupied):
+        moves = []
+        for from_square in _scan_reversed(ours & ~self.pawns):
+            for to_square in _scan_reversed(self._attacks(from_square, occupied) & theirs):
+                moves.append((from_square, to_square, None))
+
+        pawn_attacks = PAWN_ATTACKS[self.turn]
+        pawns = self.pawns & ours
+        for from_square in _scan_reversed(pawns):
+            for to_square in _scan_reversed(pawn_attacks[from_square] & theirs):
+                if to_square < 8 or to_square >= 56:
+                    for promotion in PROMOTIONS:
+                        moves.append((from_square, to_square, promotion))
+                else:
+                    moves.append((from_square, to_square, None))
+
+        ep = self.ep_square
+        if ep is not None and not occupied & (1 << ep):
+            rank = 0xFF << (32 if self.turn else 24)
+            for from_square in _scan_reversed(pawns & PAWN_ATTACKS[not self.turn][ep] & rank):
+                moves.append((from_square, ep, None))
+        return moves
+
+    def _quiet_moves(self, ours, theirs, occupied):
+        moves = []
+        empty = ~occupied & BB_ALL
+        for from_square in _scan_reversed(ours & ~self.pawns):
+            for to_square in _scan_reversed(self._attacks(from_square, occupied) & empty):
+                moves.append((from_square, to_square, None))
+
+        if self.castling and self.kings & ours:
+            moves.extend(self._castling_moves(ours, occupied))
+
+        pawns = self.pawns & ours
+        if self.turn:
+            single = (pawns << 8) & empty
+            double = (single << 8) & empty & (0xFFFF << 16)   # ranks 3 and 4, as python-chess
+            back = -8
+        else:
+            single = (pawns >> 8) & empty
+            double = (single >> 8) & empty & (0xFFFF << 32)   # ranks 5 and 6
+            back = 8
+        for to_square in _scan_reversed(single):
+            if to_square < 8 or to_square >= 56:
+                for promotion in PROMOTIONS:
+                    moves.append((to_square + back, to_square, promotion))
+            else:
+                moves.append((to_square + back, to_square, None))
+        for to_square in _scan_reversed(double):
+            moves.append((to_square + 2 * back, to_square, None))
+        return moves
+
+    def _castling_moves(self, ours, occupied):
+        backrank = BB_RANK_1 if self.turn else BB_RANK_8
+        king = ours & self.kings & ~self.promoted & backrank
+        king &= -king
+        if not king:
+            return []
+        king_square = king.bit_length() - 1
+        base = 0 if self.turn else 56
+
+        moves = []
+        for rook_square in _scan_reversed(self.castling & backrank):
+            rook = 1 << rook_square
+            a_side = rook < king
+            king_to = base + (2 if a_side else 6)
+            rook_to = base + (3 if a_side else 5)
+            path = (_between_on_rank(king_square, king_to) | _between_on_rank(rook_square, rook_to)
+                    | (1 << king_to) | (1 << rook_to))
+            if not (occupied ^ king ^ rook) & path:
+                moves.append((king_square, rook_square, None))
+        return moves
+
+    def push(self, move):
+        """Return the position after move (which must come from legal_moves)."""
+        from_square, to_square, promotion = move
+        position = self.copy()
+        turn = self.turn
+        from_bb, to_bb = 1 << from_square, 1 << to_square
+
+        promoted = bool(position.promoted & from_bb)
+        piece_type = position._remove(from_square)
+        captured = position._remove(to_square) if not (to_bb & (self.white if turn else self.black)) else None
+
+        position.castling &= ~to_bb & ~from_bb
+        if piece_type == KING and not promoted:
+            position.castling &= ~(BB_RANK_1 if turn else BB_RANK_8)
+        elif captured == KING and not self.promoted & to_bb:
+            if turn and to_square >= 56:
+                position.castling &= ~BB_RANK_8
+            elif not turn and to_square < 8:
+                position.castling &= ~BB_RANK_1
+
+        position.ep_square = None
+        if piece_type == PAWN:
+            diff = to_square - from_square
+            if diff == 16 and 8 <= from_square < 16:
+                position.ep_square = from_square + 8
+            elif diff == -16 and 48 <= from_square < 56:
+                position.ep_square = from_square - 8
+            elif to_square == self.ep_square and abs(diff) in (7, 9) and not captured:
+                position._remove(to_square - 8 if turn else to_square + 8)
+
+        if promotion:
+            promoted = True
+            piece_type = promotion
+
+        if piece_type == KING and to_bb & (self.white if turn else self.black):
+            # Castling: the rook sits on to_square
+            position._remove(to_square)
+            base = 0 if turn else 56
+            a_side = (to_square & 7) < (from_square & 7)
+            position._set(base + (2 if a_side else 6), KING, turn)
+            position._set(base + (3 if a_side else 5), ROOK, turn)
+        else:
+            position._set(to_square, piece_type, turn)
+            if promoted:
+                position.promoted |= to_bb
+
+        position.turn = not turn
+        return position
+
+    def uci(self, move):
+        from_square, to_square, promotion = move
+        if self.kings & (1 << from_square) and (self.white if self.turn else self.black) & (1 << to_square):
+            # Castling is king-to-rook internally; standard UCI moves the king two files
+            if from_square in (E1, E8) and (to_square & 7) in (0, 7):
+                to_square = from_square + (2 if to_square & 7 else -2)
+        name = UCI_NAMES[from_square][to_square]
+        return name + PROMOTION_SYMBOLS[promotion] if promotion else name
+
+    def legal_moves_uci(self):
+        return [self.uci(move) for move in self.legal_moves()]
+
+
+def perft(position, depth):
+    if depth == 0:
+        return 1
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+    return sum(perft(position.push(move), depth - 1) for move in moves)
@@ -0,0 +1,51 @@
+"""
+Recent moves per game, for cheap reconnects.
+
+Every move_applied broadcast is kept here, already encoded (in each wire
+format), in a fixed-size ring per game. A client that reconnects says which
+ply it last saw and gets just the moves after it, with no query and no
+serialization; if the gap has fallen out of the ring (or this process never
+saw the game), since() returns None and the caller sends the full state
+instead.
+"""
+import threading
+from collections import OrderedDict, deque
+
+
+class MoveLog:
+    def __init__(self, size=64, max_games=10000):
+        self.size = size
+        self.max_games = max_games
+        self._games = OrderedDict()  # game id -> deque of (ply, message)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._games)
+
+    def append(self, game_id, ply, message):
+        key = str(game_id)
+        with self._lock:
+            moves = self._games.get(key)
+            if moves is None or (moves and moves[-1][0] != ply - 1):
+                # First move seen here, or moves were made elsewhere: start over
+                moves = self._games[key] = deque(maxlen=self.size)
+            moves.append((ply, message))
+            self._games.move_to_end(key)
+            while len(self._games) > self.max_games:
+                self._games.popitem(last=False)
+
+    def since(self, game_id, ply):
+        """Encoded moves after ply, oldest first; None if they aren't all here."""
+        with self._lock:
+            moves = self._games.get(str(game_id))
+            if not moves or ply < moves[0][0] - 1 or ply > moves[-1][0]:
+                return None
+            return [message for move_ply, message in moves if move_ply > ply]
+
+    def discard(self, game_id):
+        with self._lock:
+            self._games.pop(str(game_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
@@ -0,0 +1,123 @@
+"""
+Bulk PGN export of finished games.
+
+Rows are read as plain values in id order, a chunk at a time, and each game is
+formatted on its own, so memory stays flat however many games match. iter_pgn
+is for writing files; aiter_pgn feeds StreamingHttpResponse under ASGI, where a
+synchronous iterator would be buffered whole before the first byte goes out.
+Both take several querysets, so archived games (whose moves are unpacked back
+to SAN, see archive.py) can go out ahead of the live ones.
+"""
+from channels.db import database_sync_to_async
+from django.db.models import Q
+
+from .clocks import parse_cadence
+from .archive import archived_pgn
+from .models import ArchivedGame, Game
+
+EXPORT_FIELDS = (
+    'id', 'pgn', 'cadence', 'created_at', 'finished_at', 'white_player_id', 'black_player_id', 'winner_id',
+    'white_player__username', 'black_player__username', 'white_elo', 'black_elo',
+)
+ARCHIVE_EXPORT_FIELDS = tuple('moves' if field == 'pgn' else field for field in EXPORT_FIELDS)
+LINE_WIDTH = 79
+
+
+def export_queryset(since=None, until=None, cadence=None, player=None, archived=False):
+    """
+    Finished games, optionally filtered by finish date (inclusive), cadence and
+    username; from ArchivedGame if archived.
+    """
+    games = ArchivedGame.objects.all() if archived else Game.objects.filter(status='finished')
+    if since:
+        games = games.filter(finished_at__date__gte=since)
+    if until:
+        games = games.filter(finished_at__date__lte=until)
+    if cadence:
+        games = games.filter(cadence=cadence)
+    if player:
+        games = games.filter(Q(white_player__username=player) | Q(black_player__username=player))
+    return games.order_by('id')
+
+
+def _tag(name, value):
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'[{name} "{value}"]\n'
+
+
+def game_result(row):
+    if row['winner_id'] is None:
+        return '1/2-1/2'
+    return '1-0' if row['winner_id'] == row['white_player_id'] else '0-1'
+
+
+def movetext(sans, result):
+    """Numbered SAN moves followed by the result, wrapped at LINE_WIDTH."""
+    tokens = []
+    for i, san in enumerate(sans):
+        if i % 2 == 0:
+            tokens.append(f'{i // 2 + 1}.')
+        tokens.append(san)
+    tokens.append(result)
+
+    lines, line = [], ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines)
+
+
+def game_pgn(row):
+    """One game (a values() row with EXPORT_FIELDS) as a PGN record with a trailing blank line."""
+    result = game_result(row)
+    base, increment = parse_cadence(row['cadence'])
+    headers = [
+        _tag('Event', f"Rated antichess game ({row['cadence']})"),
+        _tag('Site', 'Antichess Online'),
+        # Same date the since/until filters go by
+        _tag('Date', (row['finished_at'] or row['created_at']).strftime('%Y.%m.%d')),
+        _tag('Round', '-'),
+        _tag('White', row['white_player__username'] or '?'),
+        _tag('Black', row['black_player__username'] or '?'),
+        _tag('Result', result),
+        _tag('WhiteElo', row['white_elo'] if row['white_elo'] is not None else '?'),
+        _tag('BlackElo', row['black_elo'] if row['black_elo'] is not None else '?'),
+        _tag('TimeControl', f'{base:.0f}+{increment:.0f}'),
+        _tag('Variant', 'Antichess'),
+        _tag('GameId', row['id']),
+    ]
+    pgn = row['pgn'] if 'pgn' in row else archived_pgn(row['moves'])
+    return ''.join(headers) + '\n' + movetext(pgn.split(), result) + '\n\n'
+
+
+def _fields(games):
+    return ARCHIVE_EXPORT_FIELDS if games.model is ArchivedGame else EXPORT_FIELDS
+
+
+def iter_pgn(*querysets, chunk_size=1000):
+    """Yield one PGN record per game, fetching chunk_size rows at a time."""
+    for games in querysets:
+        for row in games.values(*_fields(games)).iterator(chunk_size=chunk_size):
+            yield game_pgn(row)
+
+
+async def aiter_pgn(*querysets, chunk_size=500):
+    """
+    Async version of iter_pgn. Pages through games by id instead of holding a
+    cursor open, since each fetch may run on a different thread.
+    """
+    for games in querysets:
+        fetch = database_sync_to_async(
+            lambda last_id, games=games: list(games.filter(id__gt=last_id).values(*_fields(games))[:chunk_size])
+        )
+        last_id = 0
+        while True:
+            rows = await fetch(last_id)
+            if not rows:
+                break
+            yield ''.join(game_pgn(row) for row in rows)
+            last_id = rows[-1]['id']
@@ -0,0 +1,140 @@
+"""
+Opt-in sampling profiler for one game room at a time.
+
+While a room is being profiled, a background thread looks at the stacks of
+the event loop and the rules worker threads every `interval` seconds. A sample
+counts for the room when the loop is running one of the room's consumer
+tasks, or a worker is running rules code on the room's behalf (tagged by
+RulesExecutor through the `current_room` context variable). Nothing is
+sampled, and nearly nothing is recorded, while no room is being profiled.
+
+Stacks are counted in the collapsed "frame;frame;frame count" format that
+flamegraph tools read.
+"""
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+
+current_room = contextvars.ContextVar('current_room', default=None)
+
+
+class RoomProfiler:
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._rooms = {}                          # room -> {'samples': Counter, 'until': monotonic or None, ...}
+        self._tasks = weakref.WeakKeyDictionary()  # consumer task -> room
+        self._threads = {}                         # worker thread id -> room
+        self._loop = None
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    # Hooks
+
+    def bind(self, room):
+        """Called from a consumer's task: tasks (and the threads they hand work to) belong to room."""
+        current_room.set(room)
+        task = asyncio.current_task()
+        if task is not None:
+            self._loop = task.get_loop()
+            self._tasks[task] = room
+
+    def tag(self, fn):
+        """Wrap fn so that, while it runs on a worker thread, samples there count for the current room."""
+        room = current_room.get()
+        if room is None or room not in self._rooms:
+            return fn
+
+        def tagged(*args, **kwargs):
+            ident = threading.get_ident()
+            self._threads[ident] = room
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._threads.pop(ident, None)
+        return tagged
+
+    # Control
+
+    def start(self, room, duration=None):
+        with self._lock:
+            self._rooms[room] = {
+                'samples': Counter(),
+                'started': time.monotonic(),
+                'until': time.monotonic() + duration if duration else None,
+            }
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='room-profiler', daemon=True)
+                self._sampler.start()
+
+    def stop(self, room):
+        """Stop profiling room and return its report (see report())."""
+        with self._lock:
+            state = self._rooms.pop(room, None)
+        return self._report(state)
+
+    def report(self, room):
+        """{'samples', 'seconds', 'running', 'stacks': 'collapsed stacks'} so far, or None."""
+        with self._lock:
+            state = self._rooms.get(room)
+        return self._report(state)
+
+    def profiling(self):
+        with self._lock:
+            return sorted(self._rooms)
+
+    def _report(self, state):
+        if state is None:
+            return None
+        samples = state['samples']
+        return {
+            'samples': sum(samples.values()),
+            'seconds': round(time.monotonic() - state['started'], 3),
+            'running': state['until'] is None or time.monotonic() < state['until'],
+            'stacks': ''.join(f'{stack} {count}\n' for stack, count in samples.most_common()),
+        }
+
+    # Sampling
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                active = {room: state for room, state in self._rooms.items()
+                          if state['until'] is None or now < state['until']}
+                if not active:
+                    # Reports of finished runs stay readable until stopped
+                    self._sampler = None
+                    return
+            self._sample(active)
+            time.sleep(self.interval)
+
+    def _sample(self, active):
+        frames = sys._current_frames()
+        owners = dict(self._threads)
+        loop = self._loop
+        if loop is not None and loop._thread_id is not None:
+            task = asyncio.current_task(loop)
+            room = self._tasks.get(task) if task is not None else None
+            if room is not None:
+                owners[loop._thread_id] = room
+        for ident, room in owners.items():
+            state = active.get(room)
+            frame = frames.get(ident)
+            if state is not None and frame is not None:
+                state['samples'][self._collapse(frame)] += 1
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+profiler = RoomProfiler()
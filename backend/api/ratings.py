@@ -0,0 +1,166 @@
+"""
+Batch rating recomputation from the full finished-game history.
+
+Games are grouped into rating periods (one day by default). Within a period
+every game is rated against the ratings the players had when the period
+began, so each period is a handful of NumPy operations over all of its games
+at once, and a history of millions of games is a few thousand vectorised
+steps. Two systems are computed:
+
+- Elo with the live K factor, the batch form of rules.calculate_elo (within a
+  period, a player's rating changes by K times the sum of their score minus
+  expectation over all their games);
+- Glicko-2 (rating, deviation, volatility) as specified by Glickman, with the
+  volatility solved by the Illinois iteration, vectorised over the players of
+  a period.
+
+Nothing here touches the database; see the recompute_ratings command.
+"""
+import numpy as np
+
+ELO_START = 1500
+ELO_K = 40
+
+GLICKO_RATING = 1500.0
+GLICKO_RD = 350.0
+GLICKO_VOLATILITY = 0.06
+GLICKO_TAU = 0.5
+GLICKO_SCALE = 173.7178
+EPSILON = 1e-6
+
+
+def periods(timestamps, period_seconds):
+    """Period index of each timestamp (seconds), counted from the first one."""
+    if not len(timestamps):
+        return np.zeros(0, dtype=np.int64)
+    return ((timestamps - timestamps.min()) // period_seconds).astype(np.int64)
+
+
+def _period_slices(period_index):
+    """(start, end) row ranges of each non-empty period; rows must be sorted by period."""
+    boundaries = np.flatnonzero(np.diff(period_index)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(period_index)]))
+    return zip(starts.tolist(), ends.tolist())
+
+
+def elo(white, black, score, period_index, players, k=ELO_K, start=ELO_START):
+    """
+    Elo after every period. white and black are player indexes (0..players-1),
+    score is White's score (1, 0.5, 0). Returns (ratings, highest rating after
+    any period) as float arrays of length players.
+    """
+    ratings = np.full(players, float(start))
+    highest = ratings.copy()
+    for lo, hi in _period_slices(period_index):
+        w, b, s = white[lo:hi], black[lo:hi], score[lo:hi]
+        expected = 1 / (1 + 10 ** ((ratings[b] - ratings[w]) / 400))
+        change = k * (s - expected)
+        ratings += np.bincount(w, weights=change, minlength=players) - np.bincount(b, weights=change, minlength=players)
+        np.maximum(highest, ratings, out=highest)
+    return ratings, highest
+
+
+def _g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+
+def _new_volatility(sigma, phi, v, delta, tau):
+    """Glicko-2 step 5 for many players at once."""
+    a = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    big = delta ** 2 > phi ** 2 + v
+    A = a.copy()
+    B = np.where(big, np.log(np.maximum(delta ** 2 - phi ** 2 - v, 1e-300)), a - tau)
+    # Where the bracket isn't found yet, step further left
+    pending = ~big & (f(B) < 0)
+    steps = 1
+    while pending.any() and steps < 100:
+        steps += 1
+        B[pending] = a[pending] - steps * tau
+        pending &= f(B) < 0
+
+    fA, fB = f(A), f(B)
+    for _ in range(100):
+        active = np.abs(B - A) > EPSILON
+        if not active.any():
+            break
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        crossed = fC * fB <= 0
+        A = np.where(active & crossed, B, A)
+        fA = np.where(active & crossed, fB, np.where(active, fA / 2, fA))
+        B = np.where(active, C, B)
+        fB = np.where(active, fC, fB)
+    return np.exp(A / 2)
+
+
+def glicko2(white, black, score, period_index, players, tau=GLICKO_TAU, initial=None):
+    """
+    Glicko-2 after every period; arguments as for elo(). initial is an optional
+    (rating, deviation, volatility) of arrays to start from instead of the
+    defaults. Returns (rating, deviation, volatility) float arrays of length players.
+    """
+    max_phi = GLICKO_RD / GLICKO_SCALE
+    if initial is None:
+        mu = np.zeros(players)
+        phi = np.full(players, max_phi)
+        sigma = np.full(players, GLICKO_VOLATILITY)
+    else:
+        rating, deviation, volatility = (np.asarray(column, dtype=np.float64) for column in initial)
+        mu = (rating - GLICKO_RATING) / GLICKO_SCALE
+        phi = deviation / GLICKO_SCALE
+        sigma = volatility.copy()
+
+    for lo, hi in _period_slices(period_index):
+        # Each game from both sides: player, opponent, player's score
+        player = np.concatenate((white[lo:hi], black[lo:hi]))
+        opponent = np.concatenate((black[lo:hi], white[lo:hi]))
+        s = np.concatenate((score[lo:hi], 1 - score[lo:hi]))
+
+        g = _g(phi[opponent])
+        expected = 1 / (1 + np.exp(-g * (mu[player] - mu[opponent])))
+        v_inv = np.bincount(player, weights=g ** 2 * expected * (1 - expected), minlength=players)
+        improvement = np.bincount(player, weights=g * (s - expected), minlength=players)
+
+        played = v_inv > 0
+        rated = np.flatnonzero(played)
+        v = 1 / v_inv[rated]
+        delta = v * improvement[rated]
+        new_sigma = _new_volatility(sigma[rated], phi[rated], v, delta, tau)
+
+        # Players who sat the period out only grow less certain
+        idle = ~played
+        phi[idle] = np.minimum(np.sqrt(phi[idle] ** 2 + sigma[idle] ** 2), max_phi)
+
+        phi_star = np.sqrt(phi[rated] ** 2 + new_sigma ** 2)
+        new_phi = 1 / np.sqrt(1 / phi_star ** 2 + v_inv[rated])
+        mu[rated] += new_phi ** 2 * improvement[rated]
+        phi[rated] = new_phi
+        sigma[rated] = new_sigma
+
+    return mu * GLICKO_SCALE + GLICKO_RATING, phi * GLICKO_SCALE, sigma
+
+
+def results(white, black, winner):
+    """White's score per game from winner ids (0 or negative for a draw)."""
+    return np.where(winner == white, 1.0, np.where(winner == black, 0.0, 0.5))
+
+
+def tallies(white, black, score, players):
+    """(games, wins, losses, draws) per player as int arrays."""
+    def count(indexes, weights=None):
+        return np.bincount(indexes, weights=weights, minlength=players).astype(np.int64)
+
+    both = np.concatenate((white, black))
+    player_score = np.concatenate((score, 1 - score))
+    return (
+        count(both),
+        count(both, player_score == 1),
+        count(both, player_score == 0),
+        count(both, player_score == 0.5),
+    )
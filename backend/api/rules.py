@@ -1,6 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
 import chess
 import chess.variant
 
+from . import movegen
+
+# Legal move generation backend: 'python-chess' or 'bitboard' (api.movegen)
+MOVEGEN_BACKENDS = ('python-chess', 'bitboard')
+_movegen = 'python-chess'
+
+def set_movegen(name):
+    global _movegen
+    if name not in MOVEGEN_BACKENDS:
+        raise ValueError(f"Unknown move generator {name!r}, expected one of {MOVEGEN_BACKENDS}")
+    _movegen = name
+    # Cached move lists came from the previous backend
+    position_cache.clear()
+
+class PositionCache:
+    """
+    Bounded LRU cache for results that depend only on the position.
+    Keys combine a kind ('moves', 'result') with position_key(fen).
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+position_cache = PositionCache()
+
+def position_key(fen):
+    """Placement, side to move, castling and en passant: the FEN without its move clocks."""
+    return ' '.join(fen.split(' ')[:4])
+
+def _halfmove_clock(fen):
+    fields = fen.split(' ')
+    return int(fields[4]) if len(fields) > 4 else 0
+
+def _compute_legal_moves(fen):
+    if _movegen == 'bitboard':
+        return movegen.Position.from_fen(fen).legal_moves_uci()
+    board = chess.variant.AntichessBoard(fen)
+    return [move.uci() for move in board.legal_moves]
+
+def _compute_result(key):
+    # Clocks zeroed: the 75-move rule is applied by the caller from the real halfmove clock
+    board = chess.variant.AntichessBoard(key + ' 0 1')
+    return board.result() if board.is_game_over() else None
+
+def _cached_legal_moves(fen):
+    key = position_key(fen)
+    return position_cache.get(('moves', key), lambda: _compute_legal_moves(key + ' 0 1'))
+
+def _cached_result(fen):
+    key = position_key(fen)
+    result = position_cache.get(('result', key), lambda: _compute_result(key))
+    if result is None and _halfmove_clock(fen) >= 150 and _cached_legal_moves(fen):
+        return '1/2-1/2'
+    return result
+
+def warm_position_cache(fens):
+    """Pre-compute cached results for the given positions (e.g. the most common openings)."""
+    for fen in fens:
+        _cached_legal_moves(fen)
+        _cached_result(fen)
+
 def get_initial_fen():
     board = chess.variant.AntichessBoard()
     return board.fen()
@@ -21,18 +129,33 @@ def make_move(fen, move_uci):
         return fen, None, "Illegal move"
 
 def get_legal_moves(fen):
-    board = chess.variant.AntichessBoard(fen)
-    return [move.uci() for move in board.legal_moves]
+    return list(_cached_legal_moves(fen))
 
 def is_game_over(fen):
-    board = chess.variant.AntichessBoard(fen)
-    return board.is_game_over()
+    return _cached_result(fen) is not None
 
 def get_game_result(fen):
-    board = chess.variant.AntichessBoard(fen)
-    if board.is_game_over():
-        return board.result()
-    return None
+    return _cached_result(fen)
+
+def perft(board, depth):
+    """Count leaf nodes of the legal move tree to depth (move generator correctness and speed)."""
+    if depth == 0:
+        return 1
+    moves = list(board.legal_moves)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+def fen_ply(fen):
+    """Number of half-moves played before the position in fen (0 at the start)."""
+    fields = fen.split(' ')
+    fullmove = int(fields[5]) if len(fields) > 5 else 1
+    return 2 * (fullmove - 1) + (1 if fields[1] == 'b' else 0)
 
 def calculate_elo(white_elo, black_elo, result):
     """
@@ -50,3 +173,133 @@ def calculate_elo(white_elo, black_elo, result):
     new_black_elo = round(black_elo + K * ((1 - result) - E_black))
     
     return new_white_elo, new_black_elo
+
+
+class GameSession:
+    """
+    Live board for one active game.
+    Moves are applied incrementally, so the FEN is only parsed once per game.
+    """
+    def __init__(self, game_id, fen):
+        self.game_id = game_id
+        self.board = chess.variant.AntichessBoard(fen)
+        self.fen = self.board.fen()
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._legal_moves = None
+        # Server-side GameClock, attached by the consumer
+        self.clock = None
+
+    def push(self, move_uci):
+        """
+        Apply a move to the live board.
+        Returns new FEN, SAN of the move and an error message (same shape as make_move).
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            try:
+                move = chess.Move.from_uci(move_uci)
+            except (TypeError, ValueError):
+                return self.fen, None, "Illegal move"
+
+            if not self.board.is_legal(move):
+                return self.fen, None, "Illegal move"
+
+            san = self.board.san(move)
+            self.board.push(move)
+            self.fen = self.board.fen()
+            self._legal_moves = None
+            return self.fen, san, None
+
+    def apply(self, move_uci):
+        """
+        push(), then result() and, while the game goes on, legal_moves(): one call for
+        everything a move needs. Returns new FEN, SAN, error message, result and legal moves.
+        """
+        fen, san, error = self.push(move_uci)
+        if error:
+            return fen, None, error, None, []
+        result = self.result()
+        return fen, san, None, result, [] if result else self.legal_moves()
+
+    @property
+    def ply(self):
+        return self.board.ply()
+
+    def legal_moves(self):
+        with self.lock:
+            if self._legal_moves is None:
+                self._legal_moves = position_cache.get(('moves', position_key(self.fen)), self._generate_moves)
+            return self._legal_moves
+
+    def _generate_moves(self):
+        if _movegen == 'bitboard':
+            return movegen.Position.from_board(self.board).legal_moves_uci()
+        return [move.uci() for move in self.board.legal_moves]
+
+    def is_game_over(self):
+        with self.lock:
+            return self.board.is_game_over()
+
+    def result(self):
+        """Game result string ('1-0', '0-1', '1/2-1/2') or None while the game is running."""
+        with self.lock:
+            if self.board.is_game_over():
+                return self.board.result()
+            return None
+
+
+class SessionRegistry:
+    """
+    Keeps one GameSession per active game.
+    Sessions are dropped when the game ends (evict) or after idle_timeout seconds without a move.
+    """
+    def __init__(self, idle_timeout=600):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, game_id, fen):
+        """
+        Return the live session for game_id, creating it from fen if needed.
+        If the stored position no longer matches fen (e.g. the game was changed elsewhere),
+        the session is rebuilt from fen and keeps its clock.
+        """
+        key = str(game_id)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.idle_timeout:
+                self._sweep(now)
+
+            session = self._sessions.get(key)
+            if session is None or session.fen != fen:
+                stale, session = session, GameSession(key, fen)
+                if stale is not None:
+                    session.clock = stale.clock
+                self._sessions[key] = session
+            session.last_used = now
+            return session
+
+    def peek(self, game_id):
+        """Return the live session for game_id without creating one."""
+        with self._lock:
+            return self._sessions.get(str(game_id))
+
+    def evict(self, game_id):
+        with self._lock:
+            self._sessions.pop(str(game_id), None)
+
+    def evict_idle(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+
+    def _sweep(self, now):
+        idle = [key for key, session in self._sessions.items()
+                if now - session.last_used > self.idle_timeout]
+        for key in idle:
+            del self._sessions[key]
+        self._last_sweep = now
+
+    def __len__(self):
+        return len(self._sessions)
@@ -7,7 +7,7 @@ User = get_user_model()
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
-        fields = ['elo', 'avatar', 'highest_elo', 'games_played', 'wins', 'losses', 'draws']
+        fields = ['elo', 'avatar', 'highest_elo', 'games_played', 'wins', 'losses', 'draws', 'glicko_rating', 'glicko_rd']
 
 class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
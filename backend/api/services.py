@@ -0,0 +1,273 @@
+from collections import Counter
+
+import threading
+
+import chess.variant
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .arena import Arena, award
+from .explorer import add_counts, count_positions, game_positions
+from .leaderboard import Leaderboard
+from .models import AnalysisJob, CustomUser, Game, Profile, Tournament, TournamentPlayer
+from .rules import calculate_elo, position_key, warm_position_cache
+
+RESULT_SCORES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+leaderboard = Leaderboard(refresh_interval=getattr(settings, 'LEADERBOARD', {}).get('REFRESH_INTERVAL', 300))
+
+# Arenas with players connected to this process, by tournament id
+arenas = {}
+_arenas_lock = threading.Lock()
+_arena_settings = getattr(settings, 'ARENA', {})
+
+
+def finish_game(game, result, positions=None):
+    """
+    Finish game with result ('1-0', '0-1', '1/2-1/2') in a single transaction:
+    the game row (fen, pgn, status, winner, pre-game ratings), both players'
+    profiles, the opening explorer's position counts, the game's analysis job and,
+    for an arena game, both players' tournament scores.
+    Counters and Elo change through F() expressions, so concurrent finishes for
+    the same player can't overwrite each other.
+    Updates game in place and returns (new_white_elo, new_black_elo), or None if
+    the game had already ended (finished or aborted).
+    positions is explorer.game_positions(game.pgn); callers on the event loop
+    replay it on the rules pool, since this runs on the one DB thread.
+    """
+    score_white = RESULT_SCORES.get(result, 0.5)
+    if score_white == 1:
+        winner_id = game.white_player_id
+    elif score_white == 0:
+        winner_id = game.black_player_id
+    else:
+        winner_id = None
+    finished_at = timezone.now()
+    if positions is None:
+        positions = game_positions(game.pgn)
+    explorer_counts = count_positions(positions, result)
+
+    with transaction.atomic():
+        elos = dict(
+            Profile.objects.select_for_update()
+            .filter(user_id__in=[game.white_player_id, game.black_player_id])
+            .values_list('user_id', 'elo')
+        )
+        white_elo = elos.get(game.white_player_id, 1500)
+        black_elo = elos.get(game.black_player_id, 1500)
+        updated = (
+            Game.objects.filter(id=game.id, status='active')
+            .update(fen=game.fen, pgn=game.pgn, status='finished', winner_id=winner_id, finished_at=finished_at,
+                    white_elo=white_elo, black_elo=black_elo, in_explorer=True)
+        )
+        if not updated:
+            return None
+        add_counts(explorer_counts)
+        if getattr(settings, 'ANALYSIS', {}).get('ENABLED', True):
+            AnalysisJob.objects.create(game_id=game.id)
+
+        new_white, new_black = calculate_elo(white_elo, black_elo, score_white)
+        _record_result(game.white_player_id, new_white - white_elo, score_white)
+        _record_result(game.black_player_id, new_black - black_elo, 1 - score_white)
+        transaction.on_commit(lambda: _rank(game.white_player_id, new_white, game.black_player_id, new_black))
+        if game.tournament_id is not None:
+            scores = _score_arena_game(game, score_white)
+            ratings = {game.white_player_id: new_white, game.black_player_id: new_black}
+            transaction.on_commit(lambda: _arena_results(game.id, game.tournament_id, scores, ratings))
+
+    game.status = 'finished'
+    game.winner_id = winner_id
+    game.finished_at = finished_at
+    game.white_elo = white_elo
+    game.black_elo = black_elo
+    return new_white, new_black
+
+
+def abort_game(game):
+    """
+    End an active game without a result or rating change. Returns False if it
+    had already ended. Arena players go back to the pool.
+    """
+    with transaction.atomic():
+        updated = Game.objects.filter(id=game.id, status='active').update(status='aborted',
+                                                                          finished_at=timezone.now())
+        if updated and game.tournament_id is not None:
+            unchanged = dict.fromkeys((game.white_player_id, game.black_player_id))
+            transaction.on_commit(lambda: _arena_results(game.id, game.tournament_id, unchanged, {}))
+    if updated:
+        game.status = 'aborted'
+    return bool(updated)
+
+
+def _record_result(user_id, elo_delta, score):
+    new_elo = F('elo') + elo_delta
+    Profile.objects.filter(user_id=user_id).update(
+        elo=new_elo,
+        highest_elo=Case(When(highest_elo__lt=new_elo, then=new_elo), default=F('highest_elo')),
+        games_played=F('games_played') + 1,
+        wins=F('wins') + (1 if score == 1 else 0),
+        losses=F('losses') + (1 if score == 0 else 0),
+        draws=F('draws') + (1 if score == 0.5 else 0),
+    )
+
+
+def _score_arena_game(game, score_white):
+    """Add the game's points to both players' TournamentPlayer rows. Returns {user_id: new score}."""
+    entries = TournamentPlayer.objects.select_for_update().filter(
+        tournament_id=game.tournament_id, user_id__in=[game.white_player_id, game.black_player_id])
+    scores = {}
+    for entry in entries:
+        score = score_white if entry.user_id == game.white_player_id else 1 - score_white
+        points, entry.streak = award(score, entry.streak)
+        entry.score += points
+        entry.games += 1
+        entry.wins += 1 if score == 1 else 0
+        entry.save(update_fields=['score', 'streak', 'games', 'wins'])
+        scores[entry.user_id] = entry.score
+    return scores
+
+
+def _arena_results(game_id, tournament_id, scores, ratings):
+    # The arena lives in the worker its socket path is routed to, usually not this one
+    async_to_sync(get_channel_layer().group_send)(f'arena_{tournament_id}', {
+        'type': 'arena_result',
+        'game_id': game_id,
+        'scores': scores,
+        'ratings': ratings,
+    })
+
+
+def _rank(*pairs):
+    for user_id, elo in zip(pairs[::2], pairs[1::2]):
+        if user_id is not None:
+            leaderboard.update(user_id, elo)
+
+
+def rebuild_leaderboard():
+    """Reload the leaderboard index from every profile. Returns the number of players."""
+    leaderboard.load(Profile.objects.order_by('-elo').values_list('user_id', 'elo').iterator(chunk_size=5000))
+    return len(leaderboard)
+
+
+def current_leaderboard():
+    """The leaderboard, reloaded first if it was never built or is due a refresh."""
+    if leaderboard.stale():
+        rebuild_leaderboard()
+    return leaderboard
+
+
+def leaderboard_entries(ranked):
+    """Attach usernames and counters to [(rank, user_id, elo)] from the leaderboard."""
+    profiles = {
+        row['user_id']: row for row in Profile.objects.filter(user_id__in=[user_id for _, user_id, _ in ranked])
+        .values('user_id', 'user__username', 'games_played', 'wins', 'losses', 'draws')
+    }
+    entries = []
+    for rank, user_id, elo in ranked:
+        row = profiles.get(user_id)
+        if row is None:
+            continue
+        entries.append({
+            'rank': rank,
+            'user_id': user_id,
+            'username': row['user__username'],
+            'elo': elo,
+            'games_played': row['games_played'],
+            'wins': row['wins'],
+            'losses': row['losses'],
+            'draws': row['draws'],
+        })
+    return entries
+
+
+def open_arena(tournament_id):
+    """
+    The live Arena of a tournament that hasn't finished, loaded from the
+    database on first use in this process; None if there is no such tournament.
+    """
+    arena = arenas.get(tournament_id)
+    if arena is not None:
+        return arena
+    tournament = Tournament.objects.filter(id=tournament_id, ends_at__gt=timezone.now()).first()
+    if tournament is None:
+        return None
+    with _arenas_lock:
+        if tournament_id not in arenas:
+            arena = Arena(
+                tournament.id, tournament.cadence, tournament.starts_at, tournament.ends_at,
+                window=_arena_settings.get('WINDOW', 8),
+                score_weight=_arena_settings.get('SCORE_WEIGHT', 100),
+                rematch_memory=_arena_settings.get('REMATCH_MEMORY', 3),
+            )
+            arena.load(TournamentPlayer.objects.filter(tournament_id=tournament_id).values_list('user_id', 'score'))
+            arenas[tournament_id] = arena
+        return arenas[tournament_id]
+
+
+def enter_tournament(tournament_id, user_id):
+    """Register user_id in the tournament if needed. Returns (elo, tournament score)."""
+    entry, _ = TournamentPlayer.objects.get_or_create(tournament_id=tournament_id, user_id=user_id)
+    elo = Profile.objects.filter(user_id=user_id).values_list('elo', flat=True).first() or 1500
+    return elo, entry.score
+
+
+def tournament_standings(tournament_id, offset=0, limit=50):
+    """[{rank, user_id, username, score, games, wins, streak}] by score, ties by user id."""
+    rows = (
+        TournamentPlayer.objects.filter(tournament_id=tournament_id).order_by('-score', 'user_id')
+        .values('user_id', 'user__username', 'score', 'games', 'wins', 'streak')[offset:offset + limit]
+    )
+    standings = []
+    previous = rank = None
+    for position, row in enumerate(rows, start=offset + 1):
+        if row['score'] != previous:
+            previous, rank = row['score'], position
+            if position == offset + 1 and offset:
+                # The score may be shared with players on the previous page
+                rank = TournamentPlayer.objects.filter(tournament_id=tournament_id, score__gt=row['score']).count() + 1
+        standings.append({'rank': rank, 'username': row.pop('user__username'), **row})
+    return standings
+
+
+def live_standings(arena, limit):
+    """The top of an arena's in-memory standings: [{rank, user_id, username, score}]."""
+    ranked = arena.standings.page(0, limit)
+    names = dict(CustomUser.objects.filter(id__in=[user_id for _, user_id, _ in ranked]).values_list('id', 'username'))
+    return [
+        {'rank': rank, 'user_id': user_id, 'username': names.get(user_id), 'score': score}
+        for rank, user_id, score in ranked
+    ]
+
+
+def prewarm_position_cache(positions=256, games=1000):
+    """
+    Fill rules.position_cache with the positions that occur most often in the
+    last `games` finished games. Returns the number of positions warmed.
+    """
+    counts = Counter()
+    pgns = Game.objects.filter(status='finished').order_by('-id').values_list('pgn', flat=True)[:games]
+    for pgn in pgns.iterator():
+        board = chess.variant.AntichessBoard()
+        for san in pgn.split():
+            counts[position_key(board.fen())] += 1
+            try:
+                board.push_san(san)
+            except ValueError:
+                break
+    common = [key for key, _ in counts.most_common(positions)]
+    warm_position_cache(common)
+    return len(common)
+
+
+def get_bot_user(username='antichess_bot'):
+    """The engine's account, created (with a profile and no usable password) on first use."""
+    bot, created = CustomUser.objects.get_or_create(username=username, defaults={'is_bot': True})
+    if created:
+        bot.set_unusable_password()
+        bot.save(update_fields=['password'])
+        Profile.objects.create(user=bot)
+    return bot
@@ -1,7 +1,58 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock
+
+import chess.pgn
+import chess.variant
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.auth import get_user as channels_get_user
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import Game, Profile
-from .rules import calculate_elo, make_move, is_game_over
+from django.contrib.auth.models import AnonymousUser
+from .analysis import analyse_game, claim_jobs, save_analysis
+from .arena import Arena, award
+from .auth import CachedAuthMiddlewareStack, user_cache
+from .channel_layer import ChannelHub, UnixSocketChannelLayer
+from .clocks import GameClock, TimeoutScheduler, parse_cadence
+from .consumers import (
+    ArenaConsumer, GameConsumer, MatchmakingConsumer, sessions, matchmaking, move_log, timeouts, _bot_tasks, start_bot_game,
+)
+from .engine import EXACT, WIN, BotEngine, Searcher, search, think_time
+from .explorer import explore, game_positions, zobrist_key
+from .executor import RulesExecutor, RulesQueueFull
+from .matchmaking import MatchmakingEngine, QueueEntry
+from .metrics import Registry
+from .movelog import MoveLog
+from .leaderboard import Leaderboard
+from .archive import archive_batch, delete_aborted
+from .lifecycle import reap, reap_game, stale_games
+from .services import abort_game, arenas, finish_game, leaderboard, open_arena, prewarm_position_cache, rebuild_leaderboard
+from .models import AnalysisJob, ArchivedGame, Game, MoveEvaluation, PositionStat, Profile, Tournament, TournamentPlayer
+from .movegen import Position, perft as movegen_perft
+from .pgn import export_queryset, iter_pgn
+from .profiler import RoomProfiler
+from .management.commands.recompute_ratings import Command as RecomputeRatings
+from . import ratings
+from . import consumers, wire
+from .rules import (
+    calculate_elo, make_move, is_game_over, get_game_result, get_initial_fen, get_legal_moves, perft,
+    fen_ply, position_key, position_cache, set_movegen, GameSession, PositionCache, SessionRegistry,
+)
 
 User = get_user_model()
 
@@ -63,3 +114,1471 @@ class AntichessTests(TestCase):
         self.assertEqual(len(legal_moves), 1)
         self.assertEqual(legal_moves[0], 'f1b5')
 
+
+class PerftTests(TestCase):
+    def test_perft_from_start_position(self):
+        board = chess.variant.AntichessBoard(get_initial_fen())
+        self.assertEqual([perft(board, depth) for depth in (1, 2, 3)], [20, 400, 8067])
+
+
+class BitboardMovegenTests(TestCase):
+    START_FENS = [
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1',
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        'r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1',
+        'r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1',
+    ]
+
+    def assertSameMoves(self, board):
+        expected = [move.uci() for move in board.legal_moves]
+        self.assertEqual(Position.from_fen(board.fen()).legal_moves_uci(), expected, board.fen())
+        self.assertEqual(Position.from_board(board).legal_moves_uci(), expected, board.fen())
+
+    def test_random_games_match_python_chess(self):
+        rng = random.Random(1234)
+        for _ in range(60):
+            board = chess.variant.AntichessBoard(rng.choice(self.START_FENS))
+            position = Position.from_fen(board.fen())
+            for _ in range(150):
+                self.assertSameMoves(board)
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                move = rng.choice(moves)
+                # Incremental push must stay in step with python-chess too
+                position = position.push(next(m for m in position.legal_moves() if position.uci(m) == move.uci()))
+                board.push(move)
+                self.assertEqual(position.legal_moves_uci(), [m.uci() for m in board.legal_moves])
+
+    def test_special_moves(self):
+        for fen in [
+            'rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b - e3 0 3',   # en passant is a capture
+            '8/1P6/8/8/8/8/6p1/8 w - - 0 1',                               # promotion, including to king
+            'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1',                        # castling
+            '8/8/8/8/8/8/8/K7 w - - 0 1',                                  # Black has no pieces left
+        ]:
+            self.assertSameMoves(chess.variant.AntichessBoard(fen))
+
+    def test_perft_matches(self):
+        fen = get_initial_fen()
+        self.assertEqual(movegen_perft(Position.from_fen(fen), 3), 8067)
+
+    def test_backend_is_selectable(self):
+        self.addCleanup(set_movegen, 'python-chess')
+        fen = '1n1k3r/1b1pb3/2p1p1pp/1p6/5P2/3PP1P1/1PP3K1/RNBQ2N1 w - - 2 16'
+        expected = get_legal_moves(fen)
+        set_movegen('bitboard')
+        self.assertEqual(get_legal_moves(fen), expected)
+        self.assertEqual(GameSession(1, fen).legal_moves(), expected)
+        with self.assertRaises(ValueError):
+            set_movegen('stockfish')
+
+
+class PositionCacheTests(TestCase):
+    def setUp(self):
+        position_cache.clear()
+        self.addCleanup(position_cache.clear)
+
+    def test_move_clocks_are_ignored(self):
+        fen = 'rnbqkbnr/pppppppp/8/8/8/4P3/PPPP1PPP/RNBQKBNR b - - 0 1'
+        self.assertEqual(position_key(fen), 'rnbqkbnr/pppppppp/8/8/8/4P3/PPPP1PPP/RNBQKBNR b - -')
+        moves = get_legal_moves(fen)
+        self.assertEqual(get_legal_moves(fen.replace(' 0 1', ' 3 12')), moves)
+        stats = position_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = PositionCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 0)      # 'a' becomes most recent
+        cache.get('c', lambda: 3)      # evicts 'b'
+        self.assertEqual(cache.get('a', lambda: 0), 1)
+        self.assertEqual(cache.get('b', lambda: 0), 0)
+        self.assertEqual(len(cache), 2)
+
+    def test_seventyfive_move_rule_uses_real_halfmove_clock(self):
+        fen = '8/8/8/3k4/8/8/8/R3K3 w - - {} 90'
+        self.assertIsNone(get_game_result(fen.format(10)))
+        self.assertEqual(get_game_result(fen.format(150)), '1/2-1/2')
+        self.assertTrue(is_game_over(fen.format(150)))
+        # Position over by the rules wins regardless of the clock
+        self.assertEqual(get_game_result('8/8/8/8/8/8/8/K7 b - - 150 90'), '0-1')
+
+    def test_prewarm_from_finished_games(self):
+        user = User.objects.create_user(username='warm', password='password')
+        Game.objects.create(white_player=user, black_player=user, cadence='1+0', status='finished', pgn='e3 b5 Bxb5')
+        Game.objects.create(white_player=user, black_player=user, cadence='1+0', status='finished', pgn='e3 e6')
+        self.assertEqual(prewarm_position_cache(positions=2), 2)
+        get_legal_moves(get_initial_fen())
+        self.assertEqual(position_cache.stats()['hits'], 1)
+
+
+class GameSessionTests(TestCase):
+    def test_session_applies_moves_incrementally(self):
+        session = GameSession(1, get_initial_fen())
+        fen1, san, error = session.push('e2e3')
+        self.assertIsNone(error)
+        self.assertEqual(san, 'e3')
+        self.assertEqual(fen1, make_move(get_initial_fen(), 'e2e3')[0])
+
+        session.push('b7b5')
+        self.assertEqual(session.legal_moves(), ['f1b5'])
+        self.assertIsNone(session.result())
+
+    def test_session_rejects_illegal_move(self):
+        session = GameSession(1, get_initial_fen())
+        fen, san, error = session.push('e2e5')
+        self.assertEqual(error, 'Illegal move')
+        self.assertEqual(fen, get_initial_fen())
+        self.assertEqual(session.push('garbage')[2], 'Illegal move')
+
+    def test_apply_returns_result_and_legal_moves(self):
+        session = GameSession(1, get_initial_fen())
+        fen, san, error, result, legal_moves = session.apply('e2e3')
+        self.assertEqual((san, error, result), ('e3', None, None))
+        self.assertEqual(legal_moves, get_legal_moves(fen))
+        self.assertEqual(session.apply('e2e4')[2:], ('Illegal move', None, []))
+
+    def test_registry_rebuilds_stale_session_and_evicts(self):
+        registry = SessionRegistry(idle_timeout=600)
+        session = registry.get(7, get_initial_fen())
+        self.assertIs(registry.get('7', get_initial_fen()), session)
+
+        other_fen, _, _ = make_move(get_initial_fen(), 'e2e3')
+        self.assertIsNot(registry.get(7, other_fen), session)
+
+        registry.evict(7)
+        self.assertIsNone(registry.peek(7))
+
+    def test_registry_rebuild_keeps_clock(self):
+        registry = SessionRegistry(idle_timeout=600)
+        session = registry.get(7, get_initial_fen())
+        session.clock = GameClock(60, 0)
+        session.push('e2e3')
+        # The move never reached the database: the saved position wins
+        rebuilt = registry.get(7, get_initial_fen())
+        self.assertIsNot(rebuilt, session)
+        self.assertEqual(rebuilt.fen, get_initial_fen())
+        self.assertIs(rebuilt.clock, session.clock)
+
+    def test_registry_drops_idle_sessions(self):
+        registry = SessionRegistry(idle_timeout=60)
+        registry.get(1, get_initial_fen()).last_used -= 120
+        registry.evict_idle()
+        self.assertEqual(len(registry), 0)
+
+
+class GameConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.white = User.objects.create_user(username='white', password='password')
+        Profile.objects.create(user=self.white)
+        self.black = User.objects.create_user(username='black', password='password')
+        Profile.objects.create(user=self.black)
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black,
+                                        cadence='1+0', status='active', fen=get_initial_fen())
+        move_log.clear()
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{self.game.id}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'game_id': str(self.game.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_moves_are_applied_and_broadcast(self):
+        async def scenario():
+            white = await self.connect(self.white)
+            black = await self.connect(self.black)
+
+            await white.send_json_to({'command': 'make_move', 'move': 'e2e3'})
+            update = await white.receive_json_from(timeout=5)
+            self.assertEqual(await black.receive_json_from(timeout=5), update)
+            self.assertEqual(update['type'], 'move_applied')
+            self.assertEqual((update['ply'], update['uci'], update['san']), (1, 'e2e3', 'e3'))
+
+            await black.send_json_to({'command': 'make_move', 'move': 'b7b5'})
+            update = await black.receive_json_from(timeout=5)
+            self.assertEqual(update['ply'], 2)
+            self.assertEqual(update['legal_moves'], ['f1b5'])
+            self.assertIsNone(update['result'])
+            self.assertEqual(await white.receive_json_from(timeout=5), update)
+
+            await white.send_json_to({'command': 'get_state'})
+            state = await white.receive_json_from(timeout=5)
+            self.assertEqual(state['type'], 'game_state')
+            self.assertEqual(state['game']['pgn'], 'e3 b5')
+            self.assertEqual(state['game']['ply'], 2)
+            self.assertEqual(state['game']['legal_moves'], ['f1b5'])
+
+            await white.disconnect()
+            await black.disconnect()
+
+        async_to_sync(scenario)()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.pgn, 'e3 b5')
+        self.assertEqual(self.game.fen, sessions.peek(self.game.id).fen)
+
+    def test_side_to_move_loses_on_time(self):
+        async def scenario():
+            white = await self.connect(self.white)
+            await white.send_json_to({'command': 'make_move', 'move': 'e2e3'})
+            update = await white.receive_json_from(timeout=5)
+            self.assertTrue(update['clock']['running'])
+            self.assertEqual(update['clock']['turn'], 'black')
+
+            # Black is nearly out of time
+            clock = sessions.peek(self.game.id).clock
+            clock.remaining['black'] = 0.05
+            timeouts.schedule(self.game.id, clock.deadline())
+
+            finished = await white.receive_json_from(timeout=5)
+            await white.disconnect()
+            return finished
+
+        finished = async_to_sync(scenario)()
+        self.assertEqual(finished['type'], 'game_finished')
+        self.assertEqual((finished['result'], finished['reason']), ('1-0', 'timeout'))
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.winner), ('finished', self.white))
+        self.assertEqual(Profile.objects.get(user=self.white).wins, 1)
+
+    def test_timeout_waits_for_a_move_in_progress(self):
+        session = sessions.get(self.game.id, self.game.fen)
+        session.clock = GameClock(60, 0)
+        session.clock.press(now=time.monotonic() - 120)
+
+        async def scenario():
+            async with consumers.move_lock(self.game.id):
+                task = asyncio.ensure_future(consumers.handle_timeout(self.game.id))
+                await asyncio.sleep(0.05)
+                status = await database_sync_to_async(lambda: Game.objects.get(id=self.game.id).status)()
+            await task
+            return status
+
+        self.assertEqual(async_to_sync(scenario)(), 'active')
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, 'finished')
+
+    def test_failed_save_drops_the_live_board(self):
+        async def scenario():
+            with mock.patch('api.consumers.save_move', side_effect=RuntimeError('database is locked')):
+                with self.assertRaises(RuntimeError):
+                    await consumers.apply_move(self.game.id, self.white.id, 'e2e3')
+            return await consumers.apply_move(self.game.id, self.white.id, 'e2e3')
+
+        self.assertIsNone(async_to_sync(scenario)())
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.pgn, 'e3')
+        self.assertEqual(self.game.fen, sessions.peek(self.game.id).fen)
+
+    def test_move_on_a_game_ended_elsewhere_is_dropped(self):
+        stale = Game.objects.select_related('white_player', 'black_player').get(id=self.game.id)
+        Game.objects.filter(id=self.game.id).update(status='aborted')
+
+        async def get_stale_game(game_id):
+            return stale
+
+        async def scenario():
+            channel_layer = get_channel_layer()
+            listener = await channel_layer.new_channel()
+            await channel_layer.group_add(f'game_{self.game.id}', listener)
+            with mock.patch('api.consumers.get_game', get_stale_game):
+                error = await consumers.apply_move(self.game.id, self.white.id, 'e2e3')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(channel_layer.receive(listener), 0.1)
+            return error
+
+        self.assertEqual(async_to_sync(scenario)(), 'Game is not active')
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.pgn), ('aborted', ''))
+        self.assertIsNone(sessions.peek(self.game.id))
+
+    def test_timeout_errors_are_counted_and_logged(self):
+        async def scenario():
+            failed = consumers.errors.value('handle_timeout')
+            with mock.patch('api.consumers.handle_timeout', side_effect=RuntimeError('boom')), \
+                    self.assertLogs('api.consumers', 'ERROR'):
+                timeouts.schedule(self.game.id, time.monotonic())
+                await asyncio.sleep(0.05)
+            return consumers.errors.value('handle_timeout') - failed
+
+        self.assertEqual(async_to_sync(scenario)(), 1)
+
+    def test_spectators_watch_read_only_with_batched_updates(self):
+        async def scenario():
+            white = await self.connect(self.white)
+            black = await self.connect(self.black)
+            spectator = await self.connect(AnonymousUser())
+
+            await spectator.send_json_to({'command': 'make_move', 'move': 'e2e3'})
+            self.assertEqual((await spectator.receive_json_from(timeout=5))['type'], 'error')
+
+            # First update goes out at once; the next two queue up behind it
+            for player, uci in ((white, 'e2e3'), (black, 'b7b5'), (white, 'f1b5')):
+                await player.send_json_to({'command': 'make_move', 'move': uci})
+                await white.receive_json_from(timeout=5)
+                await black.receive_json_from(timeout=5)
+            frames = [await spectator.receive_json_from(timeout=5) for _ in range(2)]
+            for communicator in (white, black, spectator):
+                await communicator.disconnect()
+            return frames
+
+        first, batch = async_to_sync(scenario)()
+        self.assertEqual((first['type'], first['ply']), ('move_applied', 1))
+        self.assertEqual(batch['type'], 'batch')
+        self.assertEqual([message['uci'] for message in batch['messages']], ['b7b5', 'f1b5'])
+
+    def test_reconnect_replays_only_missed_moves(self):
+        async def scenario():
+            white = await self.connect(self.white)
+            black = await self.connect(self.black)
+            for player, uci in ((white, 'e2e3'), (black, 'b7b5'), (white, 'f1b5')):
+                await player.send_json_to({'command': 'make_move', 'move': uci})
+                await white.receive_json_from(timeout=5)
+                await black.receive_json_from(timeout=5)
+            await black.disconnect()
+
+            replies = []
+            for last_ply in (1, 3, 7):
+                black = await self.connect(self.black)
+                await black.send_json_to({'command': 'join_game', 'last_ply': last_ply})
+                replies.append(await black.receive_json_from(timeout=5))
+                await black.disconnect()
+            await white.disconnect()
+            return replies
+
+        behind, current, ahead = async_to_sync(scenario)()
+        self.assertEqual(behind['type'], 'resumed')
+        self.assertEqual(behind['ply'], 3)
+        self.assertEqual([message['uci'] for message in behind['messages']], ['b7b5', 'f1b5'])
+        self.assertTrue(behind['clock']['running'])
+        self.assertEqual((current['type'], current['messages']), ('resumed', []))
+        self.assertEqual(ahead['type'], 'game_state')
+
+    def test_binary_subprotocol(self):
+        async def scenario():
+            white = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{self.game.id}/',
+                                          subprotocols=[wire.SUBPROTOCOL])
+            white.scope['user'] = self.white
+            white.scope['url_route'] = {'kwargs': {'game_id': str(self.game.id)}}
+            connected, subprotocol = await white.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, wire.SUBPROTOCOL)
+            black = await self.connect(self.black)
+
+            await white.send_to(bytes_data=wire.encode_command('join_game'))
+            state = wire.decode(await white.receive_from(timeout=5))
+            await white.send_to(bytes_data=wire.encode_command('make_move', move='e2e3'))
+            update = wire.decode(await white.receive_from(timeout=5))
+            json_update = await black.receive_json_from(timeout=5)
+            await white.send_to(bytes_data=b'\x99')
+            error = wire.decode(await white.receive_from(timeout=5))
+            await white.disconnect()
+            await black.disconnect()
+            return state, update, json_update, error
+
+        state, update, json_update, error = async_to_sync(scenario)()
+        self.assertEqual(state['game']['white_player'], self.white.id)
+        self.assertEqual(len(state['game']['legal_moves']), 20)
+        self.assertEqual({key: json_update[key] for key in update}, update)
+        self.assertEqual(error['type'], 'error')
+
+    def test_moves_are_measured(self):
+        async def scenario():
+            white = await self.connect(self.white)
+            await white.send_json_to({'command': 'make_move', 'move': 'e2e3'})
+            await white.receive_json_from(timeout=5)
+            await white.disconnect()
+
+        async_to_sync(scenario)()
+        staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertRegex(body, r'antichess_ws_command_seconds_count\{consumer="game",command="make_move"\} [1-9]')
+        # Game lookup and save
+        self.assertRegex(body, r'antichess_move_db_queries_bucket\{le="2"\} [1-9]')
+        self.assertRegex(body, r'antichess_rules_call_seconds_count\{function="apply"\} [1-9]')
+        self.assertIn('antichess_open_sockets{consumer="game"} 0', body)
+
+    def test_double_submit_applies_one_move(self):
+        async def scenario():
+            channel_layer = get_channel_layer()
+            listener = await channel_layer.new_channel()
+            await channel_layer.group_add(f'game_{self.game.id}', listener)
+            errors = await asyncio.gather(
+                consumers.apply_move(self.game.id, self.white.id, 'e2e3'),
+                consumers.apply_move(self.game.id, self.white.id, 'e2e4'),
+            )
+            update = await channel_layer.receive(listener)
+            return errors, json.loads(update['text'])
+
+        errors, update = async_to_sync(scenario)()
+        self.assertEqual(errors, [None, None])
+        self.assertEqual((update['ply'], update['uci']), (1, 'e2e3'))
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.pgn, 'e3')
+        self.assertEqual(self.game.fen, sessions.peek(self.game.id).fen)
+
+    def test_move_log_ring(self):
+        log = MoveLog(size=2, max_games=2)
+        for ply in (1, 2, 3):
+            log.append(1, ply, f'm{ply}')
+        self.assertEqual(log.since(1, 1), ['m2', 'm3'])
+        self.assertIsNone(log.since(1, 0))
+        log.append(1, 7, 'm7')  # moves 4-6 were made elsewhere
+        self.assertIsNone(log.since(1, 3))
+        log.append(2, 1, 'a')
+        log.append(3, 1, 'b')
+        self.assertIsNone(log.since(1, 6))
+        self.assertEqual(len(log), 2)
+
+
+class RulesExecutorTests(TestCase):
+    def test_run_returns_result_and_records_latency(self):
+        executor = RulesExecutor(workers=2, max_pending=4)
+        self.addCleanup(executor.shutdown)
+        moves = async_to_sync(executor.run)(get_legal_moves, get_initial_fen())
+        self.assertEqual(len(moves), 20)
+        stats = executor.stats()
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['pending'], 0)
+        self.assertIn('p99', stats)
+
+    def test_run_rejects_when_queue_is_full(self):
+        executor = RulesExecutor(workers=1, max_pending=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+
+        async def scenario():
+            blocked = asyncio.ensure_future(executor.run(release.wait, 5))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(RulesQueueFull):
+                await executor.run(get_initial_fen)
+            release.set()
+            await blocked
+
+        async_to_sync(scenario)()
+        self.assertEqual(executor.stats()['rejected'], 1)
+
+
+class MatchmakingEngineTests(TestCase):
+    def test_pairs_closest_opponent_within_band(self):
+        engine = MatchmakingEngine(base_band=100, band_growth=50, max_band=800)
+        self.assertIsNone(engine.join('1+0', 1, 1500, 'a', now=0))
+        self.assertIsNone(engine.join('1+0', 2, 1700, 'b', now=0))
+        self.assertIsNone(engine.join('3+0', 3, 1550, 'c', now=0))
+
+        white, black = engine.join('1+0', 4, 1560, 'd', now=0)
+        self.assertEqual((white.user_id, black.user_id), (1, 4))
+        self.assertEqual(engine.waiting(), 2)
+
+    def test_band_widens_while_waiting(self):
+        engine = MatchmakingEngine(base_band=100, band_growth=50, max_band=800)
+        engine.join('1+0', 1, 1500, 'a', now=0)
+        engine.join('1+0', 2, 1800, 'b', now=1)
+        self.assertEqual(engine.sweep(now=2), [])
+
+        pairs = engine.sweep(now=5)
+        self.assertEqual([(w.user_id, b.user_id) for w, b in pairs], [(1, 2)])
+        self.assertEqual(engine.waiting(), 0)
+
+    def test_player_is_never_paired_with_themselves_or_twice(self):
+        engine = MatchmakingEngine()
+        engine.join('1+0', 1, 1500, 'a', now=0)
+        self.assertIsNone(engine.join('1+0', 1, 1500, 'a2', now=0))
+        self.assertEqual(engine.waiting('1+0'), 1)
+        self.assertTrue(engine.leave(1))
+        self.assertFalse(engine.leave(1))
+
+
+    def test_leave_from_another_channel_keeps_the_entry(self):
+        engine = MatchmakingEngine()
+        engine.join('1+0', 1, 1500, 'tab1', now=0)
+        engine.join('1+0', 1, 1500, 'tab2', now=1)
+        self.assertFalse(engine.leave(1, 'tab1'))
+        self.assertEqual(engine.waiting(), 1)
+        self.assertTrue(engine.leave(1, 'tab2'))
+        self.assertEqual(engine.waiting(), 0)
+
+    def test_requeue_restores_popped_entries(self):
+        engine = MatchmakingEngine(base_band=100, band_growth=0)
+        engine.join('1+0', 1, 1500, 'c1', now=0)
+        engine.join('1+0', 2, 1900, 'c2', now=1)
+        engine.join('1+0', 3, 2300, 'c3', now=2)
+        expired = engine.expire(1.5, now=3)
+        self.assertEqual([entry.user_id for entry in expired], [1, 2])
+        engine.join('1+0', 2, 1950, 'c2b', now=3)
+        engine.requeue(expired)
+        self.assertEqual(engine.waiting('1+0'), 3)
+        # Still oldest first; user 2 keeps the entry they joined again with
+        self.assertEqual([entry.user_id for entry in engine.expire(0.5, now=3)], [1, 3])
+        self.assertEqual(engine.expire(0, now=4)[0].channel_name, 'c2b')
+
+    def test_expire_returns_long_waiters_oldest_first(self):
+        engine = MatchmakingEngine(base_band=0, band_growth=0)
+        engine.join('1+0', 1, 1000, 'c1', now=0)
+        engine.join('3+0', 2, 1500, 'c2', now=5)
+        engine.join('1+0', 3, 2000, 'c3', now=20)
+
+        expired = engine.expire(10, now=21)
+        self.assertEqual([entry.user_id for entry in expired], [1, 2])
+        self.assertEqual(engine.waiting(), 1)
+        self.assertEqual(engine.expire(10, now=21), [])
+
+
+class MatchmakingConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='player1', password='password')
+        Profile.objects.create(user=self.user1)
+        self.user2 = User.objects.create_user(username='player2', password='password')
+        Profile.objects.create(user=self.user2)
+
+    def test_two_players_are_paired_into_one_game(self):
+        async def scenario():
+            sockets = []
+            for user in (self.user1, self.user2):
+                communicator = WebsocketCommunicator(MatchmakingConsumer.as_asgi(), '/ws/matchmaking/')
+                communicator.scope['user'] = user
+                await communicator.connect()
+                await communicator.send_json_to({'command': 'find_game', 'cadence': '1+0'})
+                sockets.append(communicator)
+
+            found = [await communicator.receive_json_from(timeout=5) for communicator in sockets]
+            for communicator in sockets:
+                await communicator.disconnect()
+            return found
+
+        white, black = async_to_sync(scenario)()
+        self.assertEqual((white['color'], black['color']), ('white', 'black'))
+        self.assertEqual(white['game_id'], black['game_id'])
+
+        game = Game.objects.get()
+        self.assertEqual(game.status, 'active')
+        self.assertEqual((game.white_player, game.black_player), (self.user1, self.user2))
+        self.assertEqual(matchmaking.waiting(), 0)
+
+    def test_players_wait_again_when_their_game_cannot_be_created(self):
+        async def scenario():
+            sockets = []
+            with mock.patch('api.consumers.create_matched_game', side_effect=RuntimeError('database is locked')), \
+                    self.assertLogs('api.consumers', 'ERROR'):
+                for user in (self.user1, self.user2):
+                    communicator = WebsocketCommunicator(MatchmakingConsumer.as_asgi(), '/ws/matchmaking/')
+                    communicator.scope['user'] = user
+                    await communicator.connect()
+                    await communicator.send_json_to({'command': 'find_game', 'cadence': '1+0'})
+                    sockets.append(communicator)
+                await asyncio.sleep(0.1)
+                waiting = matchmaking.waiting()
+
+            # The sweeper pairs them once games can be created again
+            found = [await communicator.receive_json_from(timeout=5) for communicator in sockets]
+            for communicator in sockets:
+                await communicator.disconnect()
+            return waiting, found
+
+        waiting, found = async_to_sync(scenario)()
+        self.assertEqual(waiting, 2)
+        self.assertEqual({message['color'] for message in found}, {'white', 'black'})
+        self.assertEqual(Game.objects.count(), 1)
+
+
+class ArenaTests(TransactionTestCase):
+    def setUp(self):
+        self.users = []
+        for name in ('ann', 'ben', 'cat', 'dan'):
+            user = User.objects.create_user(username=name, password='password')
+            Profile.objects.create(user=user)
+            self.users.append(user)
+        now = timezone.now()
+        self.tournament = Tournament.objects.create(name='Test arena', cadence='1+0', starts_at=now,
+                                                    ends_at=now + timedelta(hours=1))
+
+    def tearDown(self):
+        arenas.clear()
+
+    def test_award_doubles_points_on_a_streak(self):
+        self.assertEqual([award(1, 0), award(1, 1), award(1, 2), award(0.5, 3), award(0, 1)],
+                         [(2, 1), (2, 2), (4, 3), (2, 0), (0, 0)])
+
+    def test_pairing_follows_score_and_avoids_rematches(self):
+        arena = Arena(1, '1+0', None, None)
+        for user_id, rating, score in ((1, 1500, 10), (2, 1400, 9), (3, 1600, 0), (4, 1500, 0)):
+            arena.join(user_id, rating, score, f'channel.{user_id}')
+        pairs = {(white.user_id, black.user_id) for white, black in arena.pair()}
+        self.assertEqual(pairs, {(1, 2), (3, 4)})
+        self.assertEqual(arena.waiting(), 0)
+
+        # The leaders come back first and wait rather than play each other again
+        arena.finished(1, 12)
+        arena.finished(2, 9)
+        self.assertEqual(arena.pair(), [])
+        arena.finished(3, 2)
+        arena.finished(4, 0)
+        pairs = [{white.user_id, black.user_id} for white, black in arena.pair()]
+        self.assertCountEqual(pairs, [{1, 3}, {2, 4}])
+        self.assertEqual(arena.standings.page(0, 2), [(1, 1, 12), (2, 2, 9)])
+
+    def finish(self, game, result):
+        """finish_game, then hand what it sent to the arena's group to the Arena, as ArenaConsumer does."""
+        async def scenario():
+            channel_layer = get_channel_layer()
+            listener = await channel_layer.new_channel()
+            await channel_layer.group_add(f'arena_{self.tournament.id}', listener)
+            await database_sync_to_async(finish_game)(game, result)
+            event = await channel_layer.receive(listener)
+            await channel_layer.group_discard(f'arena_{self.tournament.id}', listener)
+            return event
+
+        event = async_to_sync(scenario)()
+        self.assertEqual(event['type'], 'arena_result')
+        arena = arenas[self.tournament.id]
+        self.assertTrue(arena.game_finished(event['game_id'], event['scores'], event['ratings']))
+        # Every consumer in the group relays it; only the first delivery counts
+        self.assertFalse(arena.game_finished(event['game_id'], event['scores'], event['ratings']))
+
+    async def next_game(self, communicator):
+        message = await communicator.receive_json_from(timeout=5)
+        while message['type'] != 'game_found':
+            message = await communicator.receive_json_from(timeout=5)
+        return message
+
+    def test_finished_arena_games_score_and_return_players_to_the_pool(self):
+        ann, ben = self.users[:2]
+        arena = open_arena(self.tournament.id)
+        for user in (ann, ben):
+            TournamentPlayer.objects.create(tournament=self.tournament, user=user)
+            arena.join(user.id, 1500, 0, f'channel.{user.id}')
+        for result in ('1-0', '1-0', '1-0', '0-1'):
+            arena.pair()
+            game = Game.objects.create(white_player=ann, black_player=ben, cadence='1+0', status='active',
+                                       fen=get_initial_fen(), tournament=self.tournament)
+            self.finish(game, result)
+            self.assertEqual(arena.waiting(), 2)
+
+        entries = {entry.user_id: entry for entry in TournamentPlayer.objects.all()}
+        self.assertEqual((entries[ann.id].score, entries[ann.id].streak, entries[ann.id].wins), (2 + 2 + 4, 0, 3))
+        self.assertEqual((entries[ben.id].score, entries[ben.id].games), (2, 4))
+        self.assertEqual(arena.standings.page(0, 2), [(1, ann.id, 8), (2, ben.id, 2)])
+
+        response = self.client.get(f'/api/tournaments/{self.tournament.id}/').json()
+        self.assertEqual(response['state'], 'running')
+        self.assertEqual([(row['rank'], row['username'], row['score']) for row in response['standings']],
+                         [(1, 'ann', 8), (2, 'ben', 2)])
+
+    def test_players_joining_the_socket_are_paired_into_arena_games(self):
+        async def scenario():
+            sockets = []
+            for user in self.users:
+                communicator = WebsocketCommunicator(ArenaConsumer.as_asgi(), f'/ws/arena/{self.tournament.id}/')
+                communicator.scope['user'] = user
+                communicator.scope['url_route'] = {'kwargs': {'tournament_id': str(self.tournament.id)}}
+                await communicator.connect()
+                await communicator.send_json_to({'command': 'join'})
+                sockets.append(communicator)
+
+            # arena_joined and standings come first
+            found = [await self.next_game(communicator) for communicator in sockets]
+            for communicator in sockets:
+                await communicator.disconnect()
+            return found
+
+        with mock.patch.dict(consumers._arena_settings, {'PAIRING_INTERVAL': 0.05}):
+            found = async_to_sync(scenario)()
+        self.assertEqual({message['tournament_id'] for message in found}, {self.tournament.id})
+        self.assertEqual(Game.objects.filter(tournament=self.tournament, status='active').count(), 2)
+        self.assertEqual(TournamentPlayer.objects.filter(tournament=self.tournament).count(), 4)
+        self.assertEqual(arenas[self.tournament.id].waiting(), 0)
+
+    def test_results_reach_the_arena_from_a_worker_without_it(self):
+        async def scenario():
+            sockets = []
+            for user in self.users:
+                communicator = WebsocketCommunicator(ArenaConsumer.as_asgi(), f'/ws/arena/{self.tournament.id}/')
+                communicator.scope['user'] = user
+                communicator.scope['url_route'] = {'kwargs': {'tournament_id': str(self.tournament.id)}}
+                await communicator.connect()
+                await communicator.send_json_to({'command': 'join'})
+                sockets.append(communicator)
+            first = [await self.next_game(communicator) for communicator in sockets]
+
+            # Both games end in a worker that has no Arena for this tournament
+            with mock.patch('api.services.arenas', {}):
+                for game_id in {message['game_id'] for message in first}:
+                    game = await database_sync_to_async(Game.objects.get)(id=game_id)
+                    await database_sync_to_async(finish_game)(game, '1-0')
+            second = [await self.next_game(communicator) for communicator in sockets]
+            for communicator in sockets:
+                await communicator.disconnect()
+            return first, second
+
+        with mock.patch.dict(consumers._arena_settings, {'PAIRING_INTERVAL': 0.05}):
+            first, second = async_to_sync(scenario)()
+        self.assertFalse({message['game_id'] for message in first} & {message['game_id'] for message in second})
+        self.assertEqual(Game.objects.filter(tournament=self.tournament, status='active').count(), 2)
+        self.assertEqual(sum(entry.score for entry in TournamentPlayer.objects.filter(tournament=self.tournament)), 4)
+
+
+class BotEngineTests(TestCase):
+    def test_finds_forced_win(self):
+        # White must take on d2 and is left with no pieces
+        found = search('8/8/8/8/8/3p4/8/4K3 w - - 0 1', 1.0)
+        self.assertEqual(found['move'], 'e1e2')
+        self.assertGreater(found['score'], 0)
+
+        found = search('8/8/8/8/8/8/3p4/4K3 w - - 0 1', 1.0)
+        self.assertEqual(found['move'], 'e1d2')
+
+    def test_search_respects_time_budget(self):
+        found = search(get_initial_fen(), 0.2)
+        self.assertIn(found['move'], get_legal_moves(get_initial_fen()))
+        self.assertGreaterEqual(found['depth'], 1)
+        self.assertLess(found['seconds'], 0.5)
+
+    def test_win_scores_are_stored_relative_to_the_node(self):
+        searcher = Searcher(1.0)
+        position = Position.from_fen('8/8/8/8/8/3p4/8/4K3 w - - 0 1')
+        move = position.legal_moves()[0]
+        # Found at ply 3: a win two plies below this node
+        searcher._store(1, 5, WIN - 5, EXACT, move, ply=3)
+        self.assertEqual(searcher.tt[1][1], WIN - 2)
+        with mock.patch('api.engine.zobrist', return_value=1):
+            # Reached again at ply 1, the same win is three plies from the root
+            self.assertEqual(searcher._negamax(position, 5, -WIN - 1, WIN + 1, 1), WIN - 3)
+
+    def test_broken_pool_is_replaced(self):
+        engine = BotEngine(workers=1)
+        broken = mock.Mock(submit=mock.Mock(side_effect=BrokenProcessPool('worker died')))
+        engine._pool = broken
+        try:
+            found = async_to_sync(engine.choose_move)('8/8/8/8/8/8/3p4/4K3 w - - 0 1', 0.5)
+            self.assertIsNot(engine._pool, broken)
+        finally:
+            engine.shutdown()
+        self.assertEqual(found['move'], 'e1d2')
+        broken.shutdown.assert_called_once_with(wait=False)
+
+    def test_think_time_follows_cadence(self):
+        self.assertLess(think_time('1+0'), think_time('5+0'))
+        self.assertGreater(think_time('2+1', remaining=5), think_time('1+0', remaining=5))
+        self.assertLessEqual(think_time('5+0', remaining=1), 0.25)
+
+
+class BotMatchTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='player1', password='password')
+        Profile.objects.create(user=self.user)
+
+    def test_bot_fills_slot_and_plays_white(self):
+        async def scenario():
+            channel_layer = get_channel_layer()
+            channel_name = await channel_layer.new_channel()
+            entry = QueueEntry(self.user.id, 1500, channel_name, '1+0', 0, 0)
+            with mock.patch('api.consumers.random.random', return_value=0.9):
+                await start_bot_game(entry)
+            found = await channel_layer.receive(channel_name)
+            # Nothing runs for the game until the player joins it
+            self.assertEqual(_bot_tasks, set())
+
+            game_id = found['game_id']
+            communicator = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{game_id}/')
+            communicator.scope['user'] = self.user
+            communicator.scope['url_route'] = {'kwargs': {'game_id': str(game_id)}}
+            await communicator.connect()
+            await communicator.send_json_to({'command': 'join_game'})
+            state = await communicator.receive_json_from(timeout=5)
+            self.assertEqual(state['type'], 'game_state')
+            update = await communicator.receive_json_from(timeout=10)
+            self.assertEqual((update['type'], update['ply']), ('move_applied', 1))
+            await asyncio.gather(*_bot_tasks)
+            await communicator.disconnect()
+            return found
+
+        found = async_to_sync(scenario)()
+        self.assertEqual(found['color'], 'black')
+
+        game = Game.objects.get(id=found['game_id'])
+        self.assertTrue(game.white_player.is_bot)
+        self.assertEqual(game.black_player, self.user)
+        self.assertEqual(fen_ply(game.fen), 1)
+        self.assertEqual(len(game.pgn.split()), 1)
+
+
+class FinishGameTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create_user(username='white', password='password')
+        Profile.objects.create(user=self.white, highest_elo=1510)
+        self.black = User.objects.create_user(username='black', password='password')
+        Profile.objects.create(user=self.black, wins=3)
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black,
+                                        cadence='1+0', status='active', fen=get_initial_fen())
+
+    def test_finish_updates_game_and_profiles_in_one_transaction(self):
+        self.game.pgn = 'e3'
+        # savepoint, select, game update, explorer upsert, analysis job, 2 profile updates, release
+        with self.assertNumQueries(8):
+            ratings = finish_game(self.game, '1-0')
+        self.assertEqual(ratings, (1520, 1480))
+
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.winner, self.game.pgn), ('finished', self.white, 'e3'))
+        self.assertIsNotNone(self.game.finished_at)
+
+        white, black = Profile.objects.get(user=self.white), Profile.objects.get(user=self.black)
+        self.assertEqual((white.elo, white.highest_elo, white.wins, white.games_played), (1520, 1520, 1, 1))
+        self.assertEqual((black.elo, black.highest_elo, black.wins, black.losses), (1480, 1500, 3, 1))
+
+    def test_draw_and_second_finish_is_ignored(self):
+        self.assertEqual(finish_game(self.game, '1/2-1/2'), (1500, 1500))
+        self.assertIsNone(finish_game(self.game, '1-0'))
+
+        white = Profile.objects.get(user=self.white)
+        self.assertEqual((white.draws, white.games_played, white.highest_elo), (1, 1, 1510))
+        self.game.refresh_from_db()
+        self.assertIsNone(self.game.winner)
+
+    def test_aborted_game_is_not_finished(self):
+        self.assertTrue(abort_game(self.game))
+        self.assertIsNone(finish_game(self.game, '1-0'))
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.winner), ('aborted', None))
+        self.assertEqual(Profile.objects.get(user=self.white).games_played, 0)
+
+
+class GameClockTests(TestCase):
+    def test_parse_cadence(self):
+        self.assertEqual(parse_cadence('2+1'), (120.0, 1.0))
+        self.assertEqual(parse_cadence('5+0'), (300.0, 0.0))
+
+    def test_press_charges_mover_and_adds_increment(self):
+        clock = GameClock(60, 1)
+        self.assertIsNone(clock.deadline())
+        self.assertTrue(clock.press(now=100))   # White's first move starts Black's clock
+        self.assertEqual(clock.remaining['white'], 61)
+        self.assertEqual(clock.deadline(), 160)
+
+        self.assertTrue(clock.press(now=110))
+        self.assertEqual(clock.remaining['black'], 51)
+        self.assertEqual(clock.snapshot(now=115)['white'], 56000)
+
+    def test_flagged_side_cannot_press(self):
+        clock = GameClock(60, 0)
+        clock.press(now=0)
+        self.assertTrue(clock.flagged(now=61))
+        self.assertFalse(clock.press(now=61))
+        self.assertEqual(clock.turn, 'black')
+
+    def test_scheduler_fires_only_latest_deadline(self):
+        fired = []
+
+        async def on_timeout(game_id):
+            fired.append((game_id, time.monotonic()))
+
+        async def scenario():
+            scheduler = TimeoutScheduler(on_timeout)
+            start = time.monotonic()
+            scheduler.schedule(1, start + 0.05)
+            scheduler.schedule(2, start + 0.02)
+            scheduler.schedule(1, start + 0.1)   # rescheduled: the 0.05 entry is stale
+            scheduler.schedule(3, start + 0.03)
+            scheduler.cancel(3)
+            await asyncio.sleep(0.2)
+            return start
+
+        start = async_to_sync(scenario)()
+        self.assertEqual([game_id for game_id, _ in fired], [2, 1])
+        self.assertGreaterEqual(fired[1][1], start + 0.1)
+
+
+class UnixSocketChannelLayerTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'hub.sock')
+
+    def test_groups_are_shared_between_workers_through_the_hub(self):
+        async def scenario():
+            hub = ChannelHub(self.path)
+            server = await hub.start()
+            a, b = UnixSocketChannelLayer(path=self.path), UnixSocketChannelLayer(path=self.path)
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('game_1', ca)
+            await b.group_add('game_1', cb)
+            await a.group_add('game_2', ca)
+            await asyncio.sleep(0.05)
+
+            await a.group_send('game_1', {'type': 'move_applied', 'ply': 1})
+            received = [await a.receive(ca), await b.receive(cb)]
+            # A group with members in one process never reaches the hub
+            await a.group_send('game_2', {'type': 'move_applied', 'ply': 2})
+            received.append(await a.receive(ca))
+            await b.send(ca, {'type': 'match_found'})
+            received.append(await a.receive(ca))
+            # b has no member of game_2, so only the hub knows where it lives
+            await b.group_send('game_2', {'type': 'move_applied', 'ply': 3})
+            received.append(await a.receive(ca))
+            forwarded = (a.forwarded, b.forwarded)
+
+            for layer in (a, b):
+                await layer.close()
+            # Let the hub see both disconnects before shutting it down
+            await asyncio.sleep(0.05)
+            self.assertEqual(hub.workers, {})
+            server.close()
+            await server.wait_closed()
+            return received, forwarded
+
+        received, forwarded = async_to_sync(scenario)()
+        self.assertEqual([message.get('ply') for message in received], [1, 1, 2, None, 3])
+        self.assertEqual(received[3]['type'], 'match_found')
+        self.assertEqual(forwarded, (1, 2))
+
+    def test_works_in_memory_without_hub(self):
+        async def scenario():
+            layer = UnixSocketChannelLayer(path=self.path)
+            channel = await layer.new_channel()
+            await layer.group_add('game_1', channel)
+            await layer.group_send('game_1', {'type': 'move_applied'})
+            return await layer.receive(channel)
+
+        self.assertEqual(async_to_sync(scenario)(), {'type': 'move_applied'})
+
+
+class PgnExportTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        Profile.objects.create(user=self.alice, elo=1600)
+        self.bob = User.objects.create_user(username='bob', password='password')
+        Profile.objects.create(user=self.bob)
+        self.carol = User.objects.create_user(username='carol', password='password', is_staff=True)
+        Profile.objects.create(user=self.carol)
+
+        fen, sans = get_initial_fen(), []
+        for uci in ('e2e3', 'b7b5', 'f1b5'):
+            fen, san, _ = make_move(fen, uci)
+            sans.append(san)
+        self.first = Game.objects.create(white_player=self.alice, black_player=self.bob, cadence='1+0',
+                                         status='active', fen=fen, pgn=' '.join(sans))
+        finish_game(self.first, '1-0')
+        second = Game.objects.create(white_player=self.bob, black_player=self.carol, cadence='3+0',
+                                     status='active', fen=get_initial_fen(), pgn='')
+        finish_game(second, '1/2-1/2')
+        Game.objects.create(white_player=self.alice, black_player=self.carol, cadence='1+0', status='active')
+
+    def test_export_is_valid_pgn_with_pregame_ratings(self):
+        records = list(iter_pgn(export_queryset()))
+        self.assertEqual(len(records), 2)
+
+        game = chess.pgn.read_game(io.StringIO(records[0]))
+        self.assertEqual(game.headers['White'], 'alice')
+        self.assertEqual(game.headers['WhiteElo'], '1600')
+        self.assertEqual(game.headers['Result'], '1-0')
+        self.assertEqual(game.headers['TimeControl'], '60+0')
+        self.assertEqual([move.uci() for move in game.mainline_moves()], ['e2e3', 'b7b5', 'f1b5'])
+        self.assertIn('1. e3 b5 2. Bxb5 1-0', records[0])
+        self.assertIn('[Result "1/2-1/2"]', records[1])
+
+    def test_date_is_the_finish_date(self):
+        Game.objects.filter(id=self.first.id).update(created_at=self.first.finished_at - timedelta(days=2))
+        record = next(iter_pgn(export_queryset()))
+        self.assertIn(f'[Date "{self.first.finished_at:%Y.%m.%d}"]', record)
+
+    def test_filters(self):
+        self.assertEqual(export_queryset(cadence='3+0').count(), 1)
+        self.assertEqual(export_queryset(player='alice').count(), 1)
+        self.assertEqual(export_queryset(player='carol').count(), 1)
+        today = self.first.finished_at.date()
+        self.assertEqual(export_queryset(since=today, until=today).count(), 2)
+        self.assertEqual(export_queryset(since=today + timedelta(days=1)).count(), 0)
+
+    def test_endpoint_streams_for_staff_only(self):
+        async def fetch(user, query=''):
+            client = AsyncClient()
+            await client.aforce_login(user)
+            response = await client.get('/api/games/export.pgn' + query)
+            body = b''
+            if response.status_code == 200:
+                self.assertTrue(response.streaming)
+                body = b''.join([chunk async for chunk in response.streaming_content])
+            return response.status_code, body.decode()
+
+        self.assertEqual(async_to_sync(fetch)(self.alice)[0], 403)
+        status_code, body = async_to_sync(fetch)(self.carol, '?player=bob&cadence=1%2B0')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body.count('[Event '), 1)
+        self.assertEqual(async_to_sync(fetch)(self.carol, '?since=yesterday')[0], 400)
+
+
+class ExplorerTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        Profile.objects.create(user=self.alice)
+        self.bob = User.objects.create_user(username='bob', password='password')
+        Profile.objects.create(user=self.bob)
+
+    def play(self, ucis, result, finish=True):
+        fen, sans = get_initial_fen(), []
+        for uci in ucis:
+            fen, san, _ = make_move(fen, uci)
+            sans.append(san)
+        game = Game.objects.create(white_player=self.alice, black_player=self.bob, cadence='1+0',
+                                   status='active', fen=fen, pgn=' '.join(sans))
+        if finish:
+            finish_game(game, result)
+        else:
+            Game.objects.filter(id=game.id).update(status='finished', winner=self.alice if result == '1-0' else None)
+        return game
+
+    def test_finished_games_are_counted_and_transpositions_share_a_row(self):
+        self.play(['e2e3', 'b7b6', 'g1f3', 'c8a6'], '1-0')
+        self.play(['g1f3', 'b7b6', 'e2e3', 'c8a6'], '1/2-1/2')
+
+        start = {move['uci']: move for move in explore(chess.variant.AntichessBoard())}
+        self.assertEqual(start['e2e3'], {'uci': 'e2e3', 'san': 'e3', 'white_wins': 1, 'black_wins': 0,
+                                         'draws': 0, 'total': 1})
+        self.assertEqual(start['g1f3']['draws'], 1)
+
+        board = chess.variant.AntichessBoard()
+        for uci in ('e2e3', 'b7b6', 'g1f3'):
+            board.push_uci(uci)
+        self.assertEqual(explore(board), [{'uci': 'c8a6', 'san': 'Ba6', 'white_wins': 1, 'black_wins': 0,
+                                           'draws': 1, 'total': 2}])
+        self.assertLess(zobrist_key(board), 1 << 63)
+
+        response = self.client.get('/api/explorer/?moves=g1f3,b7b6,e2e3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total'], 2)
+        self.assertEqual(self.client.get('/api/explorer/?moves=e2e5').status_code, 400)
+
+    def test_finish_uses_positions_replayed_by_the_caller(self):
+        game = self.play(['e2e3', 'b7b5'], '1-0', finish=False)
+        Game.objects.filter(id=game.id).update(status='active', winner=None)
+        positions = game_positions(game.pgn)
+        with mock.patch('api.services.game_positions', side_effect=AssertionError('replayed on the DB thread')):
+            finish_game(game, '1-0', positions)
+        self.assertEqual(explore(chess.variant.AntichessBoard())[0]['white_wins'], 1)
+
+    def test_backfill_counts_each_game_once(self):
+        self.play(['e2e3', 'b7b5'], '1-0')
+        self.play(['e2e3', 'b7b5'], '1-0', finish=False)
+        self.play(['e2e3', 'e7e6'], '1/2-1/2', finish=False)
+
+        call_command('backfill_explorer', workers=1, chunk_size=1, stdout=io.StringIO())
+        call_command('backfill_explorer', workers=1, stdout=io.StringIO())
+        stat = PositionStat.objects.get(position_key=zobrist_key(chess.variant.AntichessBoard()), move='e2e3')
+        self.assertEqual((stat.white_wins, stat.black_wins, stat.draws), (2, 0, 1))
+        self.assertFalse(Game.objects.filter(in_explorer=False).exists())
+
+
+class AnalysisTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        Profile.objects.create(user=self.alice)
+        self.bob = User.objects.create_user(username='bob', password='password')
+        Profile.objects.create(user=self.bob)
+
+    def finished_game(self, pgn):
+        game = Game.objects.create(white_player=self.alice, black_player=self.bob, cadence='1+0',
+                                   status='active', pgn=pgn)
+        finish_game(game, '1-0')
+        return game
+
+    def test_every_move_is_scored_from_the_movers_side(self):
+        evaluations = analyse_game('e3 b5 Bxb5 c6 Bxc6 Nxc6', depth=2)
+        self.assertEqual([row['san'] for row in evaluations], ['e3', 'b5', 'Bxb5', 'c6', 'Bxc6', 'Nxc6'])
+        for row, following in zip(evaluations, evaluations[1:]):
+            self.assertEqual(row['played_score'], -following['best_score'])
+        for row in evaluations:
+            self.assertGreaterEqual(row['loss'], 0)
+            self.assertEqual(row['blunder'], row['loss'] >= 300)
+
+    def test_leases_make_jobs_resumable(self):
+        game = self.finished_game('e3 b5 Bxb5')
+        token, jobs = claim_jobs(10)
+        self.assertEqual([(job_id, game_id) for job_id, game_id, _ in jobs], [(game.analysis_job.id, game.id)])
+        self.assertEqual(claim_jobs(10)[1], [])
+
+        # The worker died; once the lease runs out another one takes over
+        AnalysisJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        new_token, jobs = claim_jobs(10)
+        self.assertEqual(len(jobs), 1)
+        evaluations = analyse_game(jobs[0][2], depth=1)
+        self.assertFalse(save_analysis(jobs[0][0], token, evaluations))
+        self.assertTrue(save_analysis(jobs[0][0], new_token, evaluations))
+        job = AnalysisJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('done', 2))
+        self.assertEqual(MoveEvaluation.objects.filter(game=game).count(), 3)
+
+    def test_worker_command_and_endpoint(self):
+        game = self.finished_game('e3 b5 Bxb5 c6')
+        self.assertEqual(self.client.get(f'/api/games/{game.id}/analysis/').json()['status'], 'queued')
+        call_command('analyse_games', once=True, workers=1, depth=1, stdout=io.StringIO())
+        response = self.client.get(f'/api/games/{game.id}/analysis/').json()
+        self.assertEqual(response['status'], 'done')
+        self.assertEqual([move['ply'] for move in response['moves']], [1, 2, 3, 4])
+        self.assertEqual(self.client.get('/api/games/999/analysis/').status_code, 404)
+
+
+class RatingsTests(TestCase):
+    def test_glicko2_matches_glickmans_example(self):
+        # A 1500/200 player beats a 1400/30 one, then loses to 1550/100 and 1700/300
+        white, black, score = np.array([0, 0, 0]), np.array([1, 2, 3]), np.array([1.0, 0.0, 0.0])
+        rating, rd, volatility = ratings.glicko2(
+            white, black, score, np.zeros(3, dtype=np.int64), 4,
+            initial=([1500, 1400, 1550, 1700], [200, 30, 100, 300], [0.06] * 4))
+        self.assertAlmostEqual(rating[0], 1464.06, places=1)
+        self.assertAlmostEqual(rd[0], 151.52, places=1)
+        self.assertAlmostEqual(volatility[0], 0.05999, places=4)
+
+    def test_command_replays_the_live_ratings(self):
+        alice = User.objects.create_user(username='alice', password='password')
+        bob = User.objects.create_user(username='bob', password='password')
+        Profile.objects.bulk_create([Profile(user=alice), Profile(user=bob)])
+        start = timezone.now() - timedelta(days=10)
+        for day, result in enumerate(['1-0', '1-0', '1/2-1/2', '1-0']):
+            game = Game.objects.create(white_player=alice, black_player=bob, cadence='1+0', status='active')
+            finish_game(game, result)
+            Game.objects.filter(id=game.id).update(finished_at=start + timedelta(days=day))
+        live = {row['user_id']: row for row in Profile.objects.values()}
+        Profile.objects.update(elo=1000, highest_elo=1000, games_played=0, wins=0, losses=0, draws=0)
+
+        # One game per period, so only the live per-game rounding differs
+        call_command('recompute_ratings', stdout=io.StringIO())
+        for profile in Profile.objects.all():
+            expected = live[profile.user_id]
+            self.assertLessEqual(abs(profile.elo - expected['elo']), 1)
+            self.assertLessEqual(abs(profile.highest_elo - expected['highest_elo']), 1)
+            self.assertEqual((profile.games_played, profile.wins, profile.losses, profile.draws),
+                             (4, 3, 0, 1) if profile.user_id == alice.id else (4, 0, 3, 1))
+            self.assertLess(profile.glicko_rd, ratings.GLICKO_RD)
+        alice_profile = Profile.objects.get(user=alice)
+        self.assertGreater(alice_profile.glicko_rating, Profile.objects.get(user=bob).glicko_rating)
+        self.assertEqual(leaderboard.rank(alice.id), 1)
+
+    def test_command_locks_profiles_before_reading_the_history(self):
+        alice = User.objects.create_user(username='alice', password='password')
+        Profile.objects.create(user=alice, elo=1700)
+        load = RecomputeRatings.load
+        seen = []
+
+        def load_after_reset(command, chunk_size):
+            # Profiles are already written (so locked) when the history is read
+            seen.append(Profile.objects.get(user=alice).elo)
+            return load(command, chunk_size)
+
+        with mock.patch.object(RecomputeRatings, 'load', load_after_reset):
+            call_command('recompute_ratings', stdout=io.StringIO())
+        self.assertEqual(seen, [ratings.ELO_START])
+
+
+class LifecycleTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        Profile.objects.create(user=self.alice)
+        self.bob = User.objects.create_user(username='bob', password='password')
+        Profile.objects.create(user=self.bob)
+
+    def game(self, moves=(), **fields):
+        fen, sans = get_initial_fen(), []
+        for uci in moves:
+            fen, san, _ = make_move(fen, uci)
+            sans.append(san)
+        return Game.objects.create(white_player=self.alice, black_player=self.bob, cadence='1+0', status='active',
+                                   fen=fen, pgn=' '.join(sans), **fields)
+
+    def test_reaper_aborts_unstarted_games_and_times_out_abandoned_ones(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        unstarted = self.game()
+        abandoned = self.game(['e2e3'], last_move_at=long_ago)
+        fresh = self.game()
+        leftover = Game.objects.create(white_player=self.alice, cadence='1+0')
+        Game.objects.filter(id__in=[unstarted.id, abandoned.id, leftover.id]).update(created_at=long_ago)
+
+        reaped = {game.id: (reason, result) for game, reason, result in reap()}
+        # Black never answered e3, so Black's flag fell
+        self.assertEqual(reaped, {unstarted.id: ('aborted', None), abandoned.id: ('abandoned', '1-0')})
+        self.assertEqual(dict(Game.objects.values_list('id', 'status')),
+                         {unstarted.id: 'aborted', abandoned.id: 'finished', fresh.id: 'active'})
+        # Only the abandoned game is rated
+        self.assertEqual(Profile.objects.get(user=self.alice).games_played, 1)
+        self.assertEqual(reap(), [])
+
+    def test_reap_game_skips_games_moved_since_they_were_found(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        unstarted, other = self.game(), self.game()
+        Game.objects.filter(id__in=[unstarted.id, other.id]).update(created_at=long_ago)
+        self.assertEqual(sorted(stale_games()), sorted([(unstarted.id, ''), (other.id, '')]))
+
+        Game.objects.filter(id=unstarted.id).update(pgn='e3', last_move_at=timezone.now())
+        self.assertIsNone(reap_game(unstarted.id))
+        game, reason, result = reap_game(other.id)
+        self.assertEqual((game.id, reason, result), (other.id, 'aborted', None))
+
+    def test_archived_games_keep_their_moves_and_analysis(self):
+        game = self.game(['e2e3', 'b7b5', 'f1b5', 'c7c6'])
+        finish_game(game, '1-0')
+        token, jobs = claim_jobs(1)
+        save_analysis(jobs[0][0], token, analyse_game(game.pgn, depth=1))
+        analysis = self.client.get(f'/api/games/{game.id}/analysis/').json()
+        self.assertTrue(abort_game(self.game()))
+
+        later = timezone.now() + timedelta(seconds=1)
+        self.assertEqual(archive_batch(later), 1)
+        self.assertEqual(delete_aborted(later), 1)
+        self.assertFalse(Game.objects.exists())
+        self.assertFalse(MoveEvaluation.objects.exists())
+        archived = ArchivedGame.objects.get()
+        self.assertEqual((archived.id, len(archived.moves)), (game.id, 8))
+
+        self.assertEqual(self.client.get(f'/api/games/{game.id}/analysis/').json()['moves'], analysis['moves'])
+        records = list(iter_pgn(export_queryset(archived=True), export_queryset()))
+        self.assertEqual(len(records), 1)
+        exported = chess.pgn.read_game(io.StringIO(records[0]))
+        self.assertEqual([move.uci() for move in exported.mainline_moves()], ['e2e3', 'b7b5', 'f1b5', 'c7c6'])
+
+
+class WireTests(TestCase):
+    def test_round_trip(self):
+        for uci in ('a1h8', 'e2e4', 'h7h8q', 'b2a1k', 'g7g8n'):
+            self.assertEqual(wire.decode_move(wire.encode_move(uci)), uci)
+        clock = {'white': 59000, 'black': 61000, 'turn': 'black', 'running': True}
+        update = {'type': 'move_applied', 'ply': 1, 'uci': 'e2e3', 'san': 'e3',
+                  'fen': 'rnbqkbnr/pppppppp/8/8/8/4P3/PPPP1PPP/RNBQKBNR b - - 0 1',
+                  'legal_moves': ['a7a6', 'b7b5'], 'status': 'active', 'result': None, 'winner': None, 'clock': clock}
+        self.assertEqual(wire.decode(wire.encode(update)), update)
+        self.assertEqual(wire.decode(wire.batch([wire.encode(update)] * 2)), {'type': 'batch', 'messages': [update] * 2})
+        self.assertEqual(wire.decode_command(wire.encode_command('join_game', last_ply=12)), ('join_game', {'last_ply': 12}))
+        with self.assertRaises(wire.WireError):
+            wire.decode(wire.encode(update)[:-3])
+
+
+class MetricsTests(TestCase):
+    def test_prometheus_text(self):
+        registry = Registry()
+        latency = registry.histogram('op_seconds', 'Op time', labels=('op',), buckets=(0.1, 1))
+        latency.observe(0.05, 'read')
+        latency.observe(0.5, 'read')
+        registry.counter('errors_total', 'Errors').inc()
+        registry.gauge('depth', 'Queue depth', function=lambda: 3)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP op_seconds Op time',
+            '# TYPE op_seconds histogram',
+            'op_seconds_bucket{op="read",le="0.1"} 1',
+            'op_seconds_bucket{op="read",le="1"} 2',
+            'op_seconds_bucket{op="read",le="+Inf"} 2',
+            'op_seconds_sum{op="read"} 0.55',
+            'op_seconds_count{op="read"} 2',
+            '# HELP errors_total Errors',
+            '# TYPE errors_total counter',
+            'errors_total 1',
+            '# HELP depth Queue depth',
+            '# TYPE depth gauge',
+            'depth 3',
+        ]) + '\n')
+
+    def test_endpoint_is_restricted(self):
+        self.assertEqual(self.client.get('/api/metrics/', REMOTE_ADDR='10.0.0.9').status_code, 403)
+        # Behind the proxy everything comes from the loopback address
+        self.assertEqual(self.client.get('/api/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        with self.settings(METRICS={'TOKEN': 'scrape', 'ALLOWED_IPS': []}):
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE antichess_active_games gauge', response.content.decode())
+
+    def test_profiler_samples_only_the_bound_room(self):
+        profiler = RoomProfiler(interval=0.001)
+
+        def spin(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+        def watched():
+            spin(0.1)
+
+        def unwatched():
+            spin(0.1)
+
+        async def room(name, work):
+            profiler.bind(name)
+            work()
+
+        async def scenario():
+            await asyncio.gather(room('1', watched), room('2', unwatched))
+
+        profiler.start('1')
+        async_to_sync(scenario)()
+        report = profiler.stop('1')
+        self.assertGreater(report['samples'], 10)
+        self.assertIn('watched (tests.py', report['stacks'])
+        self.assertNotIn('unwatched', report['stacks'])
+        self.assertIsNone(profiler.report('1'))
+
+
+class LeaderboardTests(TestCase):
+    def test_matches_sorting_under_random_updates(self):
+        rng = random.Random(3)
+        board = Leaderboard(min_elo=0, max_elo=3000)
+        elos = {user_id: rng.randrange(800, 2400) for user_id in range(300)}
+        board.load(elos.items())
+        for _ in range(500):
+            user_id = rng.randrange(320)
+            if rng.random() < 0.1:
+                board.remove(user_id)
+                elos.pop(user_id, None)
+            else:
+                elos[user_id] = rng.randrange(800, 2400)
+                board.update(user_id, elos[user_id])
+
+        ordered = sorted(elos.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual([(user_id, elo) for _, user_id, elo in board.page(0, len(ordered))], ordered)
+        self.assertEqual([user_id for _, user_id, _ in board.page(37, 10)], [u for u, _ in ordered[37:47]])
+        for position, (user_id, elo) in enumerate(ordered):
+            self.assertEqual(board.position(user_id), position)
+            self.assertEqual(board.rank(user_id), 1 + sum(1 for other in elos.values() if other > elo))
+
+        user_id = ordered[100][0]
+        self.assertEqual([u for _, u, _ in board.around(user_id, radius=2)], [u for u, _ in ordered[98:103]])
+        self.assertEqual(len(board.around(ordered[0][0], radius=2)), 3)
+
+    def test_finished_games_update_ranks_and_endpoints(self):
+        users = []
+        for name, elo in (('alice', 1520), ('bob', 1500), ('carol', 1490)):
+            user = User.objects.create_user(username=name, password='password')
+            Profile.objects.create(user=user, elo=elo)
+            users.append(user)
+        alice, bob, carol = users
+        rebuild_leaderboard()
+        self.assertEqual([leaderboard.rank(user.id) for user in users], [1, 2, 3])
+
+        game = Game.objects.create(white_player=carol, black_player=alice, cadence='1+0', status='active')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(finish_game(game, '1-0'), (1512, 1498))
+        self.assertEqual([leaderboard.rank(user.id) for user in users], [3, 2, 1])
+
+        response = self.client.get('/api/leaderboard/?limit=2')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual([row['username'] for row in response.json()['results']], ['carol', 'bob'])
+
+        self.client.force_login(alice)
+        response = self.client.get('/api/leaderboard/me/?radius=1')
+        self.assertEqual(response.json()['rank'], 3)
+        self.assertEqual([row['username'] for row in response.json()['results']], ['bob', 'alice'])
+
+
+class WhoAmIConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+        await self.send(text_data=json.dumps({'user': self.scope['user'].id}))
+
+
+class CachedAuthTests(TransactionTestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='player1', password='password')
+        Profile.objects.create(user=self.user)
+        self.client.post('/api/login/', {'username': 'player1', 'password': 'password'})
+        self.cookie = f'sessionid={self.client.session.session_key}'.encode()
+
+    def connect_many(self, count):
+        async def scenario():
+            async def one():
+                communicator = WebsocketCommunicator(
+                    CachedAuthMiddlewareStack(WhoAmIConsumer.as_asgi()), '/ws/', headers=[(b'cookie', self.cookie)]
+                )
+                await communicator.connect()
+                user = (await communicator.receive_json_from(timeout=5))['user']
+                await communicator.disconnect()
+                return user
+            return await asyncio.gather(*(one() for _ in range(count)))
+
+        with mock.patch('api.auth.get_user', wraps=channels_get_user) as lookup:
+            users = async_to_sync(scenario)()
+        return users, lookup.call_count
+
+    def test_connect_storm_resolves_session_once(self):
+        self.assertEqual(self.connect_many(10), ([self.user.id] * 10, 1))
+        self.assertEqual(self.connect_many(3), ([self.user.id] * 3, 0))
+
+    def test_logout_and_password_change_invalidate(self):
+        self.connect_many(1)
+        self.client.post('/api/logout/')
+        self.assertEqual(self.connect_many(1), ([None], 1))
+
+        self.client.post('/api/login/', {'username': 'player1', 'password': 'password'})
+        self.cookie = f'sessionid={self.client.session.session_key}'.encode()
+        self.connect_many(1)
+        self.user.set_password('changed')
+        self.user.save()
+        # The session's auth hash no longer matches the new password
+        self.assertEqual(self.connect_many(1), ([None], 1))
+
+
+class GameHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.carol = User.objects.create_user(username='carol', password='password')
+        now = timezone.now()
+        pairings = [
+            (self.alice, self.bob, self.alice), (self.bob, self.alice, None), (self.carol, self.bob, self.carol),
+            (self.alice, self.carol, self.carol), (self.carol, self.alice, self.alice), (self.bob, self.carol, self.bob),
+        ]
+        self.games = []
+        for i, (white, black, winner) in enumerate(pairings):
+            # Two games share a finish time, so the id breaks the tie
+            finished_at = now - timedelta(minutes=min(i, 4))
+            self.games.append(Game.objects.create(white_player=white, black_player=black, winner=winner,
+                                                  cadence='1+0' if i % 2 else '3+0', status='finished',
+                                                  finished_at=finished_at))
+        Game.objects.create(white_player=self.alice, black_player=self.bob, cadence='1+0', status='active')
+
+    def fetch_all(self, query, limit=2):
+        ids, cursor = [], None
+        while True:
+            url = f'/api/games/?{query}&limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url).json()
+            ids += [game['id'] for game in page['results']]
+            cursor = page['next']
+            if cursor is None:
+                return ids
+
+    def newest_first(self, games):
+        return [g.id for g in sorted(games, key=lambda g: (g.finished_at, g.id), reverse=True)]
+
+    def test_keyset_pages_cover_history_in_order(self):
+        self.assertEqual(self.fetch_all('player=alice'),
+                         self.newest_first([g for g in self.games if self.alice.id in (g.white_player_id, g.black_player_id)]))
+        self.assertEqual(self.fetch_all('cadence=3%2B0', limit=1), self.newest_first(self.games[::2]))
+        self.assertEqual(self.fetch_all('', limit=4), self.newest_first(self.games))
+
+    def test_result_filters_and_shape(self):
+        self.assertEqual(self.fetch_all('player=alice&result=win'), self.newest_first([self.games[0], self.games[4]]))
+        self.assertEqual(self.fetch_all('player=alice&result=loss'), [self.games[3].id])
+        self.assertEqual(self.fetch_all('player=alice&result=draw'), [self.games[1].id])
+        game = self.client.get('/api/games/?player=carol&limit=1').json()['results'][0]
+        self.assertEqual(game['result'], '1-0')
+        self.assertEqual((game['white']['username'], game['black']['username']), ('carol', 'bob'))
+
+    def test_archived_games_stay_in_history(self):
+        by_alice = self.fetch_all('player=alice')
+        Game.objects.filter(status='finished').update(in_explorer=True)
+        # The three games that finished 3 and 4 minutes ago
+        self.assertEqual(archive_batch(timezone.now() - timedelta(minutes=2, seconds=30)), 3)
+        self.assertEqual(ArchivedGame.objects.count(), 3)
+        self.assertEqual(self.fetch_all('player=alice'), by_alice)
+        self.assertEqual(self.fetch_all('', limit=4), self.newest_first(self.games))
+        self.assertEqual(self.fetch_all('player=alice&result=win'), self.newest_first([self.games[0], self.games[4]]))
+
+    def test_query_count_and_errors(self):
+        # One scan per colour in each of the live and archive tables, plus the username
+        with self.assertNumQueries(5):
+            self.client.get('/api/games/?player=alice&limit=2')
+        with self.assertNumQueries(2):
+            self.client.get('/api/games/?limit=2')
+        self.assertEqual(self.client.get('/api/games/?cursor=nonsense').status_code, 400)
+        self.assertEqual(self.client.get('/api/games/?result=win').status_code, 400)
+        self.assertEqual(self.client.get('/api/games/?player=nobody').status_code, 404)
@@ -1,5 +1,9 @@
 from django.urls import path
-from .views import RegisterView, LoginView, LogoutView, CurrentUserView, ProfileUpdateView
+from .views import (
+    RegisterView, LoginView, LogoutView, CurrentUserView, ProfileUpdateView,
+    ExplorerView, GameAnalysisView, GameExportView, GameHistoryView, LeaderboardView, MyRankView,
+    MetricsView, RoomProfileView, TournamentListView, TournamentView,
+)
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
@@ -7,4 +11,14 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('user/', CurrentUserView.as_view(), name='current_user'),
     path('profile/update/', ProfileUpdateView.as_view(), name='profile_update'),
+    path('games/', GameHistoryView.as_view(), name='game_history'),
+    path('games/export.pgn', GameExportView.as_view(), name='game_export'),
+    path('games/<int:game_id>/analysis/', GameAnalysisView.as_view(), name='game_analysis'),
+    path('explorer/', ExplorerView.as_view(), name='explorer'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/me/', MyRankView.as_view(), name='leaderboard_me'),
+    path('tournaments/', TournamentListView.as_view(), name='tournaments'),
+    path('tournaments/<int:tournament_id>/', TournamentView.as_view(), name='tournament'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/profile/<int:game_id>/', RoomProfileView.as_view(), name='room_profile'),
 ]
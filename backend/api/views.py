@@ -1,8 +1,25 @@
+import hmac
+from datetime import timedelta
+
+import chess
+import chess.variant
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import generics, status, views, permissions
 from rest_framework.response import Response
 from .serializers import UserSerializer, ProfileSerializer
-from .models import Profile
+from .models import AnalysisJob, ArchivedGame, CustomUser, Game, Profile, Tournament
+from .analysis import game_analysis
+from .explorer import explore
+from .history import RESULTS, game_history
+from .archive import unpack_evaluations, unpack_moves
+from .metrics import registry
+from .pgn import aiter_pgn, export_queryset
+from .profiler import profiler
+from .services import current_leaderboard, leaderboard_entries, tournament_standings
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
@@ -36,3 +53,256 @@ class ProfileUpdateView(generics.UpdateAPIView):
 
     def get_object(self):
         return self.request.user.profile
+
+class GameExportView(views.APIView):
+    """Finished games as one PGN file, streamed as it is read from the database."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        filters = {}
+        for name in ('since', 'until'):
+            value = request.query_params.get(name)
+            if value:
+                filters[name] = parse_date(value)
+                if filters[name] is None:
+                    return Response({'error': f'{name} must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        cadence = request.query_params.get('cadence')
+        if cadence and cadence not in dict(Game.CADENCE_CHOICES):
+            return Response({'error': 'Unknown cadence'}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters.update(cadence=cadence, player=request.query_params.get('player'))
+        games = (export_queryset(archived=True, **filters), export_queryset(**filters))
+        response = StreamingHttpResponse(aiter_pgn(*games), content_type='application/x-chess-pgn')
+        response['Content-Disposition'] = 'attachment; filename="games.pgn"'
+        return response
+
+
+class GameAnalysisView(views.APIView):
+    """Post-game engine evaluation of every move, once the analysis job has run."""
+    def get(self, request, game_id):
+        job = AnalysisJob.objects.filter(game_id=game_id).values('status', 'finished_at').first()
+        if job is None:
+            if Game.objects.filter(id=game_id).exists():
+                return Response({'status': None, 'moves': []})
+            archived = ArchivedGame.objects.filter(id=game_id).values('moves', 'evaluations').first()
+            if archived is None:
+                return Response({'error': 'Unknown game'}, status=status.HTTP_404_NOT_FOUND)
+            if archived['evaluations'] is None:
+                return Response({'status': None, 'moves': []})
+            job = {'status': 'done', 'finished_at': None}
+            moves = unpack_evaluations(archived['evaluations'], unpack_moves(archived['moves']))
+        else:
+            moves = game_analysis(game_id) if job['status'] == 'done' else []
+        return Response({
+            'status': job['status'],
+            'finished_at': job['finished_at'],
+            # Odd plies are White's moves
+            'blunders': {
+                'white': sum(1 for move in moves if move['blunder'] and move['ply'] % 2),
+                'black': sum(1 for move in moves if move['blunder'] and not move['ply'] % 2),
+            },
+            'moves': moves,
+        })
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        return max(0, min(maximum, int(request.query_params.get(name, default))))
+    except ValueError:
+        return default
+
+
+class LeaderboardView(views.APIView):
+    """Top players by Elo, paginated with offset/limit."""
+    def get(self, request):
+        board = current_leaderboard()
+        offset = _int_param(request, 'offset', 0, len(board))
+        limit = _int_param(request, 'limit', 50, 100)
+        return Response({
+            'count': len(board),
+            'offset': offset,
+            'results': leaderboard_entries(board.page(offset, limit)),
+        })
+
+
+class MyRankView(views.APIView):
+    """The current user's rank with the players just above and below."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        board = current_leaderboard()
+        radius = _int_param(request, 'radius', 5, 25)
+        return Response({
+            'count': len(board),
+            'rank': board.rank(request.user.id),
+            'results': leaderboard_entries(board.around(request.user.id, radius)),
+        })
+
+
+class GameHistoryView(views.APIView):
+    """
+    Finished games, newest first, optionally for one player (?player=<username>)
+    and filtered by cadence and result. Follow `next` for the following page.
+    """
+    def get(self, request):
+        params = request.query_params
+        cadence = params.get('cadence')
+        if cadence and cadence not in dict(Game.CADENCE_CHOICES):
+            return Response({'error': 'Unknown cadence'}, status=status.HTTP_400_BAD_REQUEST)
+        result = params.get('result')
+        if result and result not in RESULTS:
+            return Response({'error': f"result must be one of {', '.join(RESULTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        player_id = None
+        if params.get('player'):
+            player_id = CustomUser.objects.filter(username=params['player']).values_list('id', flat=True).first()
+            if player_id is None:
+                return Response({'error': 'Unknown player'}, status=status.HTTP_404_NOT_FOUND)
+        elif result in ('win', 'loss'):
+            return Response({'error': 'result=win/loss needs a player'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            games, next_cursor = game_history(player_id, cadence, result, params.get('cursor'),
+                                              limit=_int_param(request, 'limit', 20, 100) or 20)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': games, 'next': next_cursor})
+
+
+class ExplorerView(views.APIView):
+    """
+    Moves played from a position (?fen=, defaulting to the start) with how
+    each scored. ?moves=<uci,uci,...> is played from that position first.
+    """
+    def get(self, request):
+        try:
+            board = chess.variant.AntichessBoard(request.query_params.get('fen') or chess.variant.AntichessBoard.starting_fen)
+            for uci in filter(None, request.query_params.get('moves', '').split(',')):
+                board.push_uci(uci)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        moves = explore(board)
+        return Response({'fen': board.fen(), 'total': sum(move['total'] for move in moves), 'moves': moves})
+
+
+def _tournament_data(tournament, now):
+    return {
+        'id': tournament.id,
+        'name': tournament.name,
+        'cadence': tournament.cadence,
+        'starts_at': tournament.starts_at,
+        'ends_at': tournament.ends_at,
+        'state': tournament.state(now),
+    }
+
+
+class TournamentListView(views.APIView):
+    """
+    GET: arenas that are upcoming or running, soonest first. POST (staff):
+    create one from name, cadence, minutes and an optional starts_at (default now).
+    """
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return [permissions.IsAdminUser()]
+        return super().get_permissions()
+
+    def get(self, request):
+        now = timezone.now()
+        tournaments = Tournament.objects.filter(ends_at__gt=now).order_by('starts_at', 'id')[:100]
+        return Response({'results': [_tournament_data(tournament, now) for tournament in tournaments]})
+
+    def post(self, request):
+        cadence = request.data.get('cadence')
+        if cadence not in dict(Game.CADENCE_CHOICES):
+            return Response({'error': 'Unknown cadence'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            minutes = int(request.data.get('minutes', 0))
+        except (TypeError, ValueError):
+            minutes = 0
+        if minutes <= 0:
+            return Response({'error': 'minutes must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        now = timezone.now()
+        starts_at = now
+        if request.data.get('starts_at'):
+            starts_at = parse_datetime(str(request.data['starts_at']))
+            if starts_at is None:
+                return Response({'error': 'starts_at must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(starts_at):
+                starts_at = timezone.make_aware(starts_at)
+        tournament = Tournament.objects.create(
+            name=request.data.get('name') or f'{cadence} arena', cadence=cadence,
+            starts_at=starts_at, ends_at=starts_at + timedelta(minutes=minutes),
+        )
+        return Response(_tournament_data(tournament, now), status=status.HTTP_201_CREATED)
+
+
+class TournamentView(views.APIView):
+    """One arena with its standings, paginated with offset/limit."""
+    def get(self, request, tournament_id):
+        tournament = Tournament.objects.filter(id=tournament_id).first()
+        if tournament is None:
+            return Response({'error': 'Unknown tournament'}, status=status.HTTP_404_NOT_FOUND)
+        count = tournament.players.count()
+        offset = _int_param(request, 'offset', 0, count)
+        limit = _int_param(request, 'limit', 50, 100)
+        return Response({
+            **_tournament_data(tournament, timezone.now()),
+            'count': count,
+            'offset': offset,
+            'standings': tournament_standings(tournament.id, offset, limit),
+        })
+
+
+class IsMetricsScraper(permissions.BasePermission):
+    """
+    Staff, a request with 'Authorization: Bearer <METRICS['TOKEN']>', or one from
+    METRICS['ALLOWED_IPS']. Both are unset by default: behind the reverse proxy
+    every request comes from the loopback address.
+    """
+    def has_permission(self, request, view):
+        if request.user.is_staff:
+            return True
+        config = getattr(settings, 'METRICS', {})
+        token = config.get('TOKEN')
+        if token and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return True
+        return request.META.get('REMOTE_ADDR') in config.get('ALLOWED_IPS', ())
+
+
+class MetricsView(views.APIView):
+    """This process's metrics in the Prometheus text format."""
+    permission_classes = [IsMetricsScraper]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RoomProfileView(views.APIView):
+    """
+    Sampling profiler for one game room in this process. POST starts it
+    (?seconds= to stop sampling on its own), GET returns the stacks so far and
+    DELETE stops it and returns them. ?format=collapsed returns the stacks as
+    text for flamegraph tools.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, game_id):
+        try:
+            seconds = float(request.query_params['seconds']) if 'seconds' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'seconds must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        profiler.start(str(game_id), seconds)
+        return Response({'profiling': profiler.profiling()}, status=status.HTTP_201_CREATED)
+
+    def get(self, request, game_id):
+        return self._respond(request, profiler.report(str(game_id)))
+
+    def delete(self, request, game_id):
+        return self._respond(request, profiler.stop(str(game_id)))
+
+    def _respond(self, request, report):
+        if report is None:
+            return Response({'error': 'This room is not being profiled'}, status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('format') == 'collapsed':
+            return HttpResponse(report['stacks'], content_type='text/plain; charset=utf-8')
+        return Response(report)
@@ -0,0 +1,251 @@
+"""
+Compact binary encoding of the game and matchmaking socket messages.
+
+Clients opt in by offering the SUBPROTOCOL WebSocket subprotocol; everyone
+else keeps getting JSON. encode() takes the same message dicts that are sent
+as JSON and returns one binary frame; decode() is its inverse (used by the
+tests and bench_wire, and the reference for client implementations).
+
+All integers are big-endian. A frame starts with a one-byte type:
+
+    1 game_state     u32 id, u32 white id, u32 black id, u32 winner id,
+                     u8 status, str8 cadence, u16 ply, str8 fen, str16 pgn,
+                     moves, clock
+    2 move_applied   u16 ply, move, str8 san, str8 fen, moves, u8 status,
+                     u8 result, u32 winner id, clock
+    3 game_finished  u8 status, u8 result, u32 winner id, str8 reason, clock
+    4 error          str16 message
+    5 batch          u16 count, then count x (u16 length, frame)
+    6 resumed        u16 ply, clock, then frames as in batch
+    7 game_found     u32 game id, u8 colour (0 white, 1 black)
+
+A move is a u16: from square | to square << 6 | promotion << 12, squares
+numbered a1=0 .. h8=63 and promotion 0 (none), 1 knight .. 5 king. "moves" is
+a u8 count followed by that many moves. A clock is a u8 of flags (1 present,
+2 black to move, 4 running) followed, if present, by u32 white and black
+milliseconds. Player ids of 0 mean nobody; strN is a uN byte length and UTF-8.
+
+Clients send commands as frames too: 0x81 make_move (move), 0x82 join_game
+(optionally u16 last ply) and 0x83 get_state.
+"""
+import struct
+
+SUBPROTOCOL = 'antichess.bin.v1'
+
+GAME_STATE, MOVE_APPLIED, GAME_FINISHED, ERROR, BATCH, RESUMED, GAME_FOUND = range(1, 8)
+MAKE_MOVE, JOIN_GAME, GET_STATE = 0x81, 0x82, 0x83
+
+STATUSES = ('waiting', 'active', 'finished', 'aborted')
+RESULTS = (None, '1-0', '0-1', '1/2-1/2')
+PROMOTIONS = ' nbrqk'
+COLOURS = ('white', 'black')
+
+_u8 = struct.Struct('>B')
+_u16 = struct.Struct('>H')
+_u32 = struct.Struct('>I')
+_clock = struct.Struct('>BII')
+
+
+class WireError(ValueError):
+    """A frame that can't be decoded."""
+    pass
+
+
+# Moves
+
+def encode_move(uci):
+    value = (ord(uci[0]) - 97) + (ord(uci[1]) - 49) * 8
+    value |= ((ord(uci[2]) - 97) + (ord(uci[3]) - 49) * 8) << 6
+    if len(uci) > 4:
+        value |= PROMOTIONS.index(uci[4]) << 12
+    return value
+
+
+def decode_move(value):
+    src, dst, promotion = value & 63, (value >> 6) & 63, value >> 12
+    uci = f'{chr(97 + src % 8)}{src // 8 + 1}{chr(97 + dst % 8)}{dst // 8 + 1}'
+    return uci + PROMOTIONS[promotion] if promotion else uci
+
+
+def _moves(ucis):
+    return _u8.pack(len(ucis)) + struct.pack(f'>{len(ucis)}H', *map(encode_move, ucis))
+
+
+def _str8(value):
+    data = (value or '').encode()
+    return _u8.pack(len(data)) + data
+
+
+def _str16(value):
+    data = (value or '').encode()
+    return _u16.pack(len(data)) + data
+
+
+def _id(value):
+    if isinstance(value, dict):
+        value = value.get('id')
+    return _u32.pack(value or 0)
+
+
+def _clock_bytes(clock):
+    if not clock:
+        return b'\x00'
+    flags = 1 | (2 if clock['turn'] == 'black' else 0) | (4 if clock['running'] else 0)
+    return _clock.pack(flags, clock['white'], clock['black'])
+
+
+def _frames(frames):
+    return _u16.pack(len(frames)) + b''.join(_u16.pack(len(frame)) + frame for frame in frames)
+
+
+# Encoding
+
+def encode(message):
+    """One binary frame for a message dict (as sent in JSON)."""
+    kind = message['type']
+    if kind == 'move_applied':
+        return b''.join((
+            _u8.pack(MOVE_APPLIED), _u16.pack(message['ply']), _u16.pack(encode_move(message['uci'])),
+            _str8(message['san']), _str8(message['fen']), _moves(message['legal_moves']),
+            _u8.pack(STATUSES.index(message['status'])), _u8.pack(RESULTS.index(message['result'])),
+            _id(message['winner']), _clock_bytes(message.get('clock')),
+        ))
+    if kind == 'game_state':
+        game = message['game']
+        return b''.join((
+            _u8.pack(GAME_STATE), _id(game['id']), _id(game['white_player']), _id(game['black_player']),
+            _id(game['winner']), _u8.pack(STATUSES.index(game['status'])), _str8(game['cadence']),
+            _u16.pack(game['ply']), _str8(game['fen']), _str16(game['pgn']),
+            _moves(game['legal_moves']), _clock_bytes(game.get('clock')),
+        ))
+    if kind == 'game_finished':
+        return b''.join((
+            _u8.pack(GAME_FINISHED), _u8.pack(STATUSES.index(message['status'])),
+            _u8.pack(RESULTS.index(message['result'])), _id(message['winner']),
+            _str8(message.get('reason')), _clock_bytes(message.get('clock')),
+        ))
+    if kind == 'error':
+        return _u8.pack(ERROR) + _str16(message['message'])
+    if kind == 'game_found':
+        return _u8.pack(GAME_FOUND) + _id(message['game_id']) + _u8.pack(COLOURS.index(message['color']))
+    raise ValueError(f'No binary encoding for {kind!r} messages')
+
+
+def batch(frames):
+    """Several encoded frames as one."""
+    return _u8.pack(BATCH) + _frames(frames)
+
+
+def resumed(ply, clock, frames):
+    return _u8.pack(RESUMED) + _u16.pack(ply) + _clock_bytes(clock) + _frames(frames)
+
+
+# Decoding
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise WireError('Truncated frame')
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))[0]
+
+    def u8(self):
+        return self.unpack(_u8)
+
+    def u16(self):
+        return self.unpack(_u16)
+
+    def u32(self):
+        return self.unpack(_u32)
+
+    def str8(self):
+        return self.take(self.u8()).decode()
+
+    def str16(self):
+        return self.take(self.u16()).decode()
+
+    def moves(self):
+        count = self.u8()
+        return [decode_move(value) for value in struct.unpack(f'>{count}H', self.take(count * 2))]
+
+    def clock(self):
+        flags = self.u8()
+        if not flags & 1:
+            return None
+        white, black = struct.unpack('>II', self.take(8))
+        return {'white': white, 'black': black, 'turn': 'black' if flags & 2 else 'white', 'running': bool(flags & 4)}
+
+    def frames(self):
+        return [decode(self.take(self.u16())) for _ in range(self.u16())]
+
+    def done(self):
+        return self.pos == len(self.data)
+
+
+def decode(data):
+    """The message dict for a server frame; players are ids."""
+    r = _Reader(data)
+    kind = r.u8()
+    if kind == MOVE_APPLIED:
+        return {
+            'type': 'move_applied', 'ply': r.u16(), 'uci': decode_move(r.u16()), 'san': r.str8(), 'fen': r.str8(),
+            'legal_moves': r.moves(), 'status': STATUSES[r.u8()], 'result': RESULTS[r.u8()],
+            'winner': r.u32() or None, 'clock': r.clock(),
+        }
+    if kind == GAME_STATE:
+        game = {
+            'id': r.u32(), 'white_player': r.u32() or None, 'black_player': r.u32() or None,
+            'winner': r.u32() or None, 'status': STATUSES[r.u8()], 'cadence': r.str8(), 'ply': r.u16(),
+            'fen': r.str8(), 'pgn': r.str16(), 'legal_moves': r.moves(), 'clock': r.clock(),
+        }
+        return {'type': 'game_state', 'game': game}
+    if kind == GAME_FINISHED:
+        return {
+            'type': 'game_finished', 'status': STATUSES[r.u8()], 'result': RESULTS[r.u8()],
+            'winner': r.u32() or None, 'reason': r.str8() or None, 'clock': r.clock(),
+        }
+    if kind == ERROR:
+        return {'type': 'error', 'message': r.str16()}
+    if kind == BATCH:
+        return {'type': 'batch', 'messages': r.frames()}
+    if kind == RESUMED:
+        return {'type': 'resumed', 'ply': r.u16(), 'clock': r.clock(), 'messages': r.frames()}
+    if kind == GAME_FOUND:
+        return {'type': 'game_found', 'game_id': r.u32(), 'color': COLOURS[r.u8()]}
+    raise WireError(f'Unknown frame type {kind}')
+
+
+def decode_command(data):
+    """(command, data) for a client frame, shaped like the JSON commands."""
+    try:
+        r = _Reader(data)
+        kind = r.u8()
+        if kind == MAKE_MOVE:
+            return 'make_move', {'move': decode_move(r.u16())}
+        if kind == JOIN_GAME:
+            return 'join_game', ({} if r.done() else {'last_ply': r.u16()})
+        if kind == GET_STATE:
+            return 'get_state', {}
+    except (IndexError, UnicodeError) as e:
+        raise WireError(str(e)) from e
+    raise WireError(f'Unknown command type {kind}')
+
+
+def encode_command(command, **data):
+    """A client frame; the counterpart of decode_command."""
+    if command == 'make_move':
+        return _u8.pack(MAKE_MOVE) + _u16.pack(encode_move(data['move']))
+    if command == 'join_game':
+        last_ply = data.get('last_ply')
+        return _u8.pack(JOIN_GAME) + (b'' if last_ply is None else _u16.pack(last_ply))
+    if command == 'get_state':
+        return _u8.pack(GET_STATE)
+    raise ValueError(f'Unknown command {command!r}')
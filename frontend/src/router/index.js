@@ -33,8 +33,7 @@ const router = createRouter({
     {
       path: '/game/:id',
       name: 'game',
-      component: GameView,
-      meta: { requiresAuth: true }
+      component: GameView
     }
   ]
 })
@@ -5,13 +5,20 @@ export const useGameStore = defineStore('game', {
         currentGame: null,
         socket: null,
         isConnected: false,
+        reconnectTimer: null,
+        reconnectDelay: 1000,
         error: null
     }),
     actions: {
         connect(gameId) {
             if (this.socket) {
+                this.socket.onclose = null
                 this.socket.close()
             }
+            clearTimeout(this.reconnectTimer)
+            if (this.currentGame && String(this.currentGame.id) !== String(gameId)) {
+                this.currentGame = null
+            }
 
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
             wsUrl = `${protocol}//${window.location.host}/ws/game/${gameId}/`
@@ -20,25 +27,69 @@ export const useGameStore = defineStore('game', {
 
             this.socket.onopen = () => {
                 this.isConnected = true
+                this.reconnectDelay = 1000
                 console.log("Connected to game socket")
-                this.socket.send(JSON.stringify({ command: 'join_game' }))
+                // After a drop, ask only for the moves we missed
+                const join = { command: 'join_game' }
+                if (this.currentGame) {
+                    join.last_ply = this.currentGame.ply
+                }
+                this.socket.send(JSON.stringify(join))
             }
 
             this.socket.onmessage = (event) => {
-                const data = JSON.parse(event.data)
-                if (data.type === 'game_state' || data.type === 'game_update') {
-                    this.currentGame = data.game
-                } else if (data.type === 'error') {
-                    console.error("Game error:", data.message)
-                    this.error = data.message
-                    setTimeout(() => this.error = null, 3000)
-                }
+                this.handleMessage(JSON.parse(event.data))
             }
 
             this.socket.onclose = () => {
                 this.isConnected = false
-                this.currentGame = null
+                // Keep the board and reconnect; the server replays missed moves
+                this.reconnectTimer = setTimeout(() => this.connect(gameId), this.reconnectDelay)
+                this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000)
+            }
+        },
+        handleMessage(data) {
+            if (data.type === 'batch') {
+                // Spectators get several updates per frame
+                data.messages.forEach((message) => this.handleMessage(message))
+            } else if (data.type === 'resumed') {
+                data.messages.forEach((message) => this.handleMessage(message))
+                if (this.currentGame && data.clock) {
+                    this.currentGame.clock = data.clock
+                }
+            } else if (data.type === 'game_state') {
+                this.currentGame = data.game
+            } else if (data.type === 'move_applied') {
+                this.applyMove(data)
+            } else if (data.type === 'game_finished' && this.currentGame) {
+                this.currentGame.status = data.status
+                this.currentGame.winner = data.winner
+                this.currentGame.legal_moves = []
+                this.currentGame.clock = data.clock
+            } else if (data.type === 'error') {
+                console.error("Game error:", data.message)
+                this.error = data.message
+                setTimeout(() => this.error = null, 3000)
+            }
+        },
+        applyMove(move) {
+            const game = this.currentGame
+            if (game && move.ply <= game.ply) {
+                // Already have it (replayed on reconnect and broadcast live)
+                return
+            }
+            if (!game || move.ply !== game.ply + 1) {
+                // Missed a move (or no state yet): resync with a full snapshot
+                this.socket.send(JSON.stringify({ command: 'get_state' }))
+                return
             }
+            game.ply = move.ply
+            game.fen = move.fen
+            game.pgn = game.pgn ? `${game.pgn} ${move.san}` : move.san
+            game.legal_moves = move.legal_moves
+            game.status = move.status
+            game.winner = move.winner
+            game.clock = move.clock
         },
         sendMove(moveUci) {
             if (this.socket && this.isConnected) {
@@ -49,9 +100,14 @@ export const useGameStore = defineStore('game', {
             }
         },
         disconnect() {
+            clearTimeout(this.reconnectTimer)
             if (this.socket) {
+                this.socket.onclose = null
                 this.socket.close()
+                this.socket = null
             }
+            this.isConnected = false
+            this.currentGame = null
         }
     }
 })